@@ -5,6 +5,7 @@ import os
 import re
 import sys
 import types
+import inspect
 import warnings
 from gettext import gettext as _
 from collections import OrderedDict
@@ -15,11 +16,18 @@ from flask import Flask
 from flask._compat import text_type
 
 from ._compat import iteritems
-from .commands import Group, Option, Command, Server, Shell
+from .commands import Group, Option, Command, Server, Shell, InvalidCommand, lazy, lazy_import
 from .cli import prompt, prompt_pass, prompt_bool, prompt_choices
+from .output import FORMATTERS, write_records, read_records
+from .lock import CommandLock, lock_path
+from .cache import ResultCache, cache_key, run_cached
+from .incremental import build_for, run_and_record
+from .limits import Limits, LimitExceeded, parse_size
+from .fanout import expand_configs, for_each_config
 
 __all__ = ["Command", "Shell", "Server", "Manager", "Group", "Option",
-           "prompt", "prompt_pass", "prompt_bool", "prompt_choices"]
+           "prompt", "prompt_pass", "prompt_bool", "prompt_choices",
+           "lazy", "lazy_import"]
 
 safe_actions = (argparse._StoreAction,
                 argparse._StoreConstAction,
@@ -42,6 +50,33 @@ def add_help(parser, help_args):
     parser.add_argument(*help_args,
                         action='help', default=argparse.SUPPRESS, help=_('show this help message and exit'))
 
+def _release_after(records, lock):
+    try:
+        for record in records:
+            yield record
+    finally:
+        lock.release()
+
+
+def _yields_records(command):
+    yields_records = getattr(command, 'yields_records', None)
+    if yields_records is not None:
+        return yields_records
+    return getattr(command, 'output_fields', None) is not None or \
+        inspect.isgeneratorfunction(getattr(command, 'run', None))
+
+
+def _freeze(value):
+    """
+    Returns a hashable equivalent of an option value.
+    """
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in iteritems(value)))
+    if isinstance(value, (list, tuple, set)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
 class Manager(object):
     """
     Controller class for handling a set of commands.
@@ -70,14 +105,27 @@ class Manager(object):
     :param with_default_commands: load commands **runserver** and **shell**
                                   by default.
     :param disable_argcomplete: disable automatic loading of argcomplete.
+    :param app_cache_size: number of apps built by the factory to keep for
+                           later commands with the same option values,
+                           e.g. when handling many commands in one
+                           process; 0 builds a new app every time.
 
     """
     help_args = ('-?','--help')
 
+    #: destination of the manager option which ``--for-each-config`` sets
+    #: to each configuration, see :mod:`flask_script.fanout`
+    config_option = 'config'
+
     def __init__(self, app=None, with_default_commands=None, usage=None,
-                 help=None, description=None, disable_argcomplete=False):
+                 help=None, description=None, disable_argcomplete=False,
+                 app_cache_size=1):
 
         self.app = app
+        self.app_cache_size = app_cache_size
+        self._apps = OrderedDict()
+        self._app_factory = None
+        self._app_built = None
         
         self.subparser_kwargs = dict()
 
@@ -145,20 +193,48 @@ class Manager(object):
         sub-Manager) and any options. 
 
         If your sub-Manager does not override this, any values for options will get lost.
+
+        Apps built by a factory are kept and reused for the same option
+        values, see ``app_cache_size`` and :meth:`clear_app_cache`.
         """
         if app is None:
             app = self.app
             if app is None:
                 raise Exception("There is no app here. This is unlikely to work.")
+            if app is self._app_built:
+                app = self._app_factory
 
         if isinstance(app, Flask):
             if kwargs:
                 warnings.warn("Options will be ignored.")
             return app
 
-        app = app(**kwargs)
-        self.app = app
-        return app
+        try:
+            key = (app, _freeze(kwargs))
+            hash(key)
+        except TypeError:
+            key = None
+        built = self._apps.pop(key, None)
+        if built is None:
+            built = app(**kwargs)
+        if key is not None and self.app_cache_size:
+            self._apps[key] = built
+            while len(self._apps) > self.app_cache_size:
+                self._apps.popitem(last=False)
+
+        self._app_factory, self._app_built = app, built
+        self.app = built
+        return built
+
+    def clear_app_cache(self):
+        """
+        Forgets the apps built by the factory, so that the next command
+        builds a new one.
+        """
+        self._apps.clear()
+        if self._app_built is not None and self.app is self._app_built:
+            self.app = self._app_factory
+        self._app_factory = self._app_built = None
 
     def create_app(self, *args, **kwargs):
         warnings.warn("create_app() is deprecated; use __call__().", warnings.DeprecationWarning)
@@ -175,6 +251,8 @@ class Manager(object):
         options_parser = argparse.ArgumentParser(add_help=False)
         for option in self.get_options():
             options_parser.add_argument(*option.args, **option.kwargs)
+        if parent is None:
+            self._add_global_options(options_parser)
 
         parser = argparse.ArgumentParser(prog=prog, usage=self.usage,
                                          description=self.description,
@@ -215,6 +293,103 @@ class Manager(object):
     # def foo(self, app, *args, **kwargs):
     #     print(args)
 
+    def _iter_commands(self):
+        """
+        Yields the commands of this manager and of its sub-managers.
+        """
+        for command in self._commands.values():
+            if isinstance(command, Manager):
+                for subcommand in command._iter_commands():
+                    yield subcommand
+            else:
+                yield command
+
+    def _add_global_options(self, parser):
+        """
+        Adds the options the manager handles itself, if a command can use
+        them: ``--output-format`` and ``--output`` for commands yielding
+        records, ``--refresh-cache`` for cached commands, ``--force`` for
+        incremental commands, the limits ``--timeout``, ``--cpu-limit``,
+        ``--memory-limit`` and ``--max-open-files`` for all commands, and
+        ``--for-each-config`` with ``--config-jobs`` if the manager has a
+        :attr:`config_option`. Options whose flags the application already
+        uses are left out.
+
+        The options are stored under private destinations, so they never
+        take the values of the commands' own options; :meth:`handle` passes
+        them on without the ``_fs_`` prefix.
+        """
+        self._global_options = {}
+        taken = set()
+        for action in parser._actions:
+            taken.update(action.option_strings)
+            taken.add(action.dest)
+
+        commands = list(self._iter_commands())
+        records = any(_yields_records(command) for command in commands)
+        cached = any(getattr(command, 'cache', None) for command in commands)
+        incremental = any(getattr(command, 'inputs', None) or
+                          getattr(command, 'outputs', None) for command in commands)
+        configs = self.config_option in taken
+
+        for used, flags, kwargs in (
+                (records, ('--output-format',),
+                 dict(dest='_fs_output_format',
+                      choices=sorted(FORMATTERS),
+                      default='text',
+                      help='format of records written by the command (default: text)')),
+                (records, ('--output',),
+                 dict(dest='_fs_output_file',
+                      metavar='FILE',
+                      help='write records to FILE instead of stdout, '
+                           'gzip-compressed if it ends in .gz')),
+                (cached, ('--refresh-cache',),
+                 dict(dest='_fs_refresh_cache',
+                      action='store_true',
+                      help='run a cached command even if its result is cached')),
+                (incremental, ('--force',),
+                 dict(dest='_fs_force_run',
+                      action='store_true',
+                      help='run an incremental command even if its outputs '
+                           'are up to date')),
+                (True, ('--timeout',),
+                 dict(dest='_fs_limit_timeout',
+                      type=float,
+                      metavar='SECONDS',
+                      help='stop the command after this much wall-clock time')),
+                (True, ('--cpu-limit',),
+                 dict(dest='_fs_limit_cpu',
+                      type=float,
+                      metavar='SECONDS',
+                      help='stop the command after this much CPU time')),
+                (True, ('--memory-limit',),
+                 dict(dest='_fs_limit_memory',
+                      type=parse_size,
+                      metavar='SIZE',
+                      help='limit the address space of the command, e.g. 2G')),
+                (True, ('--max-open-files',),
+                 dict(dest='_fs_limit_open_files',
+                      type=int,
+                      metavar='N',
+                      help='limit the number of files the command can open')),
+                (configs, ('--for-each-config',),
+                 dict(dest='_fs_for_each_config',
+                      metavar='GLOB',
+                      help='run the command once for every configuration file '
+                           'matching GLOB, or listed in @FILE')),
+                (configs, ('--config-jobs',),
+                 dict(dest='_fs_config_jobs',
+                      type=int,
+                      default=1,
+                      metavar='N',
+                      help='with --for-each-config, run this many at the same time')),
+        ):
+            if not used or taken & set(flags):
+                continue
+            parser.add_argument(*flags, **kwargs)
+            self._global_options[kwargs['dest']] = kwargs.get(
+                'default', False if kwargs.get('action') == 'store_true' else None)
+
     def _patch_argparser(self, parser):
         """
         Patches the parser to print the full help if no arguments are supplied
@@ -276,16 +451,77 @@ class Manager(object):
         else:
             self._commands[name] = command
 
-    def command(self, func):
+    def command(self, func=None, lock=False, lock_timeout=None, cache=None,
+                cache_config=(), cache_files=(), inputs=(), outputs=(),
+                requires=(), timeout=None, cpu_limit=None, memory_limit=None,
+                open_files=None, needs_app=True, input_records=False):
         """
         Decorator to add a command function to the registry.
 
         :param func: command function.Arguments depend on the
                      options.
-
+        :param lock: run only one instance of the command at a time, see
+                     :attr:`Command.lock`. Use as ``@manager.command(lock=True)``.
+        :param lock_timeout: seconds to wait for the lock with ``lock='wait'``
+        :param cache: cache the command's output and result for this many
+                      seconds, see :attr:`Command.cache`
+        :param cache_config: app settings the cached result depends on
+        :param cache_files: files (or options naming files) the cached
+                            result depends on
+        :param inputs: files the command reads, see :attr:`Command.inputs`
+        :param outputs: files the command writes
+        :param requires: commands to run before this one with ``run-graph``,
+                         see :attr:`Command.requires`
+        :param timeout: stop the command after this many seconds, see
+                        :attr:`Command.timeout`
+        :param cpu_limit: stop the command after this many CPU seconds
+        :param memory_limit: limit the command's address space, in bytes
+                             or e.g. ``'2G'``
+        :param open_files: limit the number of files the command can open
+        :param needs_app: False if the command does not use the app, see
+                          :attr:`Command.needs_app`
+        :param input_records: pass the command the records of the previous
+                              pipeline stage as its ``records`` argument,
+                              see :attr:`Command.input_records`
+
+        Used above ``@option`` decorators, the settings are added to the
+        command the options registered.
         """
 
-        command = Command(func)
+        if func is None:
+            def decorate(func):
+                return self.command(func, lock=lock, lock_timeout=lock_timeout,
+                                    cache=cache, cache_config=cache_config,
+                                    cache_files=cache_files,
+                                    inputs=inputs, outputs=outputs,
+                                    requires=requires, timeout=timeout,
+                                    cpu_limit=cpu_limit,
+                                    memory_limit=memory_limit,
+                                    open_files=open_files,
+                                    needs_app=needs_app,
+                                    input_records=input_records)
+            return decorate
+
+        command = self._commands.get(func.__name__)
+        if getattr(command, 'run', None) is not func:
+            command = Command(func)
+        command.lock = lock
+        command.lock_timeout = lock_timeout
+        command.cache = cache
+        command.cache_config = tuple(cache_config)
+        command.cache_files = tuple(cache_files)
+        command.inputs = tuple(inputs)
+        command.outputs = tuple(outputs)
+        command.requires = tuple(requires)
+        command.timeout = timeout
+        command.cpu_limit = cpu_limit
+        command.memory_limit = memory_limit
+        command.open_files = open_files
+        command.needs_app = needs_app
+        if input_records:
+            command.input_records = True
+            command.option_list = [option for option in command.option_list
+                                   if option.kwargs.get('dest', option.args[0]) != 'records']
         self.add_command(func.__name__, command)
 
         return func
@@ -293,15 +529,17 @@ class Manager(object):
     def option(self, *args, **kwargs):
         """
         Decorator to add an option to a function. Automatically registers the
-        function - do not use together with ``@command``. You can add as many
-        ``@option`` calls as you like, for example::
+        function. You can add as many ``@option`` calls as you like, for
+        example::
 
             @option('-n', '--name', dest='name')
             @option('-u', '--url', dest='url')
             def hello(name, url):
                 print "hello", name, url
 
-        Takes the same arguments as the ``Option`` constructor.
+        Takes the same arguments as the ``Option`` constructor. To set the
+        other properties of the command, e.g. ``cache``, put a
+        ``@command(...)`` decorator above the ``@option`` calls.
         """
 
         option = Option(*args, **kwargs)
@@ -348,7 +586,106 @@ class Manager(object):
             self.add_default_commands()
         self.with_default_commands = False
 
-    def handle(self, prog, args=None):
+    def get_lock(self, func_stack):
+        """
+        Returns a :class:`~flask_script.lock.CommandLock` for the command
+        at the end of ``func_stack`` if it asks for one, else None.
+        """
+        command = func_stack[-1]
+        policy = getattr(command, 'lock', False)
+        if not policy:
+            return None
+        if policy is True:
+            policy = 'skip'
+
+        return CommandLock(lock_path(self._command_names(func_stack)), policy,
+                           getattr(command, 'lock_timeout', None))
+
+    def get_limits(self, func_stack, options):
+        """
+        Returns the :class:`~flask_script.limits.Limits` of the command at
+        the end of ``func_stack``; the ``--timeout`` etc. options override
+        the command's own limits.
+        """
+        command = func_stack[-1]
+
+        def limit(name, attribute):
+            value = options.get(name)
+            if value is None:
+                value = getattr(command, attribute, None)
+            return value
+
+        return Limits(timeout=limit('limit_timeout', 'timeout'),
+                      cpu=limit('limit_cpu', 'cpu_limit'),
+                      memory=limit('limit_memory', 'memory_limit'),
+                      open_files=limit('limit_open_files', 'open_files'))
+
+    def _command_names(self, func_stack):
+        """
+        Returns the names under which the commands in ``func_stack`` were
+        added, e.g. ``['db', 'upgrade']``.
+        """
+        names = []
+        for parent, handler in zip(func_stack, func_stack[1:]):
+            for name, candidate in iteritems(getattr(parent, '_commands', {})):
+                if candidate is handler:
+                    names.append(name)
+                    break
+        return names
+
+    def _run_command(self, func_stack, args, config, options, manager_config=None):
+        """
+        Runs the command at the end of ``func_stack``, skipping it if it
+        is up to date (see :mod:`flask_script.incremental`) and going
+        through the result cache if it is cached (see
+        :mod:`flask_script.cache`). ``manager_config`` holds the options
+        of the managers in ``func_stack``.
+        """
+        command = func_stack[-1]
+        call_config = config
+        if getattr(command, 'input_records', False):
+            records = options.get('records')
+            if records is None:
+                records = read_records()
+            call_config = dict(config, records=records)
+        run = lambda: command(*args, **call_config)
+        if not getattr(command, 'cache', None) and \
+                not getattr(command, 'inputs', None) and \
+                not getattr(command, 'outputs', None):
+            return run()
+
+        names = self._command_names(func_stack)
+        arguments = dict(config)
+        if len(args) > 1:
+            arguments['_args'] = args[1:]
+
+        if getattr(command, 'cache', None):
+            key = cache_key(names, command, args[0], arguments, manager_config)
+            run = lambda run=run: run_cached(
+                ResultCache.for_app(args[0]), key, command.cache, run,
+                refresh=options.get('refresh_cache', False))
+
+        build = build_for(names, command, arguments)
+        if build is None:
+            return run()
+        if not options.get('force_run', False) and build.up_to_date():
+            sys.stderr.write('%s is up to date.\n' % ' '.join(names))
+            return None
+        return run_and_record(build, run)
+
+    def handle(self, prog, args=None, app=None, records=None, stream=False):
+        """
+        Parses ``args`` and runs the selected command.
+
+        :param app: an app to run the command with, e.g. from a previous
+                    call. The manager's own options and app factory are
+                    then not used.
+        :param records: records for a command with ``input_records``,
+                        instead of reading them from stdin
+        :param stream: return the records a command yields instead of
+                       writing them; the command's lock is then released
+                       once they are exhausted
+        """
         self.set_defaults()
         app_parser = self.create_parser(prog)
         
@@ -358,6 +695,11 @@ class Manager(object):
         # get the handle function and remove it from parsed options
         kwargs = app_namespace.__dict__
         func_stack = kwargs.pop('func_stack', None)
+        options = dict((dest[len('_fs_'):], kwargs.pop(dest, default))
+                       for dest, default
+                       in iteritems(getattr(self, '_global_options', {})))
+        options['records'] = records
+        options['stream'] = stream
         if not func_stack:
             app_parser.error('too few arguments')
 
@@ -365,7 +707,51 @@ class Manager(object):
         if remaining_args and not getattr(last_func, 'capture_all_args', False):
             app_parser.error('too many arguments')
 
+        lock = self.get_lock(func_stack)
+        if lock is not None and not lock.acquire():
+            message = 'The command is already running (pid %s).' % lock.owner()
+            if lock.policy == 'skip':
+                sys.stderr.write(message + ' Skipping.\n')
+                return None
+            app_parser.exit(1, message + '\n')
+
+        try:
+            if options.get('for_each_config'):
+                return self._for_each_config(func_stack, kwargs, remaining_args,
+                                             options)
+            with self.get_limits(func_stack, options):
+                res = self._handle(func_stack, kwargs, remaining_args, options, app)
+            if lock is not None and isinstance(res, types.GeneratorType):
+                res, lock = _release_after(res, lock), None
+            return res
+        except LimitExceeded as exc:
+            sys.stderr.write('%s\n' % exc)
+            return 1
+        finally:
+            if lock is not None:
+                lock.release()
+
+    def _for_each_config(self, func_stack, kwargs, remaining_args, options):
+        """
+        Runs the command once for each configuration given with
+        ``--for-each-config``, see :mod:`flask_script.fanout`.
+        """
+        dest = self.config_option
+        configs = expand_configs(options['for_each_config'])
+
+        def run(config):
+            config_kwargs = dict(kwargs)
+            config_kwargs[dest] = config
+            with self.get_limits(func_stack, options):
+                return self._handle(func_stack, config_kwargs, remaining_args,
+                                    options)
+
+        return for_each_config(configs, run, options.get('config_jobs') or 1)
+
+    def _handle(self, func_stack, kwargs, remaining_args, options, app=None):
+        last_func = func_stack[-1]
         args = []
+        manager_config = {}
         for handle in func_stack:
 
             # get only safe config options
@@ -380,10 +766,21 @@ class Manager(object):
             kwargs = dict((k, v) for k, v in iteritems(kwargs)
                           if k not in config_keys)
 
+            if handle is not last_func:
+                manager_config.update(config)
+
+            if handle is self and app is not None:
+                args = [app]
+                continue
+
             if handle is last_func and getattr(last_func, 'capture_all_args', False):
                 args.append(remaining_args)
             try:
-                res = handle(*args, **config)
+                if handle is last_func:
+                    res = self._run_command(func_stack, args, config, options,
+                                            manager_config)
+                else:
+                    res = handle(*args, **config)
             except TypeError as err:
                 err.args = ("{0}: {1}".format(handle,str(err)),)
                 raise
@@ -391,6 +788,13 @@ class Manager(object):
             args = [res]
 
         assert not kwargs
+
+        if isinstance(res, types.GeneratorType) and not options.get('stream'):
+            write_records(res, options.get('output_format', 'text'),
+                          options.get('output_file'),
+                          fields=getattr(last_func, 'output_fields', None),
+                          text_formatter=getattr(last_func, 'format_text', None))
+            res = None
         return res
 
     def run(self, commands=None, default_command=None):
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_script._state
+    ~~~~~~~~~~~~~~~~~~~
+
+    Where Flask-Script keeps files between runs: caches, checkpoints,
+    lock files and the like.
+"""
+import os
+import re
+import sys
+import json
+import hashlib
+
+try:
+    _replace = os.replace
+except AttributeError:  # Python 2
+    _replace = os.rename
+
+
+def state_dir():
+    """
+    Returns the state directory, creating it if necessary.
+
+    This is ``$FLASK_SCRIPT_STATE_DIR`` if set, otherwise
+    ``flask-script`` in the user's cache directory.
+    """
+    path = os.environ.get('FLASK_SCRIPT_STATE_DIR')
+    if not path:
+        cache = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+        path = os.path.join(cache, 'flask-script')
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            if not os.path.isdir(path):
+                raise
+    return path
+
+
+def state_path(*parts):
+    """
+    Returns a path below the state directory.
+    """
+    return os.path.join(state_dir(), *parts)
+
+
+def script_digest():
+    """
+    Returns a short digest of the current management script's path.
+    """
+    script = os.path.abspath(sys.argv[0])
+    return hashlib.sha1(script.encode('utf-8')).hexdigest()[:12]
+
+
+def command_state_path(kind, names, suffix):
+    """
+    Returns the state file of kind ``kind`` (a subdirectory) for the
+    command reached through ``names`` in the current management script.
+    """
+    name = re.sub(r'[^\w.-]+', '_', '-'.join(names)) or 'manager'
+    return state_path(kind, '%s-%s%s' % (name, script_digest(), suffix))
+
+
+def read_json(path, default=None):
+    """
+    Returns the JSON document stored in ``path``, or ``default`` if the
+    file does not exist or cannot be parsed.
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return default
+
+
+def write_json(path, data):
+    """
+    Atomically replaces ``path`` with ``data`` as JSON: a crash leaves
+    either the old or the new file behind, never a partial one.
+    """
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    _replace(tmp, path)
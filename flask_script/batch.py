@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_script.batch
+    ~~~~~~~~~~~~~~~~~~
+
+    Batch commands which process a source in chunks and can resume after
+    a crash.
+
+    Typical usage::
+
+        from flask_script.batch import BatchCommand, KeysetSource
+
+        class Backfill(BatchCommand):
+
+            chunk_size = 500
+
+            def get_source(self):
+                return KeysetSource(User.query, User.id)
+
+            def process(self, users):
+                for user in users:
+                    user.slug = slugify(user.name)
+
+            def commit(self):
+                db.session.commit()
+
+        manager.add_command('backfill', Backfill())
+
+    and then::
+
+        python manage.py backfill
+        python manage.py backfill --resume    # after it was interrupted
+"""
+from __future__ import absolute_import, print_function
+
+import io
+import os
+import sys
+import json
+import hashlib
+from itertools import islice
+
+from .commands import Command, Option
+from ._state import state_path, read_json, write_json
+
+
+class Source(object):
+    """
+    Something to iterate in chunks. :meth:`chunks` yields lists of items
+    together with a JSON-serializable checkpoint from which iteration can
+    continue after that chunk.
+    """
+
+    def chunks(self, size, checkpoint=None):
+        raise NotImplementedError
+
+    def count(self):
+        """
+        Returns the number of items, or None if that is not known cheaply.
+        """
+        return None
+
+
+class IterableSource(Source):
+    """
+    Any iterable. The checkpoint is the number of items consumed, so on
+    resume the iterable must produce the same items in the same order;
+    the ones already processed are skipped.
+    """
+
+    def __init__(self, iterable):
+        self.iterable = iterable
+
+    def chunks(self, size, checkpoint=None):
+        position = checkpoint or 0
+        items = iter(self.iterable)
+        if position:
+            for _ in islice(items, position):
+                pass
+        while True:
+            chunk = list(islice(items, size))
+            if not chunk:
+                break
+            position += len(chunk)
+            yield chunk, position
+
+    def count(self):
+        try:
+            return len(self.iterable)
+        except TypeError:
+            return None
+
+
+class FileSource(Source):
+    """
+    The lines of a file, without line endings. The checkpoint is a byte
+    offset, so resuming does not read the processed part again.
+    """
+
+    def __init__(self, path, encoding='utf-8'):
+        self.path = path
+        self.encoding = encoding
+
+    def chunks(self, size, checkpoint=None):
+        with io.open(self.path, 'rb') as f:
+            if checkpoint:
+                f.seek(checkpoint)
+            while True:
+                chunk = []
+                for _ in range(size):
+                    line = f.readline()
+                    if not line:
+                        break
+                    chunk.append(line.rstrip(b'\r\n').decode(self.encoding))
+                if not chunk:
+                    break
+                yield chunk, f.tell()
+
+
+class KeysetSource(Source):
+    """
+    Rows of a query, fetched with keyset pagination: every chunk is
+    ``query.filter(column > last).order_by(column).limit(size)``, which
+    stays fast deep into large tables where ``OFFSET`` does not. The
+    column must be unique, e.g. the primary key. The checkpoint is the
+    last key processed.
+
+    :param query: a SQLAlchemy query, or anything with the same
+                  ``filter``, ``order_by``, ``limit`` and ``all`` methods
+    :param column: the column to paginate on
+    :param key: returns the column value of a row, by default the
+                attribute named like the column
+    """
+
+    def __init__(self, query, column, key=None):
+        self.query = query
+        self.column = column
+        if key is None:
+            name = getattr(column, 'key', None) or getattr(column, 'name')
+            key = lambda row: getattr(row, name)
+        self.key = key
+
+    def chunks(self, size, checkpoint=None):
+        last = checkpoint
+        while True:
+            query = self.query
+            if last is not None:
+                query = query.filter(self.column > last)
+            chunk = query.order_by(self.column).limit(size).all()
+            if not chunk:
+                break
+            last = self.key(chunk[-1])
+            yield chunk, last
+
+
+def as_source(source):
+    if isinstance(source, Source):
+        return source
+    return IterableSource(source)
+
+
+class BatchCommand(Command):
+    """
+    Base class for commands which process a source in chunks.
+
+    Subclasses implement :meth:`get_source` and :meth:`process`, and
+    usually :meth:`commit`. After every committed chunk a checkpoint is
+    written; with ``--resume`` the command continues after the last one.
+    The checkpoint is removed when the command completes.
+
+    Options in ``option_list`` are passed to all three methods as keyword
+    arguments. Checkpoints are kept per command and option values, in
+    Flask-Script's state directory unless ``--checkpoint`` names a file.
+    """
+
+    #: default number of items per chunk
+    chunk_size = 1000
+
+    def get_options(self):
+        return tuple(super(BatchCommand, self).get_options()) + (
+            Option('--chunk-size',
+                   dest='chunk_size',
+                   type=int,
+                   default=self.chunk_size,
+                   help='items per chunk (default: %d)' % self.chunk_size),
+            Option('--resume',
+                   dest='resume',
+                   action='store_true',
+                   help='continue after the last checkpoint'),
+            Option('--checkpoint',
+                   dest='checkpoint_file',
+                   metavar='FILE',
+                   help='where to keep the checkpoint'),
+        )
+
+    def get_source(self, **kwargs):
+        """
+        Returns a :class:`Source` or an iterable to process.
+        """
+        raise NotImplementedError
+
+    def process(self, items, **kwargs):
+        """
+        Processes one chunk, a list of items.
+        """
+        raise NotImplementedError
+
+    def commit(self, **kwargs):
+        """
+        Called after each chunk, before the checkpoint is written.
+        """
+
+    def checkpoint_path(self, options):
+        key = json.dumps([os.path.abspath(sys.argv[0]), type(self).__module__,
+                          type(self).__name__, sorted(options.items())],
+                         default=repr)
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+        return state_path('checkpoints', '%s-%s.json' % (
+            type(self).__name__.lower(), digest))
+
+    def run(self, chunk_size, resume, checkpoint_file, **kwargs):
+        path = checkpoint_file or self.checkpoint_path(kwargs)
+        state = read_json(path)
+        if state is not None and not resume:
+            print("Ignoring the checkpoint of an earlier run; "
+                  "pass --resume to continue it.", file=sys.stderr)
+            state = None
+        elif state is None and resume:
+            print("No checkpoint found, starting from the beginning.",
+                  file=sys.stderr)
+        checkpoint, done = None, 0
+        if state is not None:
+            checkpoint, done = state['checkpoint'], state['done']
+            print("Resuming after %d items." % done, file=sys.stderr)
+
+        source = as_source(self.get_source(**kwargs))
+        total = source.count()
+        progress = self.progress(total=total - done if total else None,
+                                 label=type(self).__name__.lower())
+        for items, checkpoint in source.chunks(chunk_size, checkpoint):
+            self.process(items, **kwargs)
+            self.commit(**kwargs)
+            done += len(items)
+            write_json(path, dict(checkpoint=checkpoint, done=done))
+            progress.update(len(items))
+        progress.close()
+
+        if os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_script.bench
+    ~~~~~~~~~~~~~~~~~~
+
+    The ``bench`` command: calls routes through the app's test client,
+    without any sockets, to measure the cost of the framework and your
+    views in isolation.
+
+    Typical usage::
+
+        from flask_script.bench import Bench
+
+        manager.add_command('bench', Bench())
+
+    and then::
+
+        python manage.py bench -n 5000 / /about
+        python manage.py bench --all -d 5
+"""
+from __future__ import absolute_import, print_function
+
+import math
+import time
+import threading
+
+from .cli import format_table
+from .commands import Command, Option, InvalidCommand, get_static_urls
+
+try:
+    timer = time.perf_counter
+except AttributeError:  # Python 2
+    timer = time.time
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+
+class BenchResult(object):
+    """
+    Timings of one route, in seconds.
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self.times = []
+        self.errors = 0
+        self.elapsed = 0.0
+        self.alloc = None
+
+    @property
+    def count(self):
+        return len(self.times)
+
+    @property
+    def mean(self):
+        return sum(self.times) / len(self.times) if self.times else 0.0
+
+    @property
+    def stdev(self):
+        if len(self.times) < 2:
+            return 0.0
+        mean = self.mean
+        return math.sqrt(sum((t - mean) ** 2 for t in self.times) /
+                         (len(self.times) - 1))
+
+    def percentile(self, percent):
+        if not self.times:
+            return 0.0
+        ordered = sorted(self.times)
+        index = int(math.ceil(len(ordered) * percent / 100.0)) - 1
+        return ordered[max(0, min(index, len(ordered) - 1))]
+
+
+def _request(client, url):
+    response = client.get(url)
+    response.close()
+    return response.status_code < 400
+
+
+def _worker(app, url, iterations, deadline, result, lock):
+    client = app.test_client()
+    times = []
+    errors = 0
+    n = 0
+    while True:
+        if iterations is not None and n >= iterations:
+            break
+        if deadline is not None and timer() >= deadline:
+            break
+        started = timer()
+        ok = _request(client, url)
+        times.append(timer() - started)
+        if not ok:
+            errors += 1
+        n += 1
+    with lock:
+        result.times.extend(times)
+        result.errors += errors
+
+
+def measure_allocations(app, url, samples=20):
+    """
+    Returns the mean peak of memory allocated while serving one request
+    to ``url``, in bytes, or None if tracemalloc is not available.
+    """
+    if tracemalloc is None:
+        return None
+    client = app.test_client()
+    total = 0
+    for _ in range(samples):
+        tracemalloc.start()
+        try:
+            _request(client, url)
+            total += tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return total / float(samples)
+
+
+def bench(app, url, iterations=1000, duration=None, warmup=10, threads=1,
+          allocations=False):
+    """
+    Benchmarks requests to a single URL and returns a :class:`BenchResult`.
+    With ``duration``, runs for that many seconds instead of a fixed
+    number of ``iterations``, which are split among the ``threads``.
+    """
+    client = app.test_client()
+    for _ in range(warmup):
+        _request(client, url)
+
+    result = BenchResult(url)
+    lock = threading.Lock()
+    deadline = timer() + duration if duration else None
+    per_thread = None
+    if not duration:
+        per_thread = [iterations // threads + (1 if i < iterations % threads else 0)
+                      for i in range(threads)]
+    workers = [threading.Thread(target=_worker,
+                                args=(app, url,
+                                      per_thread[i] if per_thread else None,
+                                      deadline, result, lock))
+               for i in range(threads)]
+    started = timer()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    result.elapsed = timer() - started
+
+    if allocations:
+        result.alloc = measure_allocations(app, url)
+    return result
+
+
+def format_results(results):
+    """
+    Returns a table of :class:`BenchResult` objects.
+    """
+    header = ('URL', 'Requests', 'Req/s', 'Mean ms', 'Stdev ms', 'p50 ms',
+              'p90 ms', 'p99 ms', 'Errors', 'Alloc KiB')
+    rows = []
+    for result in results:
+        rows.append((result.url, str(result.count),
+                     '%.1f' % (result.count / result.elapsed if result.elapsed else 0),
+                     '%.3f' % (result.mean * 1000), '%.3f' % (result.stdev * 1000),
+                     '%.3f' % (result.percentile(50) * 1000),
+                     '%.3f' % (result.percentile(90) * 1000),
+                     '%.3f' % (result.percentile(99) * 1000),
+                     str(result.errors),
+                     '-' if result.alloc is None else '%.1f' % (result.alloc / 1024.0)))
+    return format_table(header, rows)
+
+
+class Bench(Command):
+    """
+    Benchmarks routes through the test client.
+
+    :param iterations: default number of requests per route
+    :param warmup: default number of untimed requests per route
+    """
+
+    help = description = 'Benchmarks routes through the test client'
+
+    def __init__(self, iterations=1000, warmup=10):
+        self.iterations = iterations
+        self.warmup = warmup
+
+    def get_options(self):
+        return (
+            Option('urls',
+                   nargs='*',
+                   metavar='PATH',
+                   help='paths to benchmark'),
+            Option('-a', '--all',
+                   dest='all_routes',
+                   action='store_true',
+                   help='benchmark every GET route without arguments'),
+            Option('-n', '--iterations',
+                   dest='iterations',
+                   type=int,
+                   default=self.iterations,
+                   help='requests per route (default: %d)' % self.iterations),
+            Option('-d', '--duration',
+                   dest='duration',
+                   type=float,
+                   help='run each route for this many seconds instead'),
+            Option('-w', '--warmup',
+                   dest='warmup',
+                   type=int,
+                   default=self.warmup,
+                   help='untimed requests per route (default: %d)' % self.warmup),
+            Option('-t', '--threads',
+                   dest='threads',
+                   type=int,
+                   default=1,
+                   help='number of concurrent threads (default: 1)'),
+            Option('--allocations',
+                   dest='allocations',
+                   action='store_true',
+                   help='also measure memory allocated per request'),
+        )
+
+    def __call__(self, app, urls, all_routes, iterations, duration, warmup,
+                 threads, allocations):
+        urls = list(urls or [])
+        if all_routes:
+            urls.extend(url for url in get_static_urls(app) if url not in urls)
+        if not urls:
+            raise InvalidCommand("Nothing to benchmark; pass URLs or --all.")
+
+        results = [bench(app, url, iterations, duration, warmup, threads,
+                         allocations) for url in urls]
+        print(format_results(results))
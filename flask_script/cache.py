@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_script.cache
+    ~~~~~~~~~~~~~~~~~~
+
+    Result caching for idempotent commands.
+
+    A command with a ``cache`` attribute (or added with
+    ``@manager.command(cache=600)``) is run at most once per that many
+    seconds for the same arguments.  Within that time the manager replays
+    the output the command wrote and returns its return value (or the
+    records it yielded) from a cache on disk.
+
+    The cache key is made from the management script, the command's name
+    and parsed arguments, the options of the managers it was reached
+    through (which may select the app's configuration), the values of the app settings named in ``cache_config``, and the
+    contents of the files named in ``cache_files``.
+"""
+from __future__ import absolute_import
+
+import os
+import sys
+import json
+import time
+import types
+import pickle
+import hashlib
+
+from ._state import state_path, script_digest, _replace
+
+#: default size limit of the cache directory, in bytes
+MAX_SIZE = 256 * 1024 * 1024
+
+
+def file_digest(path):
+    """
+    Returns the SHA-1 of a file's contents, or None if it does not exist.
+    """
+    digest = hashlib.sha1()
+    try:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 16), b''):
+                digest.update(block)
+    except (IOError, OSError):
+        return None
+    return digest.hexdigest()
+
+
+def cache_key(names, command, app, options, manager_options=None):
+    """
+    Returns the cache key of running ``command`` as ``names`` with the
+    parsed ``options``, reached through managers with the parsed
+    ``manager_options``.
+    """
+    files = []
+    for name in getattr(command, 'cache_files', ()):
+        paths = options.get(name, name)
+        if not isinstance(paths, (list, tuple)):
+            paths = [paths]
+        files.extend((path, file_digest(path)) for path in paths if path)
+    config = [(key, app.config.get(key))
+              for key in getattr(command, 'cache_config', ())]
+    data = json.dumps([script_digest(), list(names), sorted(options.items()),
+                       sorted((manager_options or {}).items()), config, files],
+                      default=repr, sort_keys=True)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+class Entry(object):
+    """
+    A cached run: what the command wrote to stdout and stderr, and its
+    return value or the records it yielded.
+    """
+
+    def __init__(self, expires, stdout, stderr, result=None, records=None):
+        self.expires = expires
+        self.stdout = stdout
+        self.stderr = stderr
+        self.result = result
+        self.records = records
+
+    def replay(self):
+        sys.stdout.write(self.stdout)
+        sys.stderr.write(self.stderr)
+        if self.records is not None:
+            return (record for record in self.records)
+        return self.result
+
+
+class ResultCache(object):
+    """
+    A directory of pickled :class:`Entry` objects, one file per key.
+
+    Reading an entry marks it as used; when the directory grows beyond
+    ``max_size`` bytes, the least recently used entries are removed.
+    """
+
+    def __init__(self, directory=None, max_size=MAX_SIZE):
+        self.directory = directory or state_path('cache')
+        self.max_size = max_size
+
+    @classmethod
+    def for_app(cls, app):
+        return cls(app.config.get('RESULT_CACHE_DIR'),
+                   app.config.get('RESULT_CACHE_SIZE', MAX_SIZE))
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.pickle')
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                entry = pickle.load(f)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError,
+                AttributeError, ImportError):
+            return None
+        if entry.expires < time.time():
+            self._remove(path)
+            return None
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return entry
+
+    def set(self, key, entry):
+        """
+        Stores an entry. Entries which cannot be pickled, or which would
+        take more than a quarter of the cache, are not stored.
+        """
+        try:
+            data = pickle.dumps(entry, pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            return False
+        if len(data) > self.max_size // 4:
+            return False
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:
+                if not os.path.isdir(self.directory):
+                    raise
+        path = self.path(key)
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        _replace(tmp, path)
+        self.evict()
+        return True
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache fits into
+        ``max_size``.
+        """
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith('.pickle'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.max_size:
+                break
+            self._remove(path)
+            total -= size
+
+    def clear(self):
+        if os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if name.endswith('.pickle'):
+                    self._remove(os.path.join(self.directory, name))
+
+
+class _Tee(object):
+    """
+    Writes to a stream and remembers what was written.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(data)
+        return self.stream.write(data)
+
+    def getvalue(self):
+        return ''.join(self.chunks)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+class capture(object):
+    """
+    Context manager recording what is written to stdout and stderr.
+    """
+
+    def __enter__(self):
+        self.stdout, self.stderr = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = _Tee(sys.stdout), _Tee(sys.stderr)
+        self.out, self.err = sys.stdout, sys.stderr
+        return self
+
+    def __exit__(self, *exc_info):
+        sys.stdout, sys.stderr = self.stdout, self.stderr
+
+
+def run_cached(cache, key, ttl, func, refresh=False):
+    """
+    Returns the replayed result of the entry ``key`` if there is one,
+    otherwise calls ``func`` and caches its output and result for ``ttl``
+    seconds. If ``func`` returns a generator, the records are stored once
+    it is exhausted. A non-zero integer result is a failed run, which is
+    not cached. With ``refresh``, ``func`` is called in any case.
+    """
+    entry = None if refresh else cache.get(key)
+    if entry is not None:
+        return entry.replay()
+
+    with capture() as captured:
+        result = func()
+    if isinstance(result, int) and not isinstance(result, bool) and result:
+        return result
+    if not isinstance(result, types.GeneratorType):
+        cache.set(key, Entry(time.time() + ttl, captured.out.getvalue(),
+                             captured.err.getvalue(), result=result))
+        return result
+
+    def record(records, captured):
+        collected = []
+        with capture() as more:
+            for item in records:
+                collected.append(item)
+                yield item
+        cache.set(key, Entry(time.time() + ttl,
+                             captured.out.getvalue() + more.out.getvalue(),
+                             captured.err.getvalue() + more.err.getvalue(),
+                             records=collected))
+
+    return record(result, captured)
@@ -92,3 +92,20 @@ def prompt_choices(name, choices, default=None, no_choice=('none',)):
             return None
         if rv in _choices or rv == default:
             return rv
+
+
+def format_table(header, rows):
+    """
+    Formats rows of strings as a left-aligned table with a header line.
+
+    :param header: tuple of column titles
+    :param rows: list of tuples with as many strings as ``header``
+    """
+
+    widths = [max(len(row[i]) for row in [header] + list(rows))
+              for i in range(len(header))]
+    template = '  '.join('%%-%ds' % width for width in widths)
+    lines = [(template % tuple(header)).rstrip(),
+             '-' * (sum(widths) + 2 * (len(widths) - 1))]
+    lines.extend((template % tuple(row)).rstrip() for row in rows)
+    return '\n'.join(lines)
@@ -3,17 +3,36 @@ from __future__ import absolute_import,print_function
 
 import os
 import sys
+import ast
+import atexit
 import code
+import json
+import stat
+import time
+import fnmatch
+import threading
 import warnings
 import string
 import inspect
+import types
 
 import argparse
 
-from flask import _request_ctx_stack
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+from flask import current_app
 
 from .cli import prompt, prompt_pass, prompt_bool, prompt_choices
-from ._compat import izip, text_type
+from ._compat import izip, text_type, module_available
+from ._state import state_path
+from .engines import ENGINES, engine_available
+from .progress import Progress
 
 
 class InvalidCommand(Exception):
@@ -109,6 +128,62 @@ class Command(object):
     option_list = ()
     help_args = None
 
+    #: names of the items of the tuples yielded by a generator ``run``
+    #: method, used by the structured output formats
+    output_fields = None
+
+    #: whether the command yields records, for commands which do so
+    #: without ``output_fields`` or a generator ``run`` method
+    yields_records = None
+
+    #: run only one instance of this command at a time: True or one of
+    #: the policies ``skip``, ``wait`` and ``fail``, see
+    #: :mod:`flask_script.lock`
+    lock = False
+
+    #: with the ``wait`` policy, give up after this many seconds
+    lock_timeout = None
+
+    #: replay the output and result of a previous run with the same
+    #: arguments for this many seconds instead of running again, see
+    #: :mod:`flask_script.cache`
+    cache = None
+
+    #: names of app settings the cached result depends on
+    cache_config = ()
+
+    #: files the cached result depends on: paths, or the names of options
+    #: holding paths
+    cache_files = ()
+
+    #: files the command reads and writes: paths, glob patterns, or the
+    #: names of options holding paths. The command is skipped if its
+    #: outputs are up to date, see :mod:`flask_script.incremental`
+    inputs = ()
+    outputs = ()
+
+    #: command lines to run before this command when it is run with
+    #: :class:`~flask_script.graph.RunGraph`, e.g. ``'db upgrade'``
+    requires = ()
+
+    #: limits of the command: seconds of wall-clock and CPU time, bytes
+    #: (or e.g. ``'2G'``) of address space and number of open files, see
+    #: :mod:`flask_script.limits`
+    timeout = None
+    cpu_limit = None
+    memory_limit = None
+    open_files = None
+
+    #: whether the command uses the app. The launcher of
+    #: :mod:`flask_script.manifest` runs commands which do not without
+    #: importing Flask or the app
+    needs_app = True
+
+    #: whether the command consumes records: it is then passed the records
+    #: of the previous stage of a :mod:`~flask_script.pipeline`, or JSON
+    #: lines read from stdin, as its ``records`` argument
+    input_records = False
+
     def __init__(self, func=None):
         if func is None:
             if not self.option_list:
@@ -177,9 +252,10 @@ class Command(object):
         parent = kwargs.pop('parent',None)
         parser = argparse.ArgumentParser(*args, add_help=False, **kwargs)
         help_args = self.help_args
-        while help_args is None and parent is not None:
-            help_args = parent.help_args
-            parent = getattr(parent,'parent',None)
+        ancestor = parent
+        while help_args is None and ancestor is not None:
+            help_args = ancestor.help_args
+            ancestor = getattr(ancestor,'parent',None)
 
         if help_args:
             from flask_script import add_help
@@ -211,9 +287,48 @@ class Command(object):
         """
         Handles the command with the given app.
         Default behaviour is to call ``self.run`` within a test request context.
+
+        If ``self.run`` is a generator, the records it yields are written
+        by the manager in the format chosen with ``--output-format``, see
+        :mod:`flask_script.output`.
         """
         with app.test_request_context():
-            return self.run(*args, **kwargs)
+            result = self.run(*args, **kwargs)
+        if isinstance(result, types.GeneratorType):
+            return self._iter_records(app, result)
+        return result
+
+    def _iter_records(self, app, records):
+        # the generator body runs while the records are written
+        with app.test_request_context():
+            for record in records:
+                yield record
+
+    def get_manager(self):
+        """
+        Returns the top-level :class:`~flask_script.Manager` this command
+        was parsed by, e.g. to run other commands with it.
+        """
+        manager = self.parent
+        while getattr(manager, 'parent', None) is not None:
+            manager = manager.parent
+        return manager
+
+    def progress(self, iterable=None, total=None, label='', **kwargs):
+        """
+        Returns a :class:`~flask_script.progress.Progress` to report this
+        command's progress with, or, if ``iterable`` is given, an iterator
+        over it which counts the items::
+
+            for user in self.progress(users, label='users'):
+                ...
+
+        Further keyword arguments are passed to ``Progress``.
+        """
+        progress = Progress(total, label, **kwargs)
+        if iterable is None:
+            return progress
+        return progress.iterate(iterable)
 
     def run(self):
         """
@@ -222,6 +337,105 @@ class Command(object):
         """
         raise NotImplementedError
 
+class LazyObject(object):
+    """
+    A proxy creating its object on first use, by calling ``factory``.
+
+    Use it for expensive entries in a shell context::
+
+        def make_context():
+            return dict(app=app, models=lazy_import('myapp.models'))
+    """
+
+    __slots__ = ('_factory', '_obj', '__weakref__')
+
+    def __init__(self, factory):
+        object.__setattr__(self, '_factory', factory)
+
+    def _get_object(self):
+        try:
+            return object.__getattribute__(self, '_obj')
+        except AttributeError:
+            obj = object.__getattribute__(self, '_factory')()
+            object.__setattr__(self, '_obj', obj)
+            return obj
+
+    def __getattr__(self, name):
+        return getattr(self._get_object(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._get_object(), name, value)
+
+    def __delattr__(self, name):
+        delattr(self._get_object(), name)
+
+    def __dir__(self):
+        return dir(self._get_object())
+
+    def __repr__(self):
+        return repr(self._get_object())
+
+    def __str__(self):
+        return str(self._get_object())
+
+    def __bool__(self):
+        return bool(self._get_object())
+    __nonzero__ = __bool__
+
+    def __call__(self, *args, **kwargs):
+        return self._get_object()(*args, **kwargs)
+
+    def __getitem__(self, key):
+        return self._get_object()[key]
+
+    def __setitem__(self, key, value):
+        self._get_object()[key] = value
+
+    def __iter__(self):
+        return iter(self._get_object())
+
+    def __len__(self):
+        return len(self._get_object())
+
+    def __contains__(self, item):
+        return item in self._get_object()
+
+    def __eq__(self, other):
+        return self._get_object() == other
+
+    def __ne__(self, other):
+        return self._get_object() != other
+
+    def __hash__(self):
+        return hash(self._get_object())
+
+
+def lazy(factory):
+    """
+    Returns a :class:`LazyObject` which calls ``factory`` on first use.
+    """
+    return LazyObject(factory)
+
+
+def lazy_import(name):
+    """
+    Returns a :class:`LazyObject` which imports the module ``name``
+    on first use.
+    """
+    import importlib
+    return LazyObject(lambda: importlib.import_module(name))
+
+
+def _preload(modules, delay):
+    import importlib
+    time.sleep(delay)
+    for name in modules:
+        try:
+            importlib.import_module(name)
+        except Exception:
+            pass
+
+
 class Shell(Command):
     """
     Runs a Python shell inside Flask application context.
@@ -230,6 +444,8 @@ class Shell(Command):
     :param make_context: a callable returning a dict of variables
                          used in the shell namespace. By default
                          returns a dict consisting of just the app.
+                         Use :func:`lazy` and :func:`lazy_import` for
+                         entries which are expensive to create.
     :param use_ptipython: use PtIPython shell if available, ignore if not.
                           The PtIPython shell can be turned off in command
                           line by passing the **--no-ptipython** flag.
@@ -242,23 +458,43 @@ class Shell(Command):
     :param use_ipython: use IPython shell if available, ignore if not.
                         The IPython shell can be turned off in command
                         line by passing the **--no-ipython** flag.
+    :param preload: names of modules to import in a background thread
+                    once the shell has started, so that they are ready
+                    by the time you need them.
+
+    Instead of starting an interactive shell, ``shell -c CODE`` runs the
+    given code and ``shell SCRIPT [ARGS...]`` runs a script (``-`` reads it
+    from stdin) in the same context, without loading any shell backend.
     """
 
     banner = ''
 
     help = description = 'Runs a Python shell inside Flask application context.'
 
+    #: shell backends in order of preference, with the modules they need
+    backends = (
+        ('ptipython', ('ptpython', 'IPython')),
+        ('ptpython', ('ptpython',)),
+        ('bpython', ('bpython',)),
+        ('ipython', ('IPython',)),
+    )
+
+    #: seconds to wait before preloading, so that the prompt comes first
+    preload_delay = 0.5
+
     def __init__(self, banner=None, make_context=None, use_ipython=True,
-                 use_bpython=True, use_ptipython=True, use_ptpython=True):
+                 use_bpython=True, use_ptipython=True, use_ptpython=True,
+                 preload=()):
 
         self.banner = banner or self.banner
         self.use_ipython = use_ipython
         self.use_bpython = use_bpython
         self.use_ptipython = use_ptipython
         self.use_ptpython = use_ptpython
+        self.preload = preload
 
         if make_context is None:
-            make_context = lambda: dict(app=_request_ctx_stack.top.app)
+            make_context = lambda: dict(app=current_app._get_current_object())
 
         self.make_context = make_context
 
@@ -284,6 +520,20 @@ class Shell(Command):
                 dest='no_ptpython',
                 default=not(self.use_ptpython),
                 help="Do not use the PtPython shell"),
+            Option('-c', '--command',
+                dest='command',
+                help="Run this code instead of an interactive shell"),
+            Option('--timing',
+                action="store_true",
+                dest='timing',
+                help="Report the time taken by each top-level statement"),
+            Option('script',
+                nargs='?',
+                help="Run this script instead of an interactive shell "
+                     "('-' reads it from stdin)"),
+            Option('script_args',
+                nargs=argparse.REMAINDER,
+                help="Arguments passed to the script in sys.argv"),
         )
 
     def get_context(self):
@@ -292,54 +542,149 @@ class Shell(Command):
         """
         return self.make_context()
 
-    def run(self, no_ipython, no_bpython, no_ptipython, no_ptpython):
+    def available_backends(self):
+        """
+        Returns the names of the installed shell backends.
+
+        Detection results are cached per interpreter in the state
+        directory. The cache is keyed on the modification times of the
+        directories on ``sys.path``, so installing a package invalidates it.
+        """
+        stamp = []
+        for path in sys.path:
+            try:
+                stamp.append(os.stat(path or '.').st_mtime)
+            except OSError:
+                stamp.append(None)
+
+        cache_file = state_path('shell-backends.json')
+        try:
+            with open(cache_file) as f:
+                cache = json.load(f)
+        except (IOError, OSError, ValueError):
+            cache = {}
+        entry = cache.get(sys.executable)
+        if entry is not None and entry.get('stamp') == stamp:
+            return entry['backends']
+
+        names = [name for name, modules in self.backends
+                 if all(module_available(m) for m in modules)]
+        cache[sys.executable] = dict(stamp=stamp, backends=names)
+        try:
+            with open(cache_file, 'w') as f:
+                json.dump(cache, f)
+        except (IOError, OSError):
+            pass
+        return names
+
+    def forget_backends(self):
+        """
+        Drops the cached backend detection, e.g. after one failed to load.
+        """
+        try:
+            os.remove(state_path('shell-backends.json'))
+        except (IOError, OSError):
+            pass
+
+    def embed_ptipython(self, context):
+        from ptpython.ipython import embed
+        history_filename = os.path.expanduser('~/.ptpython_history')
+        embed(banner1=self.banner, user_ns=context, history_filename=history_filename)
+
+    def embed_ptpython(self, context):
+        from ptpython.repl import embed
+        history_filename = os.path.expanduser('~/.ptpython_history')
+        embed(globals=context, history_filename=history_filename)
+
+    def embed_bpython(self, context):
+        from bpython import embed
+        embed(banner=self.banner, locals_=context)
+
+    def embed_ipython(self, context):
+        from IPython import embed
+        embed(banner1=self.banner, user_ns=context)
+
+    def execute(self, source, filename, context, timing=False):
+        """
+        Runs ``source`` in the shell context. With ``timing``, each
+        top-level statement is run separately and its duration is
+        reported on stderr.
+        """
+        if not timing:
+            exec(compile(source, filename, 'exec'), context)
+            return
+
+        lines = source.splitlines()
+        for node in ast.parse(source, filename).body:
+            module = ast.Module(body=[node])
+            module.type_ignores = []
+            code_obj = compile(module, filename, 'exec')
+            started = time.time()
+            exec(code_obj, context)
+            print('[%8.3f ms] %d: %s' % ((time.time() - started) * 1000,
+                                         node.lineno,
+                                         lines[node.lineno - 1].strip()),
+                  file=sys.stderr)
+
+    def run_script(self, context, command=None, script=None, script_args=(),
+                   timing=False):
+        """
+        Runs code given by ``-c`` or a script file (``-`` is stdin).
+        """
+        namespace = dict(context)
+        namespace.setdefault('__name__', '__main__')
+        if command is not None:
+            filename, source = '<command>', command
+            argv = ['-c']
+        elif script == '-':
+            filename, source = '<stdin>', sys.stdin.read()
+            argv = ['-']
+        else:
+            filename = script
+            with open(script) as f:
+                source = f.read()
+            namespace['__file__'] = script
+            argv = [script]
+
+        saved_argv = sys.argv
+        sys.argv = argv + list(script_args or ())
+        try:
+            self.execute(source, filename, namespace, timing)
+        finally:
+            sys.argv = saved_argv
+
+    def run(self, no_ipython, no_bpython, no_ptipython, no_ptpython,
+            command=None, script=None, script_args=None, timing=False):
         """
         Runs the shell.
         If no_ptipython is False or use_ptipython is True, then a PtIPython shell is run (if installed).
         If no_ptpython is False or use_ptpython is True, then a PtPython shell is run (if installed).
         If no_bpython is False or use_bpython is True, then a BPython shell is run (if installed).
         If no_ipython is False or use_python is True then a IPython shell is run (if installed).
+        If command or script is given, it is run instead.
         """
 
         context = self.get_context()
 
-        if not no_ptipython:
-            # Try PtIPython
-            try:
-                from ptpython.ipython import embed
-                history_filename = os.path.expanduser('~/.ptpython_history')
-                embed(banner1=self.banner, user_ns=context, history_filename=history_filename)
-                return
-            except ImportError:
-                pass
-
-        if not no_ptpython:
-            # Try PtPython
-            try:
-                from ptpython.repl import embed
-                history_filename = os.path.expanduser('~/.ptpython_history')
-                embed(globals=context, history_filename=history_filename)
-                return
-            except ImportError:
-                pass
+        if command is not None or script is not None:
+            return self.run_script(context, command, script, script_args, timing)
 
-        if not no_bpython:
-            # Try BPython
-            try:
-                from bpython import embed
-                embed(banner=self.banner, locals_=context)
-                return
-            except ImportError:
-                pass
+        if self.preload:
+            thread = threading.Thread(target=_preload,
+                                      args=(self.preload, self.preload_delay))
+            thread.daemon = True
+            thread.start()
 
-        if not no_ipython:
-            # Try IPython
+        disabled = dict(ptipython=no_ptipython, ptpython=no_ptpython,
+                        bpython=no_bpython, ipython=no_ipython)
+        for name in self.available_backends():
+            if disabled.get(name):
+                continue
             try:
-                from IPython import embed
-                embed(banner1=self.banner, user_ns=context)
+                getattr(self, 'embed_' + name)(context)
                 return
             except ImportError:
-                pass
+                self.forget_backends()
 
         # Use basic python shell
         code.interact(self.banner, local=context)
@@ -366,14 +711,38 @@ class Server(Command):
     :param passthrough_errors: disable the error catching. This means that the server will die on errors but it can be useful to hook debuggers in (pdb etc.)
     :param ssl_crt: path to ssl certificate file
     :param ssl_key: path to ssl key file
-    :param options: :func:`werkzeug.run_simple` options.
+    :param engine: name of the WSGI server to use, see
+                   :mod:`flask_script.engines`. Defaults to the Werkzeug
+                   development server. This can be overriden in the
+                   command line by passing the **--engine** option.
+    :param watcher: how the reloader watches for changes: ``werkzeug``
+                    uses Werkzeug's own reloader, ``inotify`` uses
+                    inotify (falling back to polling where that is not
+                    available) and ``stat`` always polls. The latter two
+                    also watch the app's template and static folders.
+    :param watch_include: additional glob patterns of files next to loaded
+                          modules which trigger a reload (``*.py`` always
+                          does)
+    :param watch_exclude: additional glob patterns of files to never
+                          reload for
+    :param watch_debounce: seconds to wait for a burst of changes to end
+    :param stats: record per-endpoint request counts, status classes,
+                  response times and bytes sent, and print a summary
+                  on shutdown
+    :param stats_address: ``host:port`` on which to serve the statistics
+                          as JSON while the server runs. Implies ``stats``.
+    :param options: :func:`werkzeug.run_simple` options, or options for
+                    the selected engine's server.
     """
 
     help = description = 'Runs the Flask development server i.e. app.run()'
 
     def __init__(self, host='127.0.0.1', port=5000, use_debugger=None,
                  use_reloader=None, threaded=False, processes=1,
-                 passthrough_errors=False, ssl_crt=None, ssl_key=None, **options):
+                 passthrough_errors=False, ssl_crt=None, ssl_key=None,
+                 engine='werkzeug', watcher='werkzeug', watch_include=None,
+                 watch_exclude=None, watch_debounce=0.1, stats=False,
+                 stats_address=None, **options):
 
         self.port = port
         self.host = host
@@ -385,6 +754,13 @@ class Server(Command):
         self.passthrough_errors = passthrough_errors
         self.ssl_crt = ssl_crt
         self.ssl_key = ssl_key
+        self.engine = engine
+        self.watcher = watcher
+        self.watch_include = watch_include
+        self.watch_exclude = watch_exclude
+        self.watch_debounce = watch_debounce
+        self.stats = stats
+        self.stats_address = stats_address
 
     def get_options(self):
 
@@ -444,12 +820,53 @@ class Server(Command):
                    type=str,
                    help='Path to ssl key',
                    default=self.ssl_key),
+            Option('--engine',
+                   dest='engine',
+                   choices=list(ENGINES),
+                   help='WSGI server to use (default: %s)' % self.engine,
+                   default=self.engine),
+            Option('--watcher',
+                   dest='watcher',
+                   choices=('werkzeug', 'inotify', 'stat'),
+                   help='how to watch files when reloading (default: %s)' % self.watcher,
+                   default=self.watcher),
+            Option('--watch-include',
+                   dest='watch_include',
+                   action='append',
+                   metavar='GLOB',
+                   help='also reload when files matching GLOB change'),
+            Option('--watch-exclude',
+                   dest='watch_exclude',
+                   action='append',
+                   metavar='GLOB',
+                   help='ignore changes of files matching GLOB'),
+            Option('--watch-debounce',
+                   dest='watch_debounce',
+                   type=float,
+                   metavar='SECONDS',
+                   default=self.watch_debounce),
+            Option('--stats',
+                   dest='stats',
+                   action='store_true',
+                   help='collect request statistics and print them on shutdown',
+                   default=self.stats),
+            Option('--stats-address',
+                   dest='stats_address',
+                   metavar='HOST:PORT',
+                   help='serve request statistics as JSON on this address',
+                   default=self.stats_address),
         )
 
         return options
 
     def __call__(self, app, host, port, use_debugger, use_reloader,
-                 threaded, processes, passthrough_errors, ssl_crt, ssl_key):
+                 threaded, processes, passthrough_errors, ssl_crt, ssl_key,
+                 engine='werkzeug', watcher='werkzeug', watch_include=None,
+                 watch_exclude=None, watch_debounce=0.1, stats=False,
+                 stats_address=None):
+        # imported here to keep the start of other commands fast
+        from . import reloader, stats as request_stats
+
         # we don't need to run the server in request context
         # so just run it directly
 
@@ -467,27 +884,446 @@ class Server(Command):
         else:
             ssl_context = (ssl_crt, ssl_key)
 
-        app.run(host=host,
-                port=port,
-                debug=use_debugger,
-                use_debugger=use_debugger,
-                use_reloader=use_reloader,
-                threaded=threaded,
-                processes=processes,
-                passthrough_errors=passthrough_errors,
-                ssl_context=ssl_context,
-                **self.server_options)
+        if not engine_available(engine):
+            raise InvalidCommand("The %s engine is not installed." % engine)
+
+        def run_engine(use_reloader):
+            middleware = None
+            printed = []
+
+            def print_summary():
+                if middleware is not None and os.getpid() == middleware.pid \
+                        and not printed:
+                    printed.append(True)
+                    print(middleware.stats.summary(), file=sys.stderr)
+
+            # with Werkzeug's reloader, only the child process serves
+            if (stats or stats_address) and (not use_reloader or
+                    os.environ.get('WERKZEUG_RUN_MAIN') == 'true'):
+                middleware = request_stats.instrument(app, processes)
+                if stats_address:
+                    request_stats.serve_stats(middleware.stats, stats_address)
+                # with our own reloader the engine runs in a daemon thread
+                # of a child which exits without returning here
+                atexit.register(print_summary)
+            try:
+                ENGINES[engine](app,
+                                host=host,
+                                port=port,
+                                use_debugger=use_debugger,
+                                use_reloader=use_reloader,
+                                threaded=threaded,
+                                processes=processes,
+                                passthrough_errors=passthrough_errors,
+                                ssl_context=ssl_context,
+                                **dict(self.server_options))
+            finally:
+                print_summary()
+
+        if not use_reloader or watcher == 'werkzeug':
+            run_engine(use_reloader)
+            return
+
+        def make_watcher():
+            return reloader.make_watcher(
+                watcher,
+                interval=self.server_options.get('reloader_interval', 1),
+                extra_files=self.server_options.get('extra_files'),
+                directories=reloader.app_directories(app),
+                include=reloader.DEFAULT_INCLUDE + tuple(self.watch_include or ())
+                        + tuple(watch_include or ()),
+                exclude=reloader.DEFAULT_EXCLUDE + tuple(self.watch_exclude or ())
+                        + tuple(watch_exclude or ()),
+                debounce=watch_debounce)
+
+        reloader.run_with_reloader(lambda: run_engine(False), make_watcher)
+
+
+def _scandir(path):
+    """
+    Yields (name, is_dir, size) for the entries of ``path``,
+    without following symlinks.
+    """
+    if scandir is not None:
+        for entry in scandir(path):
+            is_dir = entry.is_dir(follow_symlinks=False)
+            size = 0 if is_dir else entry.stat(follow_symlinks=False).st_size
+            yield entry.name, is_dir, size
+        return
+    for name in os.listdir(path):
+        st = os.lstat(os.path.join(path, name))
+        is_dir = stat.S_ISDIR(st.st_mode)
+        yield name, is_dir, 0 if is_dir else st.st_size
 
 
 class Clean(Command):
-    "Remove *.pyc and *.pyo files recursively starting at current directory"
-    def run(self):
-        for dirpath, dirnames, filenames in os.walk('.'):
-            for filename in filenames:
-                if filename.endswith('.pyc') or filename.endswith('.pyo'):
-                    full_pathname = os.path.join(dirpath, filename)
-                    print('Removing %s' % full_pathname)
-                    os.remove(full_pathname)
+    """
+    Remove *.pyc and *.pyo files recursively starting at current directory
+
+    Directories are scanned in parallel; version control directories,
+    virtualenvs and ``node_modules`` are skipped.
+
+    :param exclude: glob patterns of directories not to descend into
+    :param jobs: number of threads scanning directories
+    """
+
+    help = description = 'Remove *.pyc and *.pyo files recursively starting at current directory'
+
+    default_exclude = ('.git', '.hg', '.svn', '.tox', '.nox', '.venv',
+                       'venv', 'node_modules')
+
+    def __init__(self, exclude=None, jobs=8):
+        self.exclude = tuple(exclude) if exclude is not None else self.default_exclude
+        self.jobs = jobs
+
+    def get_options(self):
+        return (
+            Option('path',
+                   nargs='?',
+                   default='.',
+                   help='directory to clean (default: current directory)'),
+            Option('-e', '--exclude',
+                   dest='exclude',
+                   action='append',
+                   metavar='GLOB',
+                   help='also skip directories matching GLOB'),
+            Option('-s', '--stale-only',
+                   dest='stale_only',
+                   action='store_true',
+                   help='only remove bytecode whose source file is gone'),
+            Option('-n', '--dry-run',
+                   dest='dry_run',
+                   action='store_true',
+                   help='only report what would be removed'),
+            Option('-j', '--jobs',
+                   dest='jobs',
+                   type=int,
+                   default=self.jobs,
+                   help='number of scanning threads (default: %d)' % self.jobs),
+            Option('-v', '--verbose',
+                   dest='verbose',
+                   action='store_true',
+                   help='print every removed file'),
+        )
+
+    def is_excluded(self, path, name, exclude):
+        for pattern in exclude:
+            if fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(path, pattern):
+                return True
+        return False
+
+    def is_stale(self, dirpath, filename, in_pycache):
+        if in_pycache:
+            # __pycache__/name.cpython-36.opt-1.pyc belongs to ../name.py
+            source = os.path.join(os.path.dirname(dirpath),
+                                  filename.split('.', 1)[0] + '.py')
+        else:
+            source = os.path.join(dirpath, filename[:-1])
+        return not os.path.exists(source)
+
+    def clean_directory(self, dirpath, in_pycache, exclude, stale_only,
+                        dry_run, verbose):
+        """
+        Removes bytecode in a single directory. Returns the number of
+        files and bytes removed and the subdirectories to descend into.
+        """
+        count = size = 0
+        subdirs = []
+        try:
+            entries = list(_scandir(dirpath))
+        except OSError:
+            return count, size, subdirs
+        if not in_pycache and any(name == 'pyvenv.cfg' for name, _, _ in entries):
+            # a virtualenv
+            return count, size, subdirs
+
+        kept = False
+        for name, is_dir, nbytes in entries:
+            path = os.path.join(dirpath, name)
+            if is_dir:
+                kept = True
+                if not self.is_excluded(path, name, exclude):
+                    subdirs.append((path, name == '__pycache__'))
+                continue
+            if not (name.endswith('.pyc') or name.endswith('.pyo')) or \
+                    (stale_only and not self.is_stale(dirpath, name, in_pycache)):
+                kept = True
+                continue
+            if verbose:
+                print('Removing %s' % path)
+            if not dry_run:
+                try:
+                    os.remove(path)
+                except OSError:
+                    kept = True
+                    continue
+            count += 1
+            size += nbytes
+
+        if in_pycache and not kept and not dry_run:
+            try:
+                os.rmdir(dirpath)
+            except OSError:
+                pass
+        return count, size, subdirs
+
+    def run(self, path, exclude, stale_only, dry_run, jobs, verbose):
+        from multiprocessing.pool import ThreadPool
+
+        exclude = self.exclude + tuple(exclude or ())
+        count = size = 0
+        level = [(path, False)]
+        pool = ThreadPool(max(1, jobs))
+        try:
+            while level:
+                results = pool.map(
+                    lambda item: self.clean_directory(item[0], item[1], exclude,
+                                                      stale_only, dry_run, verbose),
+                    level)
+                level = []
+                for n, nbytes, subdirs in results:
+                    count += n
+                    size += nbytes
+                    level.extend(subdirs)
+        finally:
+            pool.close()
+            pool.join()
+
+        print('%s %d bytecode files (%.1f KiB)' % (
+            'Would remove' if dry_run else 'Removed', count, size / 1024.0))
+
+
+def _compile_file(args):
+    """
+    Compiles a single source file in a worker process. Returns 'compiled',
+    'skipped' (bytecode is up to date) or an error message.
+    """
+    import py_compile
+    path, optimize, invalidation, force = args
+
+    if sys.version_info < (3, 2):
+        cfile = path + ('o' if optimize > 0 else 'c')
+        try:
+            if not force and os.stat(cfile).st_mtime >= os.stat(path).st_mtime:
+                return 'skipped'
+        except OSError:
+            pass
+        try:
+            py_compile.compile(path, cfile, doraise=True)
+        except (py_compile.PyCompileError, IOError, OSError) as exc:
+            return str(exc)
+        return 'compiled'
+
+    import importlib.util
+    cfile = importlib.util.cache_from_source(
+        path, optimization=optimize if optimize > 0 else '')
+    kwargs = {}
+    flags = 0
+    if invalidation != 'timestamp':
+        kwargs['invalidation_mode'] = getattr(py_compile.PycInvalidationMode,
+                                              invalidation.upper().replace('-', '_'))
+        flags = 0b11 if invalidation == 'checked-hash' else 0b01
+
+    if not force:
+        try:
+            with open(cfile, 'rb') as f:
+                header = f.read(16)
+            if header[:4] == importlib.util.MAGIC_NUMBER and \
+                    int.from_bytes(header[4:8], 'little') == flags:
+                if flags:
+                    with open(path, 'rb') as f:
+                        up_to_date = header[8:16] == importlib.util.source_hash(f.read())
+                else:
+                    st = os.stat(path)
+                    up_to_date = header[8:16] == (
+                        (int(st.st_mtime) & 0xFFFFFFFF).to_bytes(4, 'little') +
+                        (st.st_size & 0xFFFFFFFF).to_bytes(4, 'little'))
+                if up_to_date:
+                    return 'skipped'
+        except (IOError, OSError):
+            pass
+
+    try:
+        py_compile.compile(path, cfile, doraise=True, optimize=optimize, **kwargs)
+    except (py_compile.PyCompileError, IOError, OSError) as exc:
+        return str(exc)
+    return 'compiled'
+
+
+def _measure_import(module):
+    """
+    Returns the time it takes a fresh interpreter to import ``module``,
+    without writing bytecode.
+    """
+    import subprocess
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(p for p in sys.path if p)
+    env['PYTHONDONTWRITEBYTECODE'] = '1'
+    script = ("import time; started = time.time(); import %s; "
+              "print(time.time() - started)" % module)
+    best = None
+    for _ in range(3):
+        try:
+            out = subprocess.check_output([sys.executable, '-c', script], env=env)
+            elapsed = float(out.split()[-1])
+        except (subprocess.CalledProcessError, OSError, ValueError, IndexError):
+            return None
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+class Compile(Command):
+    """
+    Precompile Python files to bytecode, in parallel
+
+    By default, compiles the app's own package. With ``--deps``, the
+    packages of all modules the app has imported are compiled as well.
+    Hash-based bytecode (PEP 552, Python 3.7+) with unchecked invalidation
+    lets read-only deployments skip the modification time checks.
+
+    :param jobs: number of worker processes (default: number of CPUs)
+    :param invalidation: default invalidation mode: ``timestamp``,
+                         ``checked-hash`` or ``unchecked-hash``
+    """
+
+    help = description = 'Precompile Python files to bytecode, in parallel'
+
+    def __init__(self, jobs=None, invalidation='timestamp'):
+        self.jobs = jobs
+        self.invalidation = invalidation
+
+    def get_options(self):
+        return (
+            Option('paths',
+                   nargs='*',
+                   metavar='PATH',
+                   help="files or directories to compile (default: the app's package)"),
+            Option('--deps',
+                   dest='deps',
+                   action='store_true',
+                   help="also compile the packages of all modules the app imported"),
+            Option('-e', '--exclude',
+                   dest='exclude',
+                   action='append',
+                   metavar='GLOB',
+                   help='skip directories matching GLOB'),
+            Option('-j', '--jobs',
+                   dest='jobs',
+                   type=int,
+                   default=self.jobs,
+                   help='number of worker processes (default: number of CPUs)'),
+            Option('-i', '--invalidation',
+                   dest='invalidation',
+                   choices=('timestamp', 'checked-hash', 'unchecked-hash'),
+                   default=self.invalidation,
+                   help='how Python checks the bytecode is current (default: %s)'
+                        % self.invalidation),
+            Option('-O', '--optimize',
+                   dest='optimize',
+                   action='append',
+                   type=int,
+                   choices=(0, 1, 2),
+                   help='optimization level, may be given more than once '
+                        '(default: 0)'),
+            Option('-f', '--force',
+                   dest='force',
+                   action='store_true',
+                   help='recompile even if the bytecode is up to date'),
+            Option('--no-measure',
+                   dest='measure',
+                   action='store_false',
+                   help="do not measure the app's import time"),
+        )
+
+    def dependency_paths(self):
+        """
+        Returns the top-level package directories and module files of all
+        loaded modules outside the standard library.
+        """
+        import sysconfig
+        stdlib = os.path.normcase(os.path.realpath(sysconfig.get_paths()['stdlib']))
+        paths = set()
+        for name, module in list(sys.modules.items()):
+            top = sys.modules.get(name.split('.', 1)[0])
+            filename = getattr(top, '__file__', None)
+            if not filename:
+                continue
+            filename = os.path.realpath(filename)
+            if os.path.normcase(filename).startswith(stdlib + os.sep) and \
+                    'site-packages' not in filename and 'dist-packages' not in filename:
+                continue
+            if os.path.basename(filename).startswith('__init__.'):
+                paths.add(os.path.dirname(filename))
+            elif filename.endswith('.py'):
+                paths.add(filename)
+        return paths
+
+    def source_files(self, paths, exclude):
+        for path in paths:
+            if os.path.isfile(path):
+                yield path
+                continue
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames[:] = [d for d in dirnames if d != '__pycache__' and not
+                               any(fnmatch.fnmatch(d, pattern) for pattern in exclude)]
+                for filename in filenames:
+                    if filename.endswith('.py'):
+                        yield os.path.join(dirpath, filename)
+
+    def __call__(self, app, paths, deps, exclude, jobs, invalidation,
+                 optimize, force, measure):
+        from multiprocessing import Pool
+
+        if invalidation != 'timestamp' and sys.version_info < (3, 7):
+            raise InvalidCommand("Hash-based bytecode needs Python 3.7 or later.")
+
+        paths = set(paths or [app.root_path])
+        if deps:
+            paths.update(self.dependency_paths())
+        exclude = Clean.default_exclude + tuple(exclude or ())
+        files = sorted(set(self.source_files(paths, exclude)))
+
+        module = app.import_name
+        if module == '__main__':
+            measure = False
+        before = _measure_import(module) if measure else None
+
+        tasks = [(path, level, invalidation, force)
+                 for level in sorted(set(optimize or [0]))
+                 for path in files]
+        pool = Pool(jobs)
+        try:
+            results = pool.map(_compile_file, tasks, chunksize=max(1, len(tasks) // 64))
+        finally:
+            pool.close()
+            pool.join()
+
+        compiled = results.count('compiled')
+        skipped = results.count('skipped')
+        for result in results:
+            if result not in ('compiled', 'skipped'):
+                print('Failed: %s' % result, file=sys.stderr)
+        print('Compiled %d, skipped %d up-to-date, %d failed' % (
+            compiled, skipped, len(results) - compiled - skipped))
+
+        if before is not None:
+            after = _measure_import(module)
+            if after is not None:
+                print('Importing %s: %.1f ms before, %.1f ms after' % (
+                    module, before * 1000, after * 1000))
+
+
+def get_static_urls(app, methods=('GET',)):
+    """
+    Returns the URLs of all rules of the app which take no arguments and
+    accept one of the given methods, sorted.
+    """
+    urls = set()
+    for rule in app.url_map.iter_rules():
+        if rule.arguments or not set(methods) & set(rule.methods or ()):
+            continue
+        urls.add(rule.rule)
+    return sorted(urls)
 
 
 class ShowUrls(Command):
@@ -508,29 +1344,32 @@ class ShowUrls(Command):
                    help='Property on Rule to order by (default: %s)' % self.order)
         )
 
+    output_fields = ('rule', 'endpoint', 'arguments')
+
     def run(self, url, order):
         from flask import current_app
         from werkzeug.exceptions import NotFound, MethodNotAllowed
 
-        rows = []
-        column_length = 0
-        column_headers = ('Rule', 'Endpoint', 'Arguments')
-
         if url:
             try:
                 rule, arguments = current_app.url_map \
                                              .bind('localhost') \
                                              .match(url, return_rule=True)
-                rows.append((rule.rule, rule.endpoint, arguments))
-                column_length = 3
             except (NotFound, MethodNotAllowed) as e:
-                rows.append(("<%s>" % e, None, None))
-                column_length = 1
+                raise InvalidCommand("%s: %s" % (url, e))
+            yield (rule.rule, rule.endpoint, arguments)
         else:
             rules = sorted(current_app.url_map.iter_rules(), key=lambda rule: getattr(rule, order))
             for rule in rules:
-                rows.append((rule.rule, rule.endpoint, None))
-            column_length = 2
+                # arguments are only known for a matched url
+                yield (rule.rule, rule.endpoint, None)
+
+    def format_text(self, records):
+        rows = list(records)
+        if not rows:
+            return
+        column_length = 3 if any(r[2] is not None for r in rows) else 2
+        column_headers = ('Rule', 'Endpoint', 'Arguments')
 
         str_template = ''
         table_width = 0
@@ -543,7 +1382,6 @@ class ShowUrls(Command):
 
         if column_length >= 2:
             max_endpoint_length = max(len(str(r[1])) for r in rows)
-            # max_endpoint_length = max(rows, key=len)
             max_endpoint_length = max_endpoint_length if max_endpoint_length > 8 else 8
             str_template += '  %-' + str(max_endpoint_length) + 's'
             table_width += 2 + max_endpoint_length
@@ -554,8 +1392,8 @@ class ShowUrls(Command):
             str_template += '  %-' + str(max_arguments_length) + 's'
             table_width += 2 + max_arguments_length
 
-        print(str_template % (column_headers[:column_length]))
-        print('-' * table_width)
+        yield str_template % (column_headers[:column_length])
+        yield '-' * table_width
 
         for row in rows:
-            print(str_template % row[:column_length])
+            yield str_template % row[:column_length]
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_script.engines
+    ~~~~~~~~~~~~~~~~~~~~
+
+    WSGI server engines used by the :class:`~flask_script.Server` command.
+
+    Every engine is a callable taking the application and the options
+    of the ``runserver`` command, translating them to whatever the
+    underlying server understands.  Engines are registered together with
+    the module they need, so that availability can be checked without
+    actually importing anything.
+"""
+from __future__ import absolute_import, print_function
+
+import os
+import sys
+import warnings
+from collections import OrderedDict
+
+from ._compat import module_available
+
+
+ENGINES = OrderedDict()
+
+
+def engine(name, module=None):
+    """
+    Decorator to register a server engine.
+
+    :param name: the name used on the command line (``--engine NAME``)
+    :param module: top-level module the engine needs. Defaults to the
+                   engine's name.
+    """
+
+    def decorate(func):
+        func.engine_module = module or name
+        ENGINES[name] = func
+        return func
+    return decorate
+
+
+def engine_available(name):
+    """
+    Returns True if the engine is known and its server is installed.
+    Nothing gets imported to find out.
+    """
+
+    func = ENGINES.get(name)
+    if func is None:
+        return False
+    return module_available(func.engine_module)
+
+
+def available_engines():
+    """
+    Returns the names of all engines which can be used right now.
+    """
+    return [name for name in ENGINES if engine_available(name)]
+
+
+def _run_with_reloader(main_func, extra_files, interval):
+    try:
+        from werkzeug._reloader import run_with_reloader
+    except ImportError:
+        from werkzeug.serving import run_with_reloader
+
+    run_with_reloader(main_func, extra_files=extra_files, interval=interval)
+
+
+def _wsgi_app(app, use_debugger):
+    app.debug = bool(use_debugger)
+    if use_debugger:
+        from werkzeug.debug import DebuggedApplication
+        return DebuggedApplication(app, evalex=True)
+    return app
+
+
+def _serve(main_func, use_reloader, options):
+    # these are meant for the reloader, not for the server
+    extra_files = options.pop('extra_files', None)
+    interval = options.pop('reloader_interval', 1)
+    if use_reloader:
+        _run_with_reloader(main_func, extra_files, interval)
+    else:
+        main_func()
+
+
+def _unsupported(name, what):
+    warnings.warn("The %s engine does not support %s; ignored." % (name, what))
+
+
+def _no_ssl(name):
+    # commands imports this module, so import from it only when needed
+    from .commands import InvalidCommand
+    raise InvalidCommand("The %s engine does not support SSL." % name)
+
+
+@engine('werkzeug')
+def run_werkzeug(app, host, port, use_debugger, use_reloader, threaded,
+                 processes, passthrough_errors, ssl_context, **options):
+    """The Werkzeug development server, i.e. ``app.run()``."""
+
+    app.run(host=host,
+            port=port,
+            debug=use_debugger,
+            use_debugger=use_debugger,
+            use_reloader=use_reloader,
+            threaded=threaded,
+            processes=processes,
+            passthrough_errors=passthrough_errors,
+            ssl_context=ssl_context,
+            **options)
+
+
+@engine('wsgiref')
+def run_wsgiref(app, host, port, use_debugger, use_reloader, threaded,
+                processes, passthrough_errors, ssl_context, **options):
+    """The reference server from the standard library."""
+
+    from wsgiref.simple_server import make_server, WSGIServer
+    try:
+        from socketserver import ThreadingMixIn, ForkingMixIn
+    except ImportError:
+        from SocketServer import ThreadingMixIn, ForkingMixIn
+
+    if threaded and processes > 1:
+        raise ValueError("cannot have a multithreaded and "
+                         "multi process server.")
+    server_class = WSGIServer
+    if threaded:
+        server_class = type('ThreadedWSGIServer',
+                            (ThreadingMixIn, WSGIServer), {})
+    elif processes > 1:
+        server_class = type('ForkingWSGIServer',
+                            (ForkingMixIn, WSGIServer),
+                            {'max_children': processes})
+
+    wsgi_app = _wsgi_app(app, use_debugger)
+
+    def main():
+        server = make_server(host, port, wsgi_app, server_class=server_class)
+        if ssl_context is not None:
+            import ssl
+            context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+            context.load_cert_chain(*ssl_context)
+            server.socket = context.wrap_socket(server.socket,
+                                                server_side=True)
+        print(" * Running on %s://%s:%d/" % (
+            'https' if ssl_context else 'http', host, port), file=sys.stderr)
+        server.serve_forever()
+
+    _serve(main, use_reloader, options)
+
+
+@engine('waitress')
+def run_waitress(app, host, port, use_debugger, use_reloader, threaded,
+                 processes, passthrough_errors, ssl_context, **options):
+    """Waitress, a multi-threaded pure-Python production server."""
+
+    if ssl_context is not None:
+        _no_ssl('waitress')
+    if processes > 1:
+        _unsupported('waitress', 'multiple processes')
+
+    wsgi_app = _wsgi_app(app, use_debugger)
+
+    def main():
+        from waitress import serve
+        if not threaded:
+            options.setdefault('threads', 1)
+        serve(wsgi_app, host=host, port=port, **options)
+
+    _serve(main, use_reloader, options)
+
+
+@engine('gevent')
+def run_gevent(app, host, port, use_debugger, use_reloader, threaded,
+               processes, passthrough_errors, ssl_context, **options):
+    """
+    gevent's WSGI server. Note that your application needs to be
+    monkey-patched by you if it does blocking I/O.
+    """
+
+    if processes > 1:
+        _unsupported('gevent', 'multiple processes')
+
+    wsgi_app = _wsgi_app(app, use_debugger)
+
+    def main():
+        from gevent.pywsgi import WSGIServer
+        if ssl_context is not None:
+            options['certfile'], options['keyfile'] = ssl_context
+        print(" * Running on %s://%s:%d/" % (
+            'https' if ssl_context else 'http', host, port), file=sys.stderr)
+        WSGIServer((host, port), wsgi_app, **options).serve_forever()
+
+    _serve(main, use_reloader, options)
+
+
+@engine('bjoern')
+def run_bjoern(app, host, port, use_debugger, use_reloader, threaded,
+               processes, passthrough_errors, ssl_context, **options):
+    """
+    bjoern, a single-threaded libev server. Multiple processes share
+    one listening socket.
+    """
+
+    if ssl_context is not None:
+        _no_ssl('bjoern')
+    if threaded:
+        _unsupported('bjoern', 'threads')
+
+    wsgi_app = _wsgi_app(app, use_debugger)
+
+    def main():
+        import bjoern
+        bjoern.listen(wsgi_app, host, port)
+        for _ in range(processes - 1):
+            if os.fork() == 0:
+                break
+        bjoern.run()
+
+    _serve(main, use_reloader, options)
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_script.fanout
+    ~~~~~~~~~~~~~~~~~~~
+
+    Running a command once per app configuration.
+
+    With ``--for-each-config GLOB`` the manager runs the selected command
+    for every configuration file matching ``GLOB`` (or listed, one per
+    line, in the file given as ``@FILE``), passing each one to the app
+    factory through the manager option named by
+    :attr:`Manager.config_option <flask_script.Manager.config_option>`::
+
+        $ python manage.py --for-each-config 'tenants/*.cfg' --config-jobs 8 db upgrade
+
+    The runs happen in ``--config-jobs`` forked worker processes, each building
+    its own app.  The output of every run is collected and printed in one
+    piece when it finishes, followed by a summary; the manager exits with
+    status 1 if any run failed.  Where ``fork`` is not available, threads
+    are used and the output of the runs is not separated.
+"""
+from __future__ import absolute_import, print_function
+
+import os
+import sys
+import glob
+import tempfile
+
+from .commands import InvalidCommand
+from .workers import make_pool, run_job, default_executor
+
+
+def expand_configs(spec):
+    """
+    Returns the configuration files matching the glob pattern ``spec``,
+    or listed in the file ``spec[1:]`` if it starts with ``@``.
+    """
+    if spec.startswith('@'):
+        with open(spec[1:]) as f:
+            configs = [line.strip() for line in f
+                       if line.strip() and not line.strip().startswith('#')]
+    else:
+        configs = sorted(glob.glob(spec))
+    if not configs:
+        raise InvalidCommand("No configurations match %s." % spec)
+    return configs
+
+
+class _CapturedOutput(object):
+    """
+    Sends everything written to stdout and stderr, by Python code or
+    otherwise, to a temporary file.
+    """
+
+    def __enter__(self):
+        self.file = tempfile.TemporaryFile()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        self.saved_fds = [os.dup(1), os.dup(2)]
+        os.dup2(self.file.fileno(), 1)
+        os.dup2(self.file.fileno(), 2)
+        self.saved_streams = sys.stdout, sys.stderr
+        sys.stdout = sys.stderr = os.fdopen(os.dup(self.file.fileno()), 'w')
+        return self
+
+    def __exit__(self, *exc_info):
+        sys.stdout.close()
+        sys.stdout, sys.stderr = self.saved_streams
+        for fd, saved in zip((1, 2), self.saved_fds):
+            os.dup2(saved, fd)
+            os.close(saved)
+        self.file.seek(0)
+        self.output = self.file.read().decode('utf-8', 'replace')
+        self.file.close()
+
+
+def _run_captured(config):
+    with _CapturedOutput() as captured:
+        status, duration = run_job(config)
+    return config, status, duration, captured.output
+
+
+def _run_shared(config):
+    status, duration = run_job(config)
+    return config, status, duration, None
+
+
+def for_each_config(configs, run, jobs=1):
+    """
+    Calls ``run`` with each configuration in ``jobs`` workers, prints the
+    output of each call when it finishes and a summary at the end.
+    Returns 1 if a call failed, else 0.
+    """
+    executor = default_executor()
+    forking = executor == 'process'
+    pool = make_pool(max(jobs, 1), run, executor)
+    results = []
+    try:
+        for config, status, duration, output in pool.imap_unordered(
+                _run_captured if forking else _run_shared, configs):
+            results.append((config, status))
+            print('==> %s (%s, %.1fs)' % (config, status, duration))
+            if output:
+                sys.stdout.write(output if output.endswith('\n') else output + '\n')
+            sys.stdout.flush()
+    except BaseException:
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    finally:
+        pool.join()
+
+    results.sort(key=lambda result: configs.index(result[0]))
+    failed = [(config, status) for config, status in results if status != 'ok']
+    print(' * %d of %d configurations succeeded' % (len(results) - len(failed),
+                                                   len(configs)),
+          file=sys.stderr)
+    for config, status in failed:
+        print('   failed: %s (%s)' % (config, status), file=sys.stderr)
+    return 1 if failed else 0
@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_script.freeze
+    ~~~~~~~~~~~~~~~~~~~
+
+    The ``freeze`` command: renders the app's pages through the test
+    client into static files, for serving them from a static tier.
+
+    Typical usage::
+
+        from flask_script.freeze import Freeze
+
+        freeze = Freeze()
+        manager.add_command('freeze', freeze)
+
+        @freeze.url_generator
+        def product():
+            for product in Product.query:
+                yield {'id': product.id}
+
+    and then::
+
+        python manage.py freeze build -j 8
+
+    Every ``GET`` route without arguments is frozen, plus the URLs the
+    registered generators yield: URL strings, dicts of values for the
+    endpoint named like the generator, or ``(endpoint, values)`` tuples.
+
+    Pages are rendered in a pool of forked processes. A page whose
+    response did not change since the last run, by its ``ETag`` or the
+    hash of its content, is not written again, and files of pages which
+    are gone are removed. Text files are also written precompressed, as
+    ``.gz`` and, if the ``brotli`` package is installed, ``.br``.
+"""
+from __future__ import absolute_import, print_function
+
+import os
+import sys
+import gzip
+import hashlib
+import multiprocessing
+from io import BytesIO
+
+try:
+    from urllib.parse import urlsplit, unquote
+except ImportError:  # Python 2
+    from urlparse import urlsplit
+    from urllib import unquote
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from ._state import read_json, write_json, _replace
+from .commands import Command, Option, InvalidCommand, get_static_urls
+from .workers import pool_class, default_executor
+
+#: name of the file in the destination which records the last run
+STATE_FILE = '.freeze.json'
+
+#: responses smaller than this are not compressed
+MIN_COMPRESS_SIZE = 256
+
+_COMPRESSIBLE = set(['application/javascript', 'application/json',
+                     'application/xml', 'application/rss+xml',
+                     'application/atom+xml', 'image/svg+xml'])
+
+
+class FreezeError(InvalidCommand):
+    """
+    A page could not be frozen.
+    """
+
+
+def output_path(url, mimetype):
+    """
+    Returns the file, relative to the destination, a URL is frozen to:
+    URLs ending in ``/`` get an ``index.html``, and HTML pages without an
+    extension ``.html``.
+    """
+    path = unquote(urlsplit(url).path)
+    if path.endswith('/'):
+        path += 'index.html'
+    elif mimetype == 'text/html' and not os.path.splitext(path)[1]:
+        path += '.html'
+    parts = [part for part in path.split('/') if part]
+    if not parts or '..' in parts:
+        raise FreezeError("Cannot freeze %s." % url)
+    return os.path.join(*parts)
+
+
+def compressible(mimetype, size):
+    return size >= MIN_COMPRESS_SIZE and (
+        mimetype.startswith('text/') or mimetype in _COMPRESSIBLE)
+
+
+def _gzip(data):
+    buf = BytesIO()
+    # a fixed mtime keeps the output identical between runs
+    with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=9, mtime=0) as f:
+        f.write(data)
+    return buf.getvalue()
+
+
+def compressed_variants(data, mimetype):
+    """
+    Returns ``(suffix, data)`` for each precompressed variant of a
+    response which is smaller than the original.
+    """
+    if not compressible(mimetype, len(data)):
+        return []
+    variants = [('.gz', _gzip(data))]
+    if brotli is not None:
+        variants.append(('.br', brotli.compress(data)))
+    return [(suffix, packed) for suffix, packed in variants
+            if len(packed) < len(data)]
+
+
+def _write(path, data):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    _replace(tmp, path)
+
+
+def freeze_url(client, url, destination, previous=None, compress=True):
+    """
+    Renders ``url`` with the test client ``client`` into ``destination``.
+    Returns the record of the page for the next run and whether its files
+    were written; ``previous`` is its record from the last run.
+    """
+    present = previous is not None and all(
+        os.path.exists(os.path.join(destination, name))
+        for name in previous['files'])
+    headers = {}
+    if present and previous.get('etag'):
+        headers['If-None-Match'] = previous['etag']
+
+    response = client.get(url, headers=headers)
+    try:
+        if response.status_code == 304 and headers:
+            return previous, False
+        if response.status_code != 200:
+            raise FreezeError("%s returned %s." % (url, response.status))
+        data = response.get_data()
+        mimetype = response.mimetype or 'application/octet-stream'
+        etag = response.headers.get('ETag')
+    finally:
+        response.close()
+
+    digest = hashlib.sha1(data).hexdigest()
+    if present and previous['hash'] == digest:
+        return dict(previous, etag=etag), False
+
+    name = output_path(url, mimetype)
+    files = [name]
+    _write(os.path.join(destination, name), data)
+    for suffix, packed in (compressed_variants(data, mimetype) if compress else ()):
+        _write(os.path.join(destination, name + suffix), packed)
+        files.append(name + suffix)
+    return dict(hash=digest, etag=etag, files=files), True
+
+
+_worker = {}
+
+
+def _init_worker(app, destination, compress):
+    _worker.update(app=app, destination=destination, compress=compress)
+
+
+def _freeze_job(args):
+    url, previous = args
+    try:
+        record, written = freeze_url(_worker['app'].test_client(), url,
+                                     _worker['destination'], previous,
+                                     _worker['compress'])
+        return url, record, written, None
+    except Exception as exc:
+        message = str(exc) if isinstance(exc, FreezeError) else \
+            '%s: %s' % (type(exc).__name__, exc)
+        return url, previous, False, message
+
+
+def freeze(app, urls, destination, jobs=1, compress=True, rebuild=False):
+    """
+    Freezes ``urls`` into ``destination`` in ``jobs`` workers, and removes
+    the files of pages frozen by the last run but not by this one.
+    Returns the numbers of pages written and unchanged, the number of
+    files removed and the ``(url, error)`` pairs of the pages which
+    failed.
+    """
+    state_file = os.path.join(destination, STATE_FILE)
+    state = read_json(state_file, {})
+    tasks = [(url, None if rebuild else state.get(url)) for url in urls]
+
+    if jobs > 1:
+        pool = pool_class(default_executor())(jobs, _init_worker,
+                                              (app, destination, compress))
+        try:
+            results = list(pool.imap_unordered(_freeze_job, tasks, 8))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        _init_worker(app, destination, compress)
+        results = [_freeze_job(task) for task in tasks]
+
+    new_state = {}
+    written = unchanged = 0
+    errors = []
+    for url, record, changed, error in results:
+        if error is not None:
+            errors.append((url, error))
+            # keep the files of the last run which succeeded
+            record = state.get(url)
+        if record is not None:
+            new_state[url] = record
+        if error is None:
+            if changed:
+                written += 1
+            else:
+                unchanged += 1
+
+    kept = set(name for record in new_state.values() for name in record['files'])
+    removed = 0
+    for record in state.values():
+        for name in record['files']:
+            path = os.path.join(destination, name)
+            if name not in kept and os.path.exists(path):
+                os.remove(path)
+                removed += 1
+    write_json(state_file, new_state)
+    return written, unchanged, removed, errors
+
+
+class Freeze(Command):
+    """
+    Renders the app's pages into static files, see
+    :mod:`flask_script.freeze`.
+
+    :param destination: default output directory
+    :param generators: functions yielding more URLs to freeze, see
+                       :meth:`url_generator`
+    """
+
+    help = description = 'Renders pages into static files'
+
+    def __init__(self, destination='build', generators=None):
+        self.destination = destination
+        self.generators = list(generators or [])
+
+    def url_generator(self, func):
+        """
+        Registers a function yielding URLs to freeze; used as a decorator.
+        """
+        self.generators.append(func)
+        return func
+
+    def get_options(self):
+        return (
+            Option('destination',
+                   nargs='?',
+                   default=self.destination,
+                   help='output directory (default: %s)' % self.destination),
+            Option('-j', '--jobs',
+                   dest='jobs',
+                   type=int,
+                   default=multiprocessing.cpu_count(),
+                   help='number of processes rendering pages (default: one per CPU)'),
+            Option('--static',
+                   dest='static',
+                   action='store_true',
+                   help="also copy the files of the app's static folder"),
+            Option('--no-compress',
+                   dest='compress',
+                   action='store_false',
+                   help='do not write precompressed .gz and .br files'),
+            Option('--rebuild',
+                   dest='rebuild',
+                   action='store_true',
+                   help='write all pages, even those unchanged since the last run'),
+        )
+
+    def get_urls(self, app, static=False):
+        """
+        Returns the URLs to freeze: every ``GET`` route without arguments,
+        the URLs yielded by the generators and, with ``static``, those of
+        the files in the app's static folder.
+        """
+        from flask import url_for
+
+        urls = list(get_static_urls(app))
+        with app.test_request_context():
+            for generator in self.generators:
+                for item in generator():
+                    if isinstance(item, dict):
+                        item = url_for(generator.__name__, **item)
+                    elif isinstance(item, tuple):
+                        item = url_for(item[0], **item[1])
+                    urls.append(item)
+            if static and app.has_static_folder:
+                for root, dirs, files in os.walk(app.static_folder):
+                    for name in files:
+                        filename = os.path.relpath(os.path.join(root, name),
+                                                   app.static_folder)
+                        urls.append(url_for('static',
+                                            filename=filename.replace(os.sep, '/')))
+        seen = set()
+        return [url for url in urls if not (url in seen or seen.add(url))]
+
+    def __call__(self, app, destination, jobs, static, compress, rebuild):
+        urls = self.get_urls(app, static)
+        if not urls:
+            raise InvalidCommand("Nothing to freeze.")
+
+        written, unchanged, removed, errors = freeze(
+            app, urls, destination, max(jobs, 1), compress, rebuild)
+        for url, error in sorted(errors):
+            print('%s: %s' % (url, error), file=sys.stderr)
+        print('Froze %d pages to %s: %d written, %d unchanged, %d files removed' % (
+            written + unchanged, destination, written, unchanged, removed))
+        if errors:
+            print('%d pages failed' % len(errors), file=sys.stderr)
+            return 1
+        return 0
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_script.graph
+    ~~~~~~~~~~~~~~~~~~
+
+    Running commands together with the commands they depend on.
+
+    A command lists the commands which must run before it in ``requires``
+    (or with ``@manager.command(requires=[...])``), as command lines
+    relative to the top-level manager, e.g. ``'db upgrade'`` or
+    ``['assets', 'build', '--minify']``.  The :class:`RunGraph` command
+    runs targets with all of their prerequisites, each of them once, and
+    runs commands which do not depend on each other at the same time::
+
+        manager.add_command('run-graph', RunGraph())
+
+        $ python manage.py run-graph --jobs 4 deploy
+"""
+from __future__ import absolute_import, print_function
+
+import sys
+import time
+import shlex
+from collections import OrderedDict
+
+try:
+    from queue import Queue, Empty
+except ImportError:  # Python 2
+    from Queue import Queue, Empty
+
+from .commands import Command, Option, InvalidCommand
+from .workers import make_pool, run_job
+
+
+def parse_command_line(line):
+    """
+    Returns a command line given as a string or a sequence as a tuple.
+    """
+    if isinstance(line, (list, tuple)):
+        return tuple(line)
+    return tuple(shlex.split(line))
+
+
+def resolve(manager, argv):
+    """
+    Returns the command which ``argv`` runs, looking up namespaces in
+    sub-managers.
+    """
+    command = manager
+    for i, name in enumerate(argv):
+        commands = getattr(command, '_commands', None)
+        if commands is None:
+            break
+        if name not in commands:
+            raise InvalidCommand("Unknown command: %s" % ' '.join(argv[:i + 1]))
+        command = commands[name]
+    if getattr(command, '_commands', None) is not None:
+        raise InvalidCommand("Not a command: %s" % ' '.join(argv))
+    return command
+
+
+class CommandGraph(object):
+    """
+    The dependency graph of command lines.
+
+    :attr:`nodes` maps each command line (a tuple) to the command lines it
+    requires, in an order in which every command comes after its
+    prerequisites.
+    """
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.nodes = OrderedDict()
+        self.durations = {}
+        self.status = {}
+
+    def add(self, line, _path=()):
+        """
+        Adds a command line with its prerequisites and returns its key.
+        """
+        key = parse_command_line(line)
+        if key in _path:
+            cycle = _path[_path.index(key):] + (key,)
+            raise InvalidCommand("Dependency cycle: %s" %
+                                 ' -> '.join(' '.join(node) for node in cycle))
+        if key in self.nodes:
+            return key
+        command = resolve(self.manager, key)
+        self.nodes[key] = [self.add(requirement, _path + (key,))
+                           for requirement in getattr(command, 'requires', ())]
+        return key
+
+    def run(self, dispatch, jobs=1, executor='thread', log=None):
+        """
+        Runs every command once its prerequisites succeeded, up to
+        ``jobs`` of them at a time, and returns whether all of them
+        succeeded. After a failure, only commands already running are
+        waited for.
+        """
+        log = log or (lambda message: print(message, file=sys.stderr))
+        waiting = dict((key, set(requires)) for key, requires in self.nodes.items())
+        dependents = dict((key, []) for key in self.nodes)
+        for key, requires in self.nodes.items():
+            for requirement in set(requires):
+                dependents[requirement].append(key)
+
+        results = Queue()
+        pool = make_pool(jobs, dispatch, executor)
+        running = [0]
+        failed = []
+
+        def submit(key):
+            del waiting[key]
+            running[0] += 1
+            pool.apply_async(run_job, (list(key),),
+                             callback=lambda result: results.put((key, result)))
+
+        try:
+            for key in list(self.nodes):
+                if not waiting[key]:
+                    submit(key)
+            while running[0]:
+                try:
+                    key, (status, duration) = results.get(True, 0.5)
+                except Empty:
+                    continue
+                running[0] -= 1
+                self.status[key] = status
+                self.durations[key] = duration
+                log(' * [%s] %s (%.1fs)' % (status, ' '.join(key), duration))
+                if status != 'ok':
+                    failed.append(key)
+                    continue
+                for dependent in dependents[key]:
+                    waiting[dependent].discard(key)
+                    if not waiting[dependent] and not failed:
+                        submit(dependent)
+        finally:
+            pool.close()
+            pool.join()
+        return not failed and not waiting
+
+    def critical_path(self):
+        """
+        Returns the chain of commands which took longest from start to
+        finish with unlimited workers, and its total duration.
+        """
+        finish = {}
+        previous = {}
+        for key, requires in self.nodes.items():
+            start = 0.0
+            previous[key] = None
+            for requirement in requires:
+                if finish.get(requirement, 0.0) > start:
+                    start = finish[requirement]
+                    previous[key] = requirement
+            finish[key] = start + self.durations.get(key, 0.0)
+        if not finish:
+            return [], 0.0
+        key = max(finish, key=finish.get)
+        total = finish[key]
+        path = []
+        while key is not None:
+            path.append(key)
+            key = previous[key]
+        return path[::-1], total
+
+
+class RunGraph(Command):
+    """
+    Runs commands with all the commands they require.
+    """
+
+    help = description = 'Run commands with their prerequisites, in parallel where possible'
+
+    def get_options(self):
+        return (
+            Option('targets',
+                   nargs='+',
+                   metavar='TARGET',
+                   help='command to run, e.g. "db upgrade"; quote commands with arguments'),
+            Option('-j', '--jobs',
+                   dest='jobs',
+                   type=int,
+                   default=1,
+                   help='commands to run at the same time (default: 1)'),
+            Option('--executor',
+                   dest='executor',
+                   choices=('thread', 'process'),
+                   default='thread',
+                   help='run commands in threads or forked processes (default: thread)'),
+            Option('-n', '--dry-run',
+                   dest='dry_run',
+                   action='store_true',
+                   help='list the commands in the order they would run and exit'),
+        )
+
+    def __call__(self, app, targets, jobs, executor, dry_run):
+        manager = self.get_manager()
+        graph = CommandGraph(manager)
+        for target in targets:
+            graph.add(target)
+
+        if dry_run:
+            for key, requires in graph.nodes.items():
+                print(' '.join(key) + (' (after %s)' % ', '.join(
+                    ' '.join(requirement) for requirement in requires)
+                    if requires else ''))
+            return
+
+        prog = sys.argv[0]
+
+        def dispatch(args):
+            return manager.handle(prog, args, app=app)
+
+        started = time.time()
+        ok = graph.run(dispatch, max(jobs, 1), executor)
+        elapsed = time.time() - started
+
+        path, total = graph.critical_path()
+        if path:
+            print(' * Critical path (%.1fs of %.1fs): %s' % (
+                total, elapsed, ' -> '.join(
+                    '%s (%.1fs)' % (' '.join(key), graph.durations.get(key, 0.0))
+                    for key in path)), file=sys.stderr)
+        if not ok:
+            skipped = [key for key in graph.nodes if key not in graph.status]
+            if skipped:
+                print(' * Not run: %s' % ', '.join(' '.join(key) for key in skipped),
+                      file=sys.stderr)
+            return 1
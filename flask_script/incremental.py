@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_script.incremental
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Make-style incremental commands.
+
+    A command with ``inputs`` and ``outputs`` (or added with
+    ``@manager.command(inputs=[...], outputs=[...])``) is skipped when it
+    has nothing to do: all of its outputs exist and are newer than its
+    inputs, or the inputs and outputs have the same contents as after its
+    last successful run.  The latter is recorded in a state file per
+    command, so that e.g. a fresh checkout, which gives every file a new
+    modification time, does not cause a rebuild.
+
+    Inputs and outputs are paths or glob patterns; a directory stands for
+    all files below it, and the name of one of the command's options
+    stands for the path(s) given in that option.
+"""
+from __future__ import absolute_import
+
+import os
+import json
+import glob
+import types
+
+from ._state import command_state_path, read_json, write_json
+from .cache import file_digest
+
+
+def expand(patterns, options=None):
+    """
+    Returns the sorted list of files matched by ``patterns``, and the
+    patterns which matched nothing.
+    """
+    options = options or {}
+    files = set()
+    missing = []
+    for pattern in patterns:
+        values = options.get(pattern, pattern)
+        if not isinstance(values, (list, tuple)):
+            values = [values]
+        for value in values:
+            if not value:
+                continue
+            matches = glob.glob(value)
+            if not matches:
+                missing.append(value)
+            for match in matches:
+                if os.path.isdir(match):
+                    for root, dirs, names in os.walk(match):
+                        files.update(os.path.join(root, name) for name in names)
+                else:
+                    files.add(match)
+    return sorted(files), missing
+
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime, st.st_size
+
+
+class Build(object):
+    """
+    Decides whether a command has to run and records its inputs and
+    outputs after it ran.
+
+    :param inputs: paths or patterns the command reads
+    :param outputs: paths or patterns the command writes
+    :param path: the state file
+    :param options: the command's parsed options
+    """
+
+    def __init__(self, inputs, outputs, path, options=None):
+        self.options = options or {}
+        self.inputs = inputs
+        self.outputs = outputs
+        self.path = path
+        self.state = read_json(path, {})
+        self.arguments = json.dumps(sorted(self.options.items()),
+                                    default=repr, sort_keys=True)
+
+    def _digests(self, files, recorded):
+        """
+        Returns ``{path: [mtime, size, digest]}`` for ``files``, reusing
+        the digests of files whose modification time and size did not
+        change since they were recorded.
+        """
+        digests = {}
+        for path in files:
+            stat = _stat(path)
+            if stat is None:
+                continue
+            old = recorded.get(path)
+            if old and tuple(old[:2]) == stat:
+                digests[path] = old
+            else:
+                digests[path] = [stat[0], stat[1], file_digest(path)]
+        return digests
+
+    def up_to_date(self):
+        """
+        Returns whether all outputs exist and are newer than, or have the
+        same contents as, the inputs.
+        """
+        outputs, missing = expand(self.outputs, self.options)
+        if missing or not outputs:
+            return False
+        inputs, missing = expand(self.inputs, self.options)
+        if missing:
+            return False
+
+        if self.state:
+            if self.state.get('arguments') != self.arguments:
+                return False
+            if sorted(self.state.get('inputs', {})) != inputs:
+                return False
+            if sorted(self.state.get('outputs', {})) != outputs:
+                return False
+
+        oldest = min(_stat(path)[0] for path in outputs)
+        if all(_stat(path)[0] <= oldest for path in inputs):
+            return True
+        if not self.state:
+            return False
+
+        recorded = self.state['inputs'], self.state['outputs']
+        current = (self._digests(inputs, recorded[0]),
+                   self._digests(outputs, recorded[1]))
+        for now, before in zip(current, recorded):
+            if any(now[path][2] != before[path][2] for path in now):
+                return False
+        # remember the new modification times to skip hashing next time
+        self.save(*current)
+        return True
+
+    def record(self):
+        """
+        Records the inputs and outputs after a successful run.
+        """
+        inputs, missing = expand(self.inputs, self.options)
+        outputs, missing = expand(self.outputs, self.options)
+        self.save(self._digests(inputs, self.state.get('inputs', {})),
+                  self._digests(outputs, {}))
+
+    def save(self, inputs, outputs):
+        self.state = dict(arguments=self.arguments, inputs=inputs,
+                          outputs=outputs)
+        write_json(self.path, self.state)
+
+
+def build_for(names, command, options):
+    """
+    Returns the :class:`Build` of running ``command`` as ``names`` with
+    the parsed ``options``, or None if it declares no inputs or outputs.
+    """
+    inputs = getattr(command, 'inputs', ())
+    outputs = getattr(command, 'outputs', ())
+    if not inputs and not outputs:
+        return None
+    return Build(inputs, outputs,
+                 command_state_path('builds', names, '.json'), options)
+
+
+def run_and_record(build, func):
+    """
+    Calls ``func`` and records the inputs and outputs of ``build`` once
+    it succeeded, i.e. returned None, 0 or False, or exhausted the
+    generator it returned.
+    """
+    result = func()
+    if not isinstance(result, types.GeneratorType):
+        if result is None or result is False or result == 0:
+            build.record()
+        return result
+
+    def record(records):
+        for item in records:
+            yield item
+        build.record()
+    return record(result)
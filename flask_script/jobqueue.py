@@ -0,0 +1,501 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_script.jobqueue
+    ~~~~~~~~~~~~~~~~~~~~~
+
+    A local job queue in a SQLite database, and the ``enqueue``, ``worker``
+    and ``jobs`` commands using it.
+
+    ``enqueue`` stores a command line of this manager; ``worker`` processes
+    create the app once, claim jobs and run them through the manager, as if
+    they had been called on the command line.  No broker is needed: the
+    database runs in WAL mode, so workers and producers on the same machine
+    do not block each other, and a claimed job carries a lease which other
+    workers take over when its worker dies.
+
+    Typical usage::
+
+        from flask_script.jobqueue import Enqueue, Worker, Jobs
+
+        manager.add_command('enqueue', Enqueue())
+        manager.add_command('worker', Worker(limits={'report': 1}))
+        manager.add_command('jobs', Jobs())
+
+    and then::
+
+        python manage.py enqueue --priority 5 report --month 2024-01
+        python manage.py worker --concurrency 4
+        python manage.py jobs --status failed
+"""
+from __future__ import absolute_import, print_function
+
+import os
+import sys
+import json
+import time
+import socket
+import sqlite3
+import hashlib
+import argparse
+import threading
+import traceback
+
+from .commands import Command, Option, InvalidCommand
+from .graph import resolve
+from ._state import state_path
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    args TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 3,
+    run_after REAL NOT NULL,
+    lease_until REAL,
+    worker TEXT,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, priority DESC, id);
+"""
+
+#: the states of a job
+STATUSES = ('queued', 'running', 'done', 'failed')
+
+
+def default_queue_path():
+    script = os.path.abspath(sys.argv[0])
+    return state_path('queue-%s.sqlite' % hashlib.sha1(
+        script.encode('utf-8')).hexdigest()[:16])
+
+
+def _json_result(value):
+    try:
+        return json.dumps(value)
+    except (TypeError, ValueError):
+        return json.dumps(repr(value))
+
+
+class JobQueue(object):
+    """
+    A queue of command lines in the SQLite database at ``path``.
+
+    Every thread uses its own connection.
+    """
+
+    def __init__(self, path, timeout=30.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self.db.executescript(_SCHEMA)
+
+    @property
+    def db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=self.timeout,
+                                 isolation_level=None)
+            db.row_factory = sqlite3.Row
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+        return db
+
+    def enqueue(self, args, priority=0, max_attempts=3, delay=0):
+        """
+        Adds a command line and returns the id of the job.
+        """
+        if not args:
+            raise ValueError("A job needs a command")
+        now = time.time()
+        cursor = self.db.execute(
+            'INSERT INTO jobs (name, args, priority, max_attempts, run_after, created) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (args[0], json.dumps(list(args)), priority, max_attempts,
+             now + delay, now))
+        return cursor.lastrowid
+
+    def claim(self, worker, lease=60.0, limits=None):
+        """
+        Claims the job with the highest priority which is due, or whose
+        lease has expired, and returns it as a dict, or None.
+
+        :param limits: maximum number of running jobs per command name
+        """
+        limits = limits or {}
+        now = time.time()
+        db = self.db
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            running = {}
+            if limits:
+                for name, count in db.execute(
+                        "SELECT name, COUNT(*) FROM jobs WHERE status = 'running' "
+                        "AND lease_until >= ? GROUP BY name", (now,)):
+                    running[name] = count
+            candidates = db.execute(
+                "SELECT * FROM jobs WHERE (status = 'queued' AND run_after <= ?) "
+                "OR (status = 'running' AND lease_until < ?) "
+                "ORDER BY priority DESC, id", (now, now))
+            job = None
+            for row in candidates.fetchall():
+                if row['status'] == 'running' and row['attempts'] >= row['max_attempts']:
+                    # its last worker died
+                    db.execute(
+                        "UPDATE jobs SET status = 'failed', finished = ?, "
+                        "error = 'lease expired', lease_until = NULL WHERE id = ?",
+                        (now, row['id']))
+                    continue
+                limit = limits.get(row['name'])
+                if limit is None or running.get(row['name'], 0) < limit:
+                    job = dict(row)
+                    break
+            if job is None:
+                db.execute('COMMIT')
+                return None
+            job['attempts'] += 1
+            job['worker'] = worker
+            db.execute(
+                "UPDATE jobs SET status = 'running', attempts = ?, lease_until = ?, "
+                "worker = ?, started = ? WHERE id = ?",
+                (job['attempts'], now + lease, worker, now, job['id']))
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        job['args'] = json.loads(job['args'])
+        return job
+
+    def extend(self, job_id, worker, lease=60.0):
+        """
+        Renews the lease of a running job. Returns False if the job was
+        taken over by another worker in the meantime.
+        """
+        cursor = self.db.execute(
+            "UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? "
+            "AND status = 'running'", (time.time() + lease, job_id, worker))
+        return cursor.rowcount == 1
+
+    def complete(self, job, result=None):
+        """
+        Records the result of a claimed job. Returns False if the job is no
+        longer leased to the worker which claimed it, and nothing was
+        recorded.
+        """
+        cursor = self.db.execute(
+            "UPDATE jobs SET status = 'done', finished = ?, result = ?, "
+            "error = NULL, lease_until = NULL WHERE id = ? AND worker = ? "
+            "AND status = 'running'",
+            (time.time(), _json_result(result), job['id'], job['worker']))
+        return cursor.rowcount == 1
+
+    def fail(self, job, error, backoff=10.0, max_backoff=3600.0):
+        """
+        Records a failed attempt. The job is retried after an exponentially
+        growing delay until it has used up its attempts. Returns False like
+        :meth:`complete`.
+        """
+        now = time.time()
+        if job['attempts'] < job['max_attempts']:
+            delay = min(backoff * 2 ** (job['attempts'] - 1), max_backoff)
+            cursor = self.db.execute(
+                "UPDATE jobs SET status = 'queued', run_after = ?, error = ?, "
+                "lease_until = NULL WHERE id = ? AND worker = ? AND status = 'running'",
+                (now + delay, error, job['id'], job['worker']))
+        else:
+            cursor = self.db.execute(
+                "UPDATE jobs SET status = 'failed', finished = ?, error = ?, "
+                "lease_until = NULL WHERE id = ? AND worker = ? AND status = 'running'",
+                (now, error, job['id'], job['worker']))
+        return cursor.rowcount == 1
+
+    def get(self, job_id):
+        row = self.db.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def jobs(self, status=None, limit=100):
+        """
+        Yields the most recent jobs as dicts.
+        """
+        query, params = 'SELECT * FROM jobs', []
+        if status:
+            query += ' WHERE status = ?'
+            params.append(status)
+        query += ' ORDER BY id DESC LIMIT ?'
+        params.append(limit)
+        for row in self.db.execute(query, params):
+            yield dict(row)
+
+    def counts(self):
+        return dict(self.db.execute(
+            'SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+
+
+def _queue_option():
+    return Option('--queue',
+                  dest='queue_path',
+                  metavar='FILE',
+                  help='queue database (default: JOB_QUEUE setting or one per script '
+                       'in the state directory)')
+
+
+def _open_queue(app, queue_path):
+    return JobQueue(queue_path or app.config.get('JOB_QUEUE') or default_queue_path())
+
+
+class Enqueue(Command):
+    """
+    Adds a command line of this manager to the job queue.
+    """
+
+    help = description = 'Adds a command to the job queue'
+
+    def get_options(self):
+        return (
+            _queue_option(),
+            Option('-p', '--priority',
+                   dest='priority',
+                   type=int,
+                   default=0,
+                   help='jobs with higher priority run first (default: 0)'),
+            Option('--max-attempts',
+                   dest='max_attempts',
+                   type=int,
+                   default=3,
+                   help='give up after this many failed attempts (default: 3)'),
+            Option('--delay',
+                   dest='delay',
+                   type=float,
+                   default=0,
+                   metavar='SECONDS',
+                   help='do not run the job before this many seconds from now'),
+            Option('args',
+                   nargs=argparse.REMAINDER,
+                   metavar='COMMAND',
+                   help='the command and its arguments'),
+        )
+
+    def __call__(self, app, queue_path, priority, max_attempts, delay, args):
+        if not args:
+            raise InvalidCommand("Which command should be queued?")
+        # a typo would otherwise only fail, and be retried, in the worker
+        resolve(self.get_manager(), args)
+        queue = _open_queue(app, queue_path)
+        job_id = queue.enqueue(args, priority, max_attempts, delay)
+        print(job_id)
+
+
+class _LeaseRenewer(object):
+    """
+    Renews the lease of the job a worker thread is running. One renewer
+    thread, and so one database connection, serves all jobs of a worker
+    thread.
+    """
+
+    def __init__(self, queue, worker_id, lease):
+        self.queue = queue
+        self.worker_id = worker_id
+        self.lease = lease
+        self.job = None
+        self.lost = False
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        while not self.stopping.wait(self.lease / 3.0):
+            with self.lock:
+                if self.job is not None and not self.queue.extend(
+                        self.job['id'], self.worker_id, self.lease):
+                    # another worker took the job over
+                    self.job, self.lost = None, True
+
+    def hold(self, job):
+        with self.lock:
+            self.job, self.lost = job, False
+
+    def release(self):
+        """
+        Stops renewing the current job; returns whether its lease was kept.
+        """
+        with self.lock:
+            self.job = None
+            return not self.lost
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
+
+
+class Worker(Command):
+    """
+    Runs queued jobs with one warm app.
+
+    :param concurrency: default number of jobs run at the same time
+    :param limits: a dict of command names to the maximum number of jobs
+                   of that command running at the same time, across all
+                   workers
+    :param lease: seconds a claimed job stays with this worker without a
+                  renewal; leases are renewed while the job runs
+    :param backoff: delay before the first retry, in seconds, doubled for
+                    every further attempt
+    """
+
+    help = description = 'Runs jobs from the job queue'
+
+    def __init__(self, concurrency=1, limits=None, lease=60.0, backoff=10.0):
+        self.concurrency = concurrency
+        self.limits = dict(limits or {})
+        self.lease = lease
+        self.backoff = backoff
+
+    def get_options(self):
+        return (
+            _queue_option(),
+            Option('-c', '--concurrency',
+                   dest='concurrency',
+                   type=int,
+                   default=self.concurrency,
+                   help='jobs run at the same time (default: %d)' % self.concurrency),
+            Option('-l', '--limit',
+                   dest='limit',
+                   action='append',
+                   metavar='COMMAND=N',
+                   help='run at most N jobs of COMMAND at the same time'),
+            Option('--poll',
+                   dest='poll',
+                   type=float,
+                   default=1.0,
+                   metavar='SECONDS',
+                   help='how often to look for new jobs when idle (default: 1)'),
+            Option('--burst',
+                   dest='burst',
+                   action='store_true',
+                   help='exit when no job is due'),
+        )
+
+    def parse_limits(self, limit):
+        limits = dict(self.limits)
+        for spec in limit or ():
+            name, _, count = spec.partition('=')
+            try:
+                limits[name] = int(count)
+            except ValueError:
+                raise InvalidCommand("Limits look like COMMAND=N, not %r." % spec)
+        return limits
+
+    def run_job(self, queue, job, dispatch, renewer):
+        renewer.hold(job)
+        started = time.time()
+        error = None
+        try:
+            result = dispatch(job['args'])
+            if isinstance(result, int) and not isinstance(result, bool) and result:
+                raise SystemExit(result)
+        except SystemExit as exc:
+            if exc.code:
+                error = 'exit status %s' % exc.code
+                outcome = 'failed (exit status %s)' % exc.code
+            result = None
+        except Exception:
+            error = traceback.format_exc()
+            outcome = 'failed'
+            traceback.print_exc()
+        finally:
+            kept = renewer.release()
+        # once the lease is lost the job belongs to whichever worker
+        # claimed it next, so its outcome is not recorded here
+        if not kept:
+            return 'lease lost, outcome discarded'
+        if error is None:
+            recorded = queue.complete(job, result)
+            outcome = 'done in %.2fs' % (time.time() - started)
+        else:
+            recorded = queue.fail(job, error, self.backoff)
+        return outcome if recorded else 'lease lost, outcome discarded'
+
+    def __call__(self, app, queue_path, concurrency, limit, poll, burst):
+        queue = _open_queue(app, queue_path)
+        limits = self.parse_limits(limit)
+        manager = self.get_manager()
+        prog = sys.argv[0]
+        base_id = '%s:%d' % (socket.gethostname(), os.getpid())
+        stopping = threading.Event()
+
+        def dispatch(args):
+            return manager.handle(prog, args, app=app)
+
+        def work(number):
+            worker_id = '%s:%d' % (base_id, number)
+            renewer = _LeaseRenewer(queue, worker_id, self.lease)
+            try:
+                while not stopping.is_set():
+                    job = queue.claim(worker_id, self.lease, limits)
+                    if job is None:
+                        if burst:
+                            return
+                        stopping.wait(poll)
+                        continue
+                    print('Job %d (%s), attempt %d: %s' % (
+                        job['id'], ' '.join(job['args']), job['attempts'],
+                        self.run_job(queue, job, dispatch, renewer)),
+                        file=sys.stderr)
+            finally:
+                renewer.stop()
+
+        threads = [threading.Thread(target=work, args=(n,))
+                   for n in range(max(1, concurrency))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(1.0)
+        except KeyboardInterrupt:
+            print(' * Finishing running jobs', file=sys.stderr)
+            stopping.set()
+            for thread in threads:
+                thread.join()
+
+
+class Jobs(Command):
+    """
+    Lists jobs in the queue with their status and results.
+    """
+
+    help = description = 'Lists jobs in the job queue'
+
+    output_fields = ('id', 'command', 'priority', 'status', 'attempts',
+                     'result', 'error')
+
+    def get_options(self):
+        return (
+            _queue_option(),
+            Option('-s', '--status',
+                   dest='status',
+                   choices=STATUSES,
+                   help='only jobs in this state'),
+            Option('-n', '--limit',
+                   dest='limit',
+                   type=int,
+                   default=100,
+                   help='at most this many of the newest jobs (default: 100)'),
+        )
+
+    def run(self, queue_path, status, limit):
+        from flask import current_app
+        queue = _open_queue(current_app, queue_path)
+        for job in queue.jobs(status, limit):
+            error = job['error']
+            yield (job['id'], ' '.join(json.loads(job['args'])), job['priority'],
+                   job['status'], job['attempts'], job['result'],
+                   error.strip().splitlines()[-1] if error else None)
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_script.launcher
+    ~~~~~~~~~~~~~~~~~~~~~
+
+    A fast entry point running commands from a manifest written by
+    ``export-manifest``.
+
+    The launcher checks the command line and prints help from the
+    manifest, without importing Flask or the app.  Commands which do not
+    need an app and are importable functions are then imported and run
+    directly; all others are handed to the manager.
+
+    This module must only use the standard library: ``export-manifest
+    --launcher`` copies it into a standalone script, and importing it as
+    part of the ``flask_script`` package would import Flask.
+"""
+from __future__ import absolute_import, print_function
+
+import os
+import sys
+import json
+import marshal
+import argparse
+from collections import OrderedDict
+
+_STORE = ('dest', 'nargs', 'const', 'default', 'type', 'choices', 'required',
+          'help', 'metavar')
+_CONST = ('dest', 'const', 'default', 'required', 'help', 'metavar')
+_FLAG = ('dest', 'default', 'required', 'help')
+
+#: the arguments each argparse action accepts
+ACTIONS = {
+    'store': _STORE,
+    'append': _STORE,
+    'store_const': _CONST,
+    'append_const': _CONST,
+    'store_true': _FLAG,
+    'store_false': _FLAG,
+    'count': _FLAG,
+    'help': ('dest', 'default', 'help'),
+    'version': ('dest', 'default', 'help', 'version'),
+}
+
+_TYPES = {'int': int, 'float': float, 'str': str}
+
+
+def load_manifest(path):
+    """
+    Reads a manifest; files ending in ``.marshal`` are in marshal format,
+    all others in JSON.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if path.endswith('.marshal'):
+        return marshal.loads(data)
+    return json.loads(data.decode('utf-8'), object_pairs_hook=OrderedDict)
+
+
+def _add_arguments(parser, node):
+    for option in node['options']:
+        kwargs = dict((key, option[key]) for key in ACTIONS[option['action']]
+                      if option.get(key) is not None)
+        kwargs['action'] = option['action']
+        if 'type' in kwargs:
+            kwargs['type'] = _TYPES[kwargs['type']]
+        if option['flags']:
+            parser.add_argument(*option['flags'], **kwargs)
+        else:
+            kwargs.pop('required', None)
+            parser.add_argument(kwargs.pop('dest'), **kwargs)
+
+
+def _build(parser, node, path):
+    _add_arguments(parser, node)
+    if 'commands' not in node:
+        parser.set_defaults(_launcher_path=path)
+        return
+    subparsers = parser.add_subparsers()
+    for name, child in node['commands'].items():
+        subparser = subparsers.add_parser(name,
+                                          usage=child.get('usage'),
+                                          help=child.get('help'),
+                                          description=child.get('description'),
+                                          add_help=False)
+        _build(subparser, child, path + [name])
+
+
+def build_parser(manifest, prog=None):
+    """
+    Returns an ``ArgumentParser`` for the command tree of a manifest.
+    """
+    tree = manifest['tree']
+    parser = argparse.ArgumentParser(prog=prog or manifest.get('prog'),
+                                     usage=tree.get('usage'),
+                                     description=tree.get('description'),
+                                     add_help=False)
+    _build(parser, tree, [])
+    return parser
+
+
+def _find(manifest, path):
+    node = manifest['tree']
+    for name in path:
+        node = node['commands'][name]
+    return node
+
+
+def _import(location):
+    module, _, name = location.partition(':')
+    __import__(module)
+    obj = sys.modules[module]
+    for attr in name.split('.'):
+        obj = getattr(obj, attr)
+    return obj
+
+
+def load_manager(manifest):
+    """
+    Imports the manager the manifest was exported from.
+    """
+    manager = manifest['manager']
+    if 'location' in manager:
+        return _import(manager['location'])
+    import runpy
+    script = manager['script']
+    sys.path.insert(0, os.path.dirname(script))
+    return runpy.run_path(script, run_name='__flask_script__')[manager['attribute']]
+
+
+def main(manifest_path, argv=None, prog=None):
+    """
+    Runs a command line with the manifest at ``manifest_path`` and returns
+    the exit status.
+    """
+    manifest = load_manifest(manifest_path)
+    argv = list(sys.argv[1:] if argv is None else argv)
+    prog = prog or os.path.basename(sys.argv[0])
+    parser = build_parser(manifest, prog)
+    if not argv:
+        parser.print_help()
+        return 2
+
+    namespace, remaining = parser.parse_known_args(argv)
+    path = getattr(namespace, '_launcher_path', None)
+    if path is None:
+        parser.error('too few arguments')
+    node = _find(manifest, path)
+    if remaining and not node.get('capture_all_args'):
+        parser.error('unrecognized arguments: %s' % ' '.join(remaining))
+
+    # options of the manager, e.g. --timeout, need the manager
+    direct = node.get('location') and node.get('direct') and all(
+        getattr(namespace, option['dest'], None) == option.get('default')
+        for option in manifest['tree']['options']
+        if option['action'] not in ('help', 'version'))
+    if direct:
+        func = _import(node['location'])
+        kwargs = dict((option['dest'], getattr(namespace, option['dest']))
+                      for option in node['options']
+                      if option['action'] not in ('help', 'version'))
+        args = [remaining] if node.get('capture_all_args') else []
+        return func(*args, **kwargs)
+
+    manager = load_manager(manifest)
+    try:
+        return manager.handle(prog, argv)
+    except SystemExit as exc:
+        return exc.code
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1], sys.argv[2:]))
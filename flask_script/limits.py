@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_script.limits
+    ~~~~~~~~~~~~~~~~~~~
+
+    Time and resource limits for commands.
+
+    A command may set ``timeout`` (seconds of wall-clock time),
+    ``cpu_limit`` (seconds of CPU time), ``memory_limit`` (bytes of
+    address space) and ``open_files`` (file descriptors), or be added with
+    e.g. ``@manager.command(timeout=600, memory_limit='2G')``.  The
+    ``--timeout``, ``--cpu-limit``, ``--memory-limit`` and
+    ``--max-open-files`` options of the manager override them.
+
+    A command exceeding a limit is stopped with :class:`LimitExceeded`,
+    which the manager reports as an error with exit status 1, instead of
+    running on or being killed by the kernel's OOM killer.
+
+    The time limits use ``SIGALRM`` and ``SIGXCPU``, and the resource
+    limits ``setrlimit``, which apply to the whole process. They are
+    therefore only enforced when the command runs in the main thread on a
+    system which supports them, and a warning is issued otherwise.
+"""
+from __future__ import absolute_import
+
+import re
+import errno
+import signal
+import warnings
+import threading
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from .commands import InvalidCommand
+
+_UNITS = {'': 1, 'k': 1 << 10, 'm': 1 << 20, 'g': 1 << 30, 't': 1 << 40}
+
+
+class LimitExceeded(InvalidCommand):
+    """
+    A command exceeded one of its limits.
+    """
+
+
+def parse_size(value):
+    """
+    Returns a size given in bytes or with a ``K``, ``M``, ``G`` or ``T``
+    suffix (powers of 1024) as a number of bytes.
+    """
+    if isinstance(value, int):
+        return value
+    match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([kmgt]?)i?b?\s*$', value, re.I)
+    if not match:
+        raise ValueError("Invalid size: %r" % value)
+    return int(float(match.group(1)) * _UNITS[match.group(2).lower()])
+
+
+def format_size(size):
+    for unit in 'TGMK':
+        if size >= _UNITS[unit.lower()] and not size % _UNITS[unit.lower()]:
+            return '%d%s' % (size // _UNITS[unit.lower()], unit)
+    return '%d bytes' % size
+
+
+class Limits(object):
+    """
+    Context manager enforcing limits on the code it wraps; limits which
+    are None are not enforced.
+
+    :param timeout: wall-clock seconds
+    :param cpu: CPU seconds, counted from entering the context
+    :param memory: bytes of address space, an int or a string like ``'2G'``
+    :param open_files: number of file descriptors
+    """
+
+    def __init__(self, timeout=None, cpu=None, memory=None, open_files=None):
+        self.timeout = timeout
+        self.cpu = cpu
+        self.memory = parse_size(memory) if memory is not None else None
+        self.open_files = open_files
+        self._timer = False
+        self._saved_signals = []
+        self._saved_limits = []
+
+    def __bool__(self):
+        return any(limit is not None for limit in
+                   (self.timeout, self.cpu, self.memory, self.open_files))
+    __nonzero__ = __bool__
+
+    def _signal(self, signum, message):
+        def handler(signum, frame):
+            raise LimitExceeded(message)
+        self._saved_signals.append((signum, signal.signal(signum, handler)))
+
+    def _setrlimit(self, which, soft):
+        old_soft, hard = resource.getrlimit(which)
+        if hard != resource.RLIM_INFINITY:
+            soft = min(soft, hard)
+        resource.setrlimit(which, (soft, hard))
+        self._saved_limits.append((which, (old_soft, hard)))
+
+    def __enter__(self):
+        if not self:
+            return self
+        if not isinstance(threading.current_thread(), threading._MainThread):
+            warnings.warn("Command limits are only enforced in the main thread.")
+            return self
+
+        if self.timeout is not None:
+            if hasattr(signal, 'setitimer'):
+                self._signal(signal.SIGALRM,
+                             "Timeout of %gs exceeded." % self.timeout)
+                signal.setitimer(signal.ITIMER_REAL, self.timeout)
+                self._timer = True
+            else:
+                warnings.warn("Timeouts are not supported on this system.")
+
+        if self.cpu is None and self.memory is None and self.open_files is None:
+            return self
+        if resource is None:
+            warnings.warn("Resource limits are not supported on this system.")
+            return self
+        if self.cpu is not None:
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            used = usage.ru_utime + usage.ru_stime
+            self._signal(signal.SIGXCPU, "CPU time limit of %gs exceeded." % self.cpu)
+            # the kernel counts whole seconds of the process' CPU time
+            self._setrlimit(resource.RLIMIT_CPU, int(used + self.cpu + 0.999))
+        if self.memory is not None:
+            self._setrlimit(resource.RLIMIT_AS, self.memory)
+        if self.open_files is not None:
+            self._setrlimit(resource.RLIMIT_NOFILE, self.open_files)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if self._timer:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            self._timer = False
+        while self._saved_limits:
+            which, limits = self._saved_limits.pop()
+            resource.setrlimit(which, limits)
+        while self._saved_signals:
+            signum, handler = self._saved_signals.pop()
+            signal.signal(signum, handler)
+
+        if exc_type is MemoryError and self.memory is not None:
+            raise LimitExceeded("Memory limit of %s exceeded." %
+                                format_size(self.memory))
+        if exc_type is not None and issubclass(exc_type, EnvironmentError) and \
+                getattr(exc_value, 'errno', None) == errno.EMFILE and \
+                self.open_files is not None:
+            raise LimitExceeded("Limit of %d open files exceeded." % self.open_files)
+        return False
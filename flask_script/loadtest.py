@@ -0,0 +1,370 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_script.loadtest
+    ~~~~~~~~~~~~~~~~~~~~~
+
+    The ``loadtest`` command: drives the app with concurrent HTTP
+    connections and reports throughput and latency.
+
+    Typical usage::
+
+        from flask_script.loadtest import LoadTest
+
+        manager.add_command('loadtest', LoadTest())
+
+    and then::
+
+        python manage.py loadtest -c 20 -d 30 / /about /api/items
+"""
+from __future__ import absolute_import, print_function
+
+import os
+import sys
+import time
+import random
+import socket
+import logging
+import threading
+
+try:
+    from http.client import HTTPConnection, HTTPSConnection
+    from urllib.parse import urlsplit
+except ImportError:  # Python 2
+    from httplib import HTTPConnection, HTTPSConnection
+    from urlparse import urlsplit
+
+from .commands import Command, Option, InvalidCommand
+from .engines import ENGINES, engine_available
+from .stats import Histogram
+
+
+class Scenario(object):
+    """
+    A weighted list of requests.
+
+    A scenario file has one request per line: an optional weight, an
+    optional method and the path, e.g.::
+
+        # weight method path
+        10 GET /
+        3 /items
+        1 HEAD /static/app.js
+
+    Empty lines and lines starting with ``#`` are ignored.
+    """
+
+    def __init__(self, requests):
+        if not requests:
+            raise InvalidCommand("No URLs to request.")
+        self.requests = [(method, path) for weight, method, path in requests]
+        self.cumulative = []
+        total = 0
+        for weight, method, path in requests:
+            total += weight
+            self.cumulative.append(total)
+        self.total = total
+
+    @classmethod
+    def from_urls(cls, urls):
+        return cls([(1, 'GET', url) for url in urls])
+
+    @classmethod
+    def from_file(cls, filename):
+        requests = []
+        with open(filename) as f:
+            for line in f:
+                fields = line.split()
+                if not fields or fields[0].startswith('#'):
+                    continue
+                weight = 1
+                if fields[0].isdigit():
+                    weight = int(fields.pop(0))
+                method = fields.pop(0).upper() if len(fields) > 1 else 'GET'
+                requests.append((weight, method, fields[0]))
+        return cls(requests)
+
+    def choose(self, rnd):
+        point = rnd.random() * self.total
+        for index, bound in enumerate(self.cumulative):
+            if point < bound:
+                return self.requests[index]
+        return self.requests[-1]
+
+
+class LoadResult(object):
+    """
+    Counters collected by one client thread, or merged from all of them.
+    Latencies are in microseconds.
+    """
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.statuses = {}
+        self.errors = {}
+        self.bytes_in = 0
+
+    def merge(self, other):
+        self.latency.merge(other.latency)
+        for key, count in other.statuses.items():
+            self.statuses[key] = self.statuses.get(key, 0) + count
+        for key, count in other.errors.items():
+            self.errors[key] = self.errors.get(key, 0) + count
+        self.bytes_in += other.bytes_in
+
+    @property
+    def failed(self):
+        return (sum(self.errors.values()) +
+                sum(n for status, n in self.statuses.items() if status >= 400))
+
+
+def _connection(base, timeout=None):
+    parts = urlsplit(base)
+    kwargs = {} if timeout is None else dict(timeout=timeout)
+    if parts.scheme == 'https':
+        return HTTPSConnection(parts.hostname, parts.port or 443, **kwargs)
+    return HTTPConnection(parts.hostname, parts.port or 80, **kwargs)
+
+
+def _client(base, scenario, deadline, remaining, lock, result, seed):
+    rnd = random.Random(seed)
+    prefix = urlsplit(base).path.rstrip('/')
+    conn = _connection(base)
+    while True:
+        if deadline is not None and time.time() >= deadline:
+            break
+        if remaining is not None:
+            with lock:
+                if remaining[0] <= 0:
+                    break
+                remaining[0] -= 1
+
+        method, path = scenario.choose(rnd)
+        started = time.time()
+        try:
+            conn.request(method, prefix + path)
+            response = conn.getresponse()
+            body = response.read()
+        except (socket.error, IOError, OSError) as exc:
+            result.errors[type(exc).__name__] = result.errors.get(type(exc).__name__, 0) + 1
+            conn.close()
+            conn = _connection(base)
+            continue
+        result.latency.record((time.time() - started) * 1e6)
+        result.statuses[response.status] = result.statuses.get(response.status, 0) + 1
+        result.bytes_in += len(body)
+        if response.will_close:
+            conn.close()
+    conn.close()
+
+
+def run_load(base, scenario, concurrency=10, requests=None, duration=None):
+    """
+    Requests ``base`` plus the scenario's paths from ``concurrency``
+    threads, until ``requests`` requests were sent or ``duration``
+    seconds have passed. Returns the merged :class:`LoadResult` and the
+    elapsed time.
+    """
+    deadline = time.time() + duration if duration else None
+    remaining = [requests] if requests else None
+    lock = threading.Lock()
+    results = [LoadResult() for _ in range(concurrency)]
+    threads = [threading.Thread(target=_client,
+                                args=(base, scenario, deadline, remaining,
+                                      lock, results[i], i))
+               for i in range(concurrency)]
+
+    started = time.time()
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - started
+
+    total = LoadResult()
+    for result in results:
+        total.merge(result)
+    return total, elapsed
+
+
+def process_usage(pid=None):
+    """
+    Returns CPU seconds used and peak RSS in bytes of the given
+    process (default: this one), or None if that cannot be determined.
+    """
+    pid = pid or os.getpid()
+    try:
+        with open('/proc/%d/stat' % pid) as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        ticks = os.sysconf('SC_CLK_TCK')
+        cpu = (int(fields[11]) + int(fields[12])) / float(ticks)
+        rss = 0
+        with open('/proc/%d/status' % pid) as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    rss = int(line.split()[1]) * 1024
+        return cpu, rss
+    except (IOError, OSError, IndexError, ValueError):
+        pass
+    if pid != os.getpid():
+        return None
+    try:
+        import resource
+    except ImportError:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    rss = usage.ru_maxrss
+    if not sys.platform == 'darwin':
+        rss *= 1024
+    return usage.ru_utime + usage.ru_stime, rss
+
+
+def start_server(app, engine='werkzeug', host='127.0.0.1', timeout=10):
+    """
+    Serves the app from a background thread on an ephemeral port, using
+    the given :mod:`~flask_script.engines` engine. Returns the base URL.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind((host, 0))
+    port = sock.getsockname()[1]
+    sock.close()
+
+    # the per-request log would dominate the measurement
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    thread = threading.Thread(target=ENGINES[engine], args=(app,),
+                              kwargs=dict(host=host,
+                                          port=port,
+                                          use_debugger=False,
+                                          use_reloader=False,
+                                          threaded=True,
+                                          processes=1,
+                                          passthrough_errors=False,
+                                          ssl_context=None))
+    thread.daemon = True
+    thread.start()
+
+    deadline = time.time() + timeout
+    while True:
+        try:
+            socket.create_connection((host, port), 1).close()
+            break
+        except socket.error:
+            if time.time() > deadline or not thread.is_alive():
+                raise InvalidCommand("The server did not start.")
+            time.sleep(0.05)
+    return 'http://%s:%d' % (host, port)
+
+
+def format_report(result, elapsed, usage=None):
+    """
+    Returns a human-readable report of a load test.
+    """
+    latency = result.latency
+    lines = [
+        'Requests:      %d in %.2fs' % (latency.count, elapsed),
+        'Throughput:    %.1f requests/s, %.1f KiB/s' % (
+            latency.count / elapsed, result.bytes_in / 1024.0 / elapsed),
+        'Latency (ms):  mean %.2f  p50 %.2f  p90 %.2f  p99 %.2f  max %.2f' % (
+            latency.mean / 1000.0, latency.percentile(50) / 1000.0,
+            latency.percentile(90) / 1000.0, latency.percentile(99) / 1000.0,
+            latency.max / 1000.0),
+        'Status codes:  %s' % ', '.join('%d: %d' % item for item in
+                                        sorted(result.statuses.items())),
+    ]
+    attempts = latency.count + sum(result.errors.values())
+    lines.append('Errors:        %d (%.2f%%)%s' % (
+        result.failed, 100.0 * result.failed / attempts if attempts else 0,
+        ''.join(', %s: %d' % item for item in sorted(result.errors.items()))))
+    if usage is not None:
+        cpu, rss = usage
+        lines.append('Server:        %.2fs CPU (%.0f%%), %.1f MiB peak RSS' % (
+            cpu, 100.0 * cpu / elapsed, rss / 1048576.0))
+    return '\n'.join(lines)
+
+
+class LoadTest(Command):
+    """
+    Runs an HTTP load test against the app.
+
+    Unless a running server is given with ``--url``, the app is served
+    in-process on an ephemeral port, through the same server engines the
+    :class:`~flask_script.Server` command uses. Note that client and
+    server then share this process (and the GIL), and the reported CPU
+    and memory usage include both.
+
+    :param concurrency: default number of concurrent connections
+    :param duration: default test duration in seconds
+    :param engine: default server engine for in-process tests
+    """
+
+    help = description = 'Runs an HTTP load test against the app'
+
+    def __init__(self, concurrency=10, duration=10, engine='werkzeug'):
+        self.concurrency = concurrency
+        self.duration = duration
+        self.engine = engine
+
+    def get_options(self):
+        return (
+            Option('urls',
+                   nargs='*',
+                   metavar='PATH',
+                   help='paths to request (default: /)'),
+            Option('-s', '--scenario',
+                   dest='scenario',
+                   metavar='FILE',
+                   help='file with weighted requests, one "[weight] [method] path" per line'),
+            Option('-c', '--concurrency',
+                   dest='concurrency',
+                   type=int,
+                   default=self.concurrency,
+                   help='number of concurrent connections (default: %d)' % self.concurrency),
+            Option('-n', '--requests',
+                   dest='requests',
+                   type=int,
+                   help='stop after this many requests'),
+            Option('-d', '--duration',
+                   dest='duration',
+                   type=float,
+                   default=self.duration,
+                   help='stop after this many seconds (default: %s)' % self.duration),
+            Option('--url',
+                   dest='target',
+                   metavar='URL',
+                   help='base URL of an already running server'),
+            Option('--engine',
+                   dest='engine',
+                   choices=list(ENGINES),
+                   default=self.engine,
+                   help='server engine for in-process tests (default: %s)' % self.engine),
+            Option('--server-pid',
+                   dest='server_pid',
+                   type=int,
+                   help='report CPU and memory usage of this server process'),
+        )
+
+    def __call__(self, app, urls, scenario, concurrency, requests, duration,
+                 target, engine, server_pid):
+        if scenario:
+            plan = Scenario.from_file(scenario)
+        else:
+            plan = Scenario.from_urls(urls or ['/'])
+        if requests:
+            duration = None
+
+        if target is None:
+            if not engine_available(engine):
+                raise InvalidCommand("The %s engine is not installed." % engine)
+            target = start_server(app, engine)
+            server_pid = os.getpid()
+
+        before = process_usage(server_pid) if server_pid else None
+        result, elapsed = run_load(target, plan, concurrency, requests, duration)
+        usage = None
+        if before is not None:
+            after = process_usage(server_pid)
+            if after is not None:
+                usage = (after[0] - before[0], after[1])
+
+        print(format_report(result, elapsed, usage))
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_script.lock
+    ~~~~~~~~~~~~~~~~~
+
+    Single-instance locks for commands.
+
+    A command with a ``lock`` attribute (or added with
+    ``@manager.command(lock=True)``) takes an exclusive lock on a lock file
+    before it runs, so that e.g. overlapping cron runs do not execute it
+    twice at the same time.  The lock file holds the PID of its owner.
+
+    Where ``fcntl`` is available the lock is an ``flock``, which the
+    operating system releases when the process dies.  Elsewhere the lock
+    file is created exclusively, and a file left behind by a process which
+    is no longer running is treated as stale and removed.
+"""
+from __future__ import absolute_import
+
+import os
+import time
+import errno
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from ._state import command_state_path
+
+#: what to do if the lock is held by another process
+POLICIES = ('skip', 'wait', 'fail')
+
+
+def pid_alive(pid):
+    """
+    Returns whether a process with the given PID exists.
+    """
+    try:
+        os.kill(pid, 0)
+    except OSError as exc:
+        return exc.errno == errno.EPERM
+    return True
+
+
+def lock_path(names):
+    """
+    Returns the lock file of the command reached through ``names`` in the
+    current management script.
+    """
+    return command_state_path('locks', names, '.lock')
+
+
+class CommandLock(object):
+    """
+    An exclusive lock on ``path``.
+
+    :param policy: ``skip`` or ``fail`` make :meth:`acquire` return False
+                   at once if another process holds the lock, ``wait``
+                   waits for it
+    :param timeout: with ``wait``, give up after this many seconds
+    """
+
+    poll_interval = 0.1
+
+    def __init__(self, path, policy='skip', timeout=None):
+        if policy not in POLICIES:
+            raise ValueError("Unknown lock policy %r, use one of %s" %
+                             (policy, ', '.join(POLICIES)))
+        self.path = path
+        self.policy = policy
+        self.timeout = timeout
+        self.fd = None
+
+    def owner(self):
+        """
+        Returns the PID written to the lock file, or None.
+        """
+        try:
+            with open(self.path) as f:
+                return int(f.read().strip() or 0) or None
+        except (IOError, OSError, ValueError):
+            return None
+
+    def acquire(self):
+        """
+        Takes the lock and returns True, or returns False if it is held
+        by another process and the policy does not allow to wait (any
+        longer).
+        """
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+
+        deadline = None
+        if self.policy == 'wait' and self.timeout is not None:
+            deadline = time.time() + self.timeout
+        while True:
+            if self._try_acquire(blocking=self.policy == 'wait' and deadline is None):
+                self._write_pid()
+                return True
+            if self.policy != 'wait' or time.time() >= deadline:
+                return False
+            time.sleep(self.poll_interval)
+
+    def _try_acquire(self, blocking):
+        if fcntl is not None:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.FD_CLOEXEC)
+                fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except (IOError, OSError) as exc:
+                os.close(fd)
+                if exc.errno in (errno.EAGAIN, errno.EACCES, errno.EWOULDBLOCK):
+                    return False
+                raise
+            self.fd = fd
+            return True
+
+        while True:
+            try:
+                self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o644)
+                return True
+            except OSError as exc:
+                if exc.errno != errno.EEXIST:
+                    raise
+            pid = self.owner()
+            if pid is None:
+                # the owner may not have written its PID yet
+                try:
+                    fresh = time.time() - os.path.getmtime(self.path) < 5
+                except OSError:
+                    continue
+            if pid is None and fresh or pid is not None and pid_alive(pid):
+                if not blocking:
+                    return False
+                time.sleep(self.poll_interval)
+                continue
+            # stale: its owner died without removing it
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    def _write_pid(self):
+        os.ftruncate(self.fd, 0)
+        os.lseek(self.fd, 0, os.SEEK_SET)
+        os.write(self.fd, ('%d\n' % os.getpid()).encode('ascii'))
+
+    def release(self):
+        if self.fd is None:
+            return
+        os.ftruncate(self.fd, 0)
+        if fcntl is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            os.close(self.fd)
+        else:
+            os.close(self.fd)
+            os.remove(self.path)
+        self.fd = None
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_script.manifest
+    ~~~~~~~~~~~~~~~~~~~~~
+
+    Exporting the command tree of a manager for :mod:`flask_script.launcher`.
+
+    The manifest describes every command: its options, help texts, where
+    the function it runs can be imported from, and whether it can run
+    without the app.  It is written as JSON, or in ``marshal`` format,
+    which loads faster but only in the Python version which wrote it.
+"""
+from __future__ import absolute_import, print_function
+
+import os
+import sys
+import json
+import time
+import marshal
+import inspect
+import argparse
+from collections import OrderedDict
+
+from .commands import Command, Option
+from . import launcher
+
+_ACTION_NAMES = {
+    argparse._StoreAction: 'store',
+    argparse._StoreConstAction: 'store_const',
+    argparse._StoreTrueAction: 'store_true',
+    argparse._StoreFalseAction: 'store_false',
+    argparse._AppendAction: 'append',
+    argparse._AppendConstAction: 'append_const',
+    argparse._CountAction: 'count',
+    argparse._HelpAction: 'help',
+    argparse._VersionAction: 'version',
+}
+
+_TYPE_NAMES = {int: 'int', float: 'float', str: 'str'}
+try:
+    _TYPE_NAMES[unicode] = 'str'
+except NameError:  # Python 3
+    pass
+
+
+def _serializable(value):
+    try:
+        json.dumps(value)
+    except (TypeError, ValueError):
+        return False
+    return True
+
+
+def describe_action(action):
+    """
+    Returns a manifest entry for an argparse action, and whether the
+    launcher reproduces it exactly.
+    """
+    name = _ACTION_NAMES.get(type(action))
+    exact = name is not None
+    option = OrderedDict(flags=list(action.option_strings),
+                         action=name or 'store')
+    for key in launcher.ACTIONS[option['action']]:
+        value = getattr(action, key, None)
+        if key == 'type' and value is not None:
+            exact = exact and value in _TYPE_NAMES
+            value = _TYPE_NAMES.get(value)
+        elif key == 'choices' and value is not None:
+            value = list(value)
+        if value is not None and not _serializable(value):
+            exact = False
+            value = None
+        if value is not None and (key != 'required' or value):
+            option[key] = value
+    return option, exact
+
+
+def _describe_parser(parser):
+    options = []
+    exact = True
+    subparsers = None
+    for action in parser._actions:
+        if isinstance(action, argparse._SubParsersAction):
+            subparsers = action
+            continue
+        option, ok = describe_action(action)
+        options.append(option)
+        exact = exact and ok
+    return options, exact, subparsers
+
+
+def function_location(func):
+    """
+    Returns ``module:name`` if ``func`` can be imported under that name
+    from a module other than ``__main__``, else None.
+    """
+    module = getattr(func, '__module__', None)
+    name = getattr(func, '__qualname__', None) or getattr(func, '__name__', None)
+    if not inspect.isfunction(func) or module in (None, '__main__') or \
+            not name or '<' in name:
+        return None
+    obj = sys.modules.get(module)
+    for attr in name.split('.'):
+        obj = getattr(obj, attr, None)
+    if obj is not func:
+        return None
+    return '%s:%s' % (module, name)
+
+
+_command_call = getattr(Command.__call__, '__func__', Command.__call__)
+
+
+def count_commands(node):
+    """
+    Returns the number of commands in a manifest (sub)tree.
+    """
+    if 'commands' not in node:
+        return 1
+    return sum(count_commands(child) for child in node['commands'].values())
+
+
+def _runs_directly(command):
+    """
+    Returns whether the launcher may call the command's function itself,
+    i.e. the command needs no app and nothing the manager does around it.
+    """
+    if getattr(command, 'needs_app', True):
+        return False
+    call = type(command).__call__
+    if getattr(call, '__func__', call) is not _command_call:
+        return False
+    if inspect.isgeneratorfunction(command.run):
+        return False
+    return not any(getattr(command, attribute, None) for attribute in (
+        'lock', 'cache', 'inputs', 'outputs', 'timeout', 'cpu_limit',
+        'memory_limit', 'open_files', 'input_records'))
+
+
+def describe(command, parser):
+    """
+    Returns the manifest entry of a manager or command and its parser.
+    """
+    options, exact, subparsers = _describe_parser(parser)
+    node = OrderedDict(usage=parser.usage, description=parser.description)
+    if subparsers is not None:
+        helps = dict((action.dest, action.help)
+                     for action in subparsers._choices_actions)
+        node['options'] = options
+        node['commands'] = OrderedDict()
+        for name, subparser in subparsers.choices.items():
+            child = describe(command._commands[name], subparser)
+            child['help'] = helps.get(name)
+            node['commands'][name] = child
+        return node
+
+    node['options'] = options
+    node['capture_all_args'] = bool(getattr(command, 'capture_all_args', False))
+    node['location'] = function_location(getattr(command, 'run', None))
+    node['direct'] = bool(exact and node['location'] and _runs_directly(command))
+    return node
+
+
+def manager_location(manager):
+    """
+    Returns where the launcher finds ``manager``: an importable
+    ``location``, or the ``script`` which defines it as ``attribute``.
+    """
+    main = None
+    for name, module in list(sys.modules.items()):
+        for attr, value in list(getattr(module, '__dict__', {}).items()):
+            if value is manager:
+                # __main__ and its aliases, e.g. multiprocessing's __mp_main__
+                if not name.startswith('__'):
+                    return dict(location='%s:%s' % (name, attr))
+                main = attr
+    if main is None:
+        raise ValueError("The manager is not a module-level variable.")
+    return dict(script=os.path.abspath(sys.argv[0]), attribute=main)
+
+
+def build_manifest(manager, prog=None):
+    """
+    Returns the manifest of a manager's command tree.
+    """
+    prog = prog or os.path.basename(sys.argv[0])
+    manager.set_defaults()
+    parser = manager.create_parser(prog)
+    return OrderedDict(version=1,
+                       created=time.time(),
+                       prog=prog,
+                       manager=manager_location(manager),
+                       tree=describe(manager, parser))
+
+
+def write_manifest(manifest, path):
+    """
+    Writes a manifest as marshal data if ``path`` ends in ``.marshal``,
+    else as JSON.
+    """
+    if path.endswith('.marshal'):
+        data = marshal.dumps(json.loads(json.dumps(manifest)))
+    else:
+        data = json.dumps(manifest, separators=(',', ':')).encode('utf-8')
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.rename(tmp, path)
+
+
+def write_launcher(path, manifest_path):
+    """
+    Writes a script which runs commands with :func:`launcher.main` and the
+    manifest at ``manifest_path``, relative to the script.
+    """
+    source = inspect.getsource(launcher)
+    source = source[:source.rindex("\nif __name__ == '__main__':")]
+    manifest_path = os.path.relpath(os.path.abspath(manifest_path),
+                                    os.path.dirname(os.path.abspath(path)))
+    with open(path, 'w') as f:
+        f.write('#!%s\n' % (sys.executable or '/usr/bin/env python'))
+        f.write(source)
+        f.write("\n\nif __name__ == '__main__':\n"
+                "    sys.exit(main(os.path.join(os.path.dirname(os.path.abspath(__file__)),\n"
+                "                               %r)))\n" % manifest_path)
+    os.chmod(path, 0o755)
+
+
+class ExportManifest(Command):
+    """
+    Writes the command tree to a manifest for the launcher.
+    """
+
+    help = description = 'Write the command tree to a manifest for a fast launcher'
+
+    def get_options(self):
+        return (
+            Option('path',
+                   nargs='?',
+                   default='manage.json',
+                   help='manifest file, in marshal format if it ends in .marshal '
+                        '(default: manage.json)'),
+            Option('--launcher',
+                   dest='launcher_file',
+                   metavar='FILE',
+                   help='also write a launcher script using the manifest'),
+        )
+
+    def __call__(self, app, path, launcher_file):
+        manifest = build_manifest(self.get_manager())
+        write_manifest(manifest, path)
+        if launcher_file:
+            write_launcher(launcher_file, path)
+        print('Wrote %d commands to %s' % (count_commands(manifest['tree']), path),
+              file=sys.stderr)
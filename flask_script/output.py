@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_script.output
+    ~~~~~~~~~~~~~~~~~~~
+
+    Structured output for commands.
+
+    A command whose ``run`` method is a generator yields records (dicts,
+    tuples or plain values) instead of printing them.  The
+    :class:`~flask_script.Manager` then writes them in the format selected
+    with ``--output-format``, to stdout or to the file given with
+    ``--output``, one record at a time.  Tuples are turned into mappings
+    using the command's ``output_fields`` where a format needs names.
+
+    A command with ``input_records`` set consumes records: it is passed
+    them as its ``records`` argument, from the previous stage of a
+    :mod:`~flask_script.pipeline` or as JSON lines from stdin.
+"""
+from __future__ import absolute_import
+
+import io
+import sys
+import csv
+import json
+import gzip
+
+from ._compat import PY2, text_type, string_types, module_available
+from .commands import InvalidCommand
+
+#: flush the output whenever this many bytes have accumulated
+BUFFER_SIZE = 64 * 1024
+
+
+class Formatter(object):
+    """
+    Base class for output formats. Subclasses implement :meth:`format`,
+    returning the encoded record.
+
+    :param stream: binary file to write to
+    :param fields: names for the items of tuple records
+    """
+
+    def __init__(self, stream, fields=None):
+        self.stream = stream
+        self.fields = tuple(fields) if fields else None
+        self.chunks = []
+        self.size = 0
+
+    def as_mapping(self, record):
+        if isinstance(record, dict):
+            return record
+        if isinstance(record, (tuple, list)) and self.fields:
+            return dict(zip(self.fields, record))
+        return record
+
+    def _write(self, data):
+        self.chunks.append(data)
+        self.size += len(data)
+        if self.size >= BUFFER_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.chunks:
+            self.stream.write(b''.join(self.chunks))
+            self.chunks = []
+            self.size = 0
+        self.stream.flush()
+
+    def begin(self):
+        pass
+
+    def write(self, record):
+        self._write(self.format(record))
+
+    def end(self):
+        self.flush()
+
+    def format(self, record):
+        raise NotImplementedError
+
+
+class TextFormatter(Formatter):
+    """
+    One line per record, items separated by two spaces.
+    """
+
+    def format(self, record):
+        if isinstance(record, dict):
+            line = '  '.join('%s=%s' % item for item in record.items())
+        elif isinstance(record, (tuple, list)):
+            line = '  '.join(text_type(value) for value in record)
+        else:
+            line = text_type(record)
+        return (line + '\n').encode('utf-8')
+
+
+class JsonLinesFormatter(Formatter):
+    """
+    One JSON document per line.
+    """
+
+    def format(self, record):
+        return (json.dumps(self.as_mapping(record), default=text_type) +
+                '\n').encode('utf-8')
+
+
+class JsonFormatter(JsonLinesFormatter):
+    """
+    A single JSON array, written incrementally.
+    """
+
+    first = True
+
+    def begin(self):
+        self._write(b'[')
+
+    def format(self, record):
+        data = json.dumps(self.as_mapping(record), default=text_type).encode('utf-8')
+        if self.first:
+            self.first = False
+            return b'\n' + data
+        return b',\n' + data
+
+    def end(self):
+        self._write(b'\n]\n' if not self.first else b']\n')
+        self.flush()
+
+
+class CsvFormatter(Formatter):
+    """
+    Comma separated values, with a header line if field names are known.
+    The columns of dict records are the command's ``output_fields``, or
+    else the keys of the first record; a later record with other keys is
+    an error rather than silently cut down.
+    """
+
+    delimiter = ','
+
+    def begin(self):
+        self.buffer = io.BytesIO() if PY2 else io.StringIO()
+        self.writer = csv.writer(self.buffer, delimiter=self.delimiter,
+                                 lineterminator='\n')
+        self.header = False
+
+    def format(self, record):
+        if isinstance(record, dict):
+            if self.fields is None:
+                self.fields = tuple(record)
+            unknown = set(record).difference(self.fields)
+            if unknown:
+                raise InvalidCommand(
+                    "Record has fields not in the columns (%s): %s" % (
+                        ', '.join(self.fields),
+                        ', '.join(sorted(map(str, unknown)))))
+            record = [record.get(field) for field in self.fields]
+        elif not isinstance(record, (tuple, list)):
+            record = [record]
+        if not self.header and self.fields:
+            self._row(self.fields)
+        self.header = True
+        self._row(record)
+        data = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return data if PY2 else data.encode('utf-8')
+
+    def _row(self, values):
+        if PY2:
+            values = [v.encode('utf-8') if isinstance(v, text_type) else v
+                      for v in values]
+        self.writer.writerow(values)
+
+
+class TsvFormatter(CsvFormatter):
+    """
+    Tab separated values.
+    """
+
+    delimiter = '\t'
+
+
+class MsgpackFormatter(Formatter):
+    """
+    A stream of MessagePack objects. Needs the ``msgpack`` package.
+    """
+
+    def begin(self):
+        if not module_available('msgpack'):
+            raise InvalidCommand("The msgpack output format needs the msgpack package.")
+        import msgpack
+        self.packer = msgpack.Packer(default=text_type)
+
+    def format(self, record):
+        return self.packer.pack(self.as_mapping(record))
+
+
+FORMATTERS = {
+    'text': TextFormatter,
+    'json': JsonFormatter,
+    'jsonl': JsonLinesFormatter,
+    'csv': CsvFormatter,
+    'tsv': TsvFormatter,
+    'msgpack': MsgpackFormatter,
+}
+
+
+def _stdout():
+    sys.stdout.flush()
+    return getattr(sys.stdout, 'buffer', sys.stdout)
+
+
+def write_records(records, format='text', output=None, fields=None,
+                  text_formatter=None):
+    """
+    Writes records to ``output`` (a file name, compressed if it ends in
+    ``.gz``) or to stdout.
+
+    :param records: an iterable of dicts, tuples or plain values
+    :param format: one of the names in :data:`FORMATTERS`
+    :param fields: names for the items of tuple records
+    :param text_formatter: a callable taking the records and returning
+                           lines, used for the ``text`` format instead of
+                           :class:`TextFormatter`
+    """
+    if output is None:
+        stream = _stdout()
+    elif output.endswith('.gz'):
+        stream = gzip.open(output, 'wb')
+    else:
+        stream = open(output, 'wb')
+
+    try:
+        if format == 'text' and text_formatter is not None:
+            formatter = Formatter(stream)
+            for line in text_formatter(records):
+                formatter._write((line + '\n').encode('utf-8')
+                                 if isinstance(line, string_types) else line)
+            formatter.flush()
+            return
+
+        formatter = FORMATTERS[format](stream, fields)
+        formatter.begin()
+        write = formatter.write
+        for record in records:
+            write(record)
+        formatter.end()
+    finally:
+        if output is not None:
+            stream.close()
+
+
+def read_records(stream=None):
+    """
+    Yields the records in JSON lines format on ``stream``, stdin by
+    default, e.g. from another command's ``--output-format jsonl``.
+    """
+    if stream is None:
+        stream = sys.stdin
+    for line in stream:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_script.pipeline
+    ~~~~~~~~~~~~~~~~~~~~~
+
+    Streaming records between commands in one process.
+
+    The :class:`Pipe` command runs commands as the stages of a pipeline::
+
+        manager.add_command('pipe', Pipe())
+
+        $ python manage.py pipe "extract --since 2024" "transform" "load --table x"
+
+    Each stage runs in its own thread (or forked process with
+    ``--processes``) with the same app.  The records a stage yields are
+    passed, without serializing them, to the next stage, whose command
+    has ``input_records`` set and gets them as its ``records`` argument.
+    Stages are connected with bounded queues, so a fast stage waits for a
+    slow one instead of buffering everything.  The records of the last
+    stage are written like those of any other command, see
+    :mod:`flask_script.output`.
+"""
+from __future__ import absolute_import, print_function
+
+import sys
+import types
+import threading
+import traceback
+
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+
+from .commands import Command, Option, InvalidCommand
+from .graph import parse_command_line, resolve
+from .workers import fork_context
+
+_RECORDS = 'records'
+_END = 'end'
+
+
+class StageFailed(InvalidCommand):
+    """
+    A stage of a pipeline failed.
+    """
+
+
+class _Aborted(Exception):
+    pass
+
+
+def _put(outbox, item, abort):
+    while not abort.is_set():
+        try:
+            outbox.put(item, True, 0.1)
+            return
+        except queue.Full:
+            continue
+    raise _Aborted()
+
+
+def _receive(inbox, abort):
+    """
+    Yields the records arriving in ``inbox`` until the previous stage is
+    done; raises :class:`_Aborted` if the pipeline is stopped.
+    """
+    while True:
+        try:
+            kind, value = inbox.get(True, 0.1)
+        except queue.Empty:
+            if abort.is_set():
+                raise _Aborted()
+            continue
+        if kind == _END:
+            return
+        for record in value:
+            yield record
+
+
+def run_stage(dispatch, line, inbox, outbox, abort, errors, batch=100):
+    """
+    Runs one stage: calls ``dispatch`` with the stage's command line and
+    the records arriving in ``inbox``, and sends the records it yields to
+    ``outbox`` in lists of up to ``batch``.
+    """
+    result = None
+    try:
+        records = _receive(inbox, abort) if inbox is not None else None
+        try:
+            result = dispatch(list(line), records)
+        except SystemExit as exc:
+            result = exc.code
+        if isinstance(result, types.GeneratorType):
+            chunk = []
+            for record in result:
+                chunk.append(record)
+                if len(chunk) >= batch:
+                    _put(outbox, (_RECORDS, chunk), abort)
+                    chunk = []
+            if chunk:
+                _put(outbox, (_RECORDS, chunk), abort)
+        elif result and not isinstance(result, bool) and isinstance(result, int):
+            raise StageFailed("exit status %d" % result)
+        _put(outbox, (_END, None), abort)
+    except _Aborted:
+        pass
+    except Exception as exc:
+        if not isinstance(exc, InvalidCommand):
+            traceback.print_exc()
+        errors.put('%s: %s' % (' '.join(line), exc))
+        abort.set()
+    finally:
+        if isinstance(result, types.GeneratorType):
+            result.close()
+
+
+class Pipeline(object):
+    """
+    Runs command lines as connected stages; iterating over it yields the
+    records of the last stage.
+
+    :param dispatch: called with a command line and the records of the
+                     previous stage (None for the first stage), returns
+                     the records of this stage
+    :param queue_size: number of lists of records waiting between stages
+    :param batch: records per list
+    :param processes: run stages in forked processes instead of threads;
+                      records are then pickled
+    """
+
+    def __init__(self, lines, dispatch, queue_size=16, batch=100,
+                 processes=False):
+        self.lines = [parse_command_line(line) for line in lines]
+        self.dispatch = dispatch
+        self.queue_size = queue_size
+        self.batch = batch
+        self.processes = processes
+
+    def __iter__(self):
+        if self.processes:
+            context = fork_context()
+            if context is None:
+                raise InvalidCommand("Running stages in processes needs fork.")
+            Queue, Event, Worker = context.Queue, context.Event, context.Process
+        else:
+            Queue, Event, Worker = queue.Queue, threading.Event, threading.Thread
+
+        abort = Event()
+        errors = Queue()
+        queues = [Queue(self.queue_size) for line in self.lines]
+        workers = []
+        for i, line in enumerate(self.lines):
+            worker = Worker(target=run_stage,
+                            args=(self.dispatch, line, queues[i - 1] if i else None,
+                                  queues[i], abort, errors, self.batch))
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+
+        try:
+            for record in _receive(queues[-1], abort):
+                yield record
+        except _Aborted:
+            pass
+        finally:
+            abort.set()
+            for worker in workers:
+                while worker.is_alive():
+                    # let processes flush what they were sending
+                    for q in queues:
+                        try:
+                            while True:
+                                q.get_nowait()
+                        except queue.Empty:
+                            pass
+                    worker.join(0.1)
+
+        messages = []
+        try:
+            while True:
+                messages.append(errors.get(True, 0.1) if self.processes
+                                else errors.get_nowait())
+        except queue.Empty:
+            pass
+        if messages:
+            raise StageFailed("Pipeline failed: %s" % '; '.join(messages))
+
+
+class Pipe(Command):
+    """
+    Runs commands as the stages of a pipeline, see :mod:`flask_script.pipeline`.
+    """
+
+    help = description = 'Run commands as a pipeline, passing records between them'
+
+    yields_records = True
+
+    def get_options(self):
+        return (
+            Option('stages',
+                   nargs='+',
+                   metavar='STAGE',
+                   help='command line of a stage; quote commands with arguments'),
+            Option('-q', '--queue-size',
+                   dest='queue_size',
+                   type=int,
+                   default=16,
+                   help='batches of records waiting between two stages (default: 16)'),
+            Option('-b', '--batch',
+                   dest='batch',
+                   type=int,
+                   default=100,
+                   help='records passed on at once (default: 100)'),
+            Option('--processes',
+                   dest='processes',
+                   action='store_true',
+                   help='run stages in forked processes instead of threads'),
+        )
+
+    def __call__(self, app, stages, queue_size, batch, processes):
+        manager = self.get_manager()
+        lines = [parse_command_line(stage) for stage in stages]
+        commands = [resolve(manager, line) for line in lines]
+        for line, command in zip(lines[1:], commands[1:]):
+            if not getattr(command, 'input_records', False):
+                raise InvalidCommand("%s does not take records." % ' '.join(line))
+
+        # the records are written like those of the last stage
+        self.output_fields = getattr(commands[-1], 'output_fields', None)
+        self.format_text = getattr(commands[-1], 'format_text', None)
+
+        prog = sys.argv[0]
+
+        def dispatch(args, records):
+            return manager.handle(prog, args, app=app, records=records, stream=True)
+
+        return iter(Pipeline(lines, dispatch, max(queue_size, 1), max(batch, 1),
+                             processes))
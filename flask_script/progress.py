@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_script.progress
+    ~~~~~~~~~~~~~~~~~~~~~
+
+    Progress reporting for long-running commands.
+
+    Typical usage::
+
+        class Backfill(Command):
+
+            def run(self):
+                rows = Row.query.all()
+                for row in self.progress(rows, label='backfill'):
+                    process(row)
+
+    On a terminal the status line is redrawn a few times per second; when
+    stderr is not a terminal (cron, CI, log files) a plain line is written
+    every ``log_interval`` seconds instead.
+
+    The clock is only read every so many iterations, and that number adapts
+    to the speed of the loop, so even very tight loops pay little more than
+    an integer comparison per item.
+"""
+from __future__ import absolute_import, print_function
+
+import sys
+import time
+import threading
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    return '%d:%02d:%02d' % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+def _adapt_step(step, elapsed, interval):
+    # the number of items after which the clock is read again
+    if elapsed <= 0:
+        return step * 10
+    return max(1, min(int(step * interval / elapsed), step * 10))
+
+
+def _isatty(stream):
+    try:
+        return stream.isatty()
+    except (AttributeError, ValueError):
+        return False
+
+
+class Progress(object):
+    """
+    Counts work done and reports throughput and ETA.
+
+    :param total: expected number of items, if known
+    :param label: text shown in front of the numbers
+    :param stream: where to write, by default ``sys.stderr``
+    :param refresh: minimum seconds between redraws on a terminal
+    :param log_interval: seconds between lines if the stream is no terminal
+    :param shared: count items processed by other processes, see
+                   :meth:`worker`
+    """
+
+    #: how often the clock is read, in seconds
+    check_interval = 0.05
+
+    def __init__(self, total=None, label='', stream=None, refresh=0.2,
+                 log_interval=10.0, shared=False):
+        self.total = total
+        self.label = label
+        self.stream = stream if stream is not None else sys.stderr
+        self.tty = _isatty(self.stream)
+        self.interval = refresh if self.tty else log_interval
+        self.count = 0
+        self.counter = None
+        if shared:
+            # imported here, as most progress bars are not shared
+            import ctypes
+            import multiprocessing
+            self.counter = multiprocessing.Value(ctypes.c_longlong, 0)
+        self.rate = 0.0
+        self.closed = False
+        self._step = 1
+        self._next_check = 1
+        self._thread = None
+        self._stop = threading.Event()
+        self._width = 0
+        self.started = self._last_check = self._last_shown = time.time()
+        self._shown_count = 0
+
+    def __enter__(self):
+        if self.counter is not None:
+            self._thread = threading.Thread(target=self._poll)
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def done(self):
+        if self.counter is None:
+            return self.count
+        return self.count + self.counter.value
+
+    def update(self, n=1):
+        """
+        Records ``n`` more items as done.
+        """
+        self.count += n
+        if self.count >= self._next_check:
+            self._tick()
+
+    def iterate(self, iterable):
+        """
+        Yields the items of ``iterable``, counting them, and closes the
+        progress report at the end.
+        """
+        if self.total is None:
+            try:
+                self.total = len(iterable)
+            except TypeError:
+                pass
+        count = self.count
+        next_check = self._next_check
+        try:
+            for item in iterable:
+                yield item
+                count += 1
+                if count >= next_check:
+                    self.count = count
+                    self._tick()
+                    next_check = self._next_check
+        finally:
+            self.count = count
+            self.close()
+
+    def worker(self):
+        """
+        Returns a :class:`WorkerProgress` for use in another process. Pass
+        it to the process when it is created (e.g. as an argument of
+        ``multiprocessing.Process`` or in ``Pool(initargs=...)``), since
+        the shared counter cannot be sent through a queue.
+        """
+        if self.counter is None:
+            raise ValueError("Create the Progress with shared=True.")
+        return WorkerProgress(self.counter)
+
+    def _tick(self):
+        now = time.time()
+        self._step = _adapt_step(self._step, now - self._last_check,
+                                 self.check_interval)
+        self._last_check = now
+        self._next_check = self.count + self._step
+        if now - self._last_shown >= self.interval:
+            self._show(now)
+
+    def _poll(self):
+        while not self._stop.wait(self.interval):
+            self._show(time.time())
+
+    def _show(self, now, final=False):
+        done = self.done
+        interval = now - self._last_shown
+        if interval > 0 and self._shown_count:
+            current = (done - self._shown_count) / interval
+            # exponential smoothing keeps the ETA from jumping around
+            self.rate = current if not self.rate else 0.3 * current + 0.7 * self.rate
+        elif now > self.started:
+            self.rate = done / (now - self.started)
+        self._last_shown = now
+        self._shown_count = done
+
+        line = self.format(done, now, final)
+        if self.tty:
+            padding = ' ' * max(0, self._width - len(line))
+            self._width = len(line)
+            self.stream.write('\r' + line + padding + ('\n' if final else ''))
+        else:
+            self.stream.write(line + '\n')
+        self.stream.flush()
+
+    def format(self, done, now, final=False):
+        parts = [self.label + ':'] if self.label else []
+        if self.total:
+            parts.append('%d/%d (%.1f%%)' % (done, self.total, 100.0 * done / self.total))
+        else:
+            parts.append('%d' % done)
+        elapsed = now - self.started
+        if final:
+            parts.append('in %s, %.1f/s' % (format_duration(elapsed),
+                                            done / elapsed if elapsed > 0 else 0.0))
+        else:
+            parts.append('%.1f/s' % self.rate)
+            if self.total and self.rate > 0:
+                parts.append('ETA %s' % format_duration(
+                    max(0, self.total - done) / self.rate))
+        return ' '.join(parts)
+
+    def close(self):
+        """
+        Writes the final line. Called automatically at the end of
+        :meth:`iterate` and when used as a context manager.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+        self._show(time.time(), final=True)
+
+
+class WorkerProgress(object):
+    """
+    Counts items in a worker process and adds them to the shared counter
+    of a :class:`Progress` in batches, so workers rarely take its lock.
+    """
+
+    check_interval = Progress.check_interval
+
+    def __init__(self, counter, flush_interval=0.2):
+        self.counter = counter
+        self.flush_interval = flush_interval
+        self.pending = 0
+        self._next_check = 1
+        self._step = 1
+        self._last_check = self._last_flush = time.time()
+
+    def update(self, n=1):
+        self.pending += n
+        if self.pending >= self._next_check:
+            self._tick()
+
+    def iterate(self, iterable):
+        try:
+            for item in iterable:
+                yield item
+                self.pending += 1
+                if self.pending >= self._next_check:
+                    self._tick()
+        finally:
+            self.flush()
+
+    def _tick(self):
+        now = time.time()
+        self._step = _adapt_step(self._step, now - self._last_check,
+                                 self.check_interval)
+        self._last_check = now
+        if now - self._last_flush >= self.flush_interval:
+            self.flush()
+        self._next_check = self.pending + self._step
+
+    def flush(self):
+        """
+        Adds the items counted since the last flush to the shared counter.
+        """
+        if self.pending:
+            with self.counter.get_lock():
+                self.counter.value += self.pending
+        self.pending = 0
+        self._next_check = self._step
+        self._last_flush = time.time()
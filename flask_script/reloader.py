@@ -0,0 +1,364 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_script.reloader
+    ~~~~~~~~~~~~~~~~~~~~~
+
+    File watching for the ``--reload`` option of the
+    :class:`~flask_script.Server` command.
+
+    The :class:`InotifyWatcher` uses Linux' inotify, so an idle server costs
+    next to nothing no matter how many modules are loaded.  Where inotify
+    is not available the :class:`StatWatcher` polls modification times,
+    like Werkzeug's own reloader does.
+"""
+from __future__ import absolute_import, print_function
+
+import os
+import sys
+import time
+import errno
+import ctypes
+import select
+import struct
+import fnmatch
+import threading
+import subprocess
+
+from ._compat import PY2, itervalues
+
+RELOADER_ENV = 'FLASK_SCRIPT_RUN_MAIN'
+
+DEFAULT_INCLUDE = ('*.py',)
+DEFAULT_EXCLUDE = ('*.pyc', '*.pyo', '*.swp', '*.swx', '*~', '.#*',
+                   '*/.git/*', '*/__pycache__/*')
+
+# see <sys/inotify.h>
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE)
+
+_EVENT = struct.Struct('iIII')
+
+
+def _load_libc():
+    if not sys.platform.startswith('linux'):
+        return None
+    import ctypes.util
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                           use_errno=True)
+    except OSError:
+        return None
+    if not hasattr(libc, 'inotify_init1'):
+        return None
+    return libc
+
+
+def inotify_available():
+    """
+    Returns True if inotify can be used on this system.
+    """
+    return _load_libc() is not None
+
+
+def module_files():
+    """
+    Returns the source files of all currently loaded modules.
+    """
+    files = set()
+    for module in list(itervalues(sys.modules)):
+        filename = getattr(module, '__file__', None)
+        if not filename:
+            continue
+        if filename[-4:] in ('.pyc', '.pyo'):
+            filename = filename[:-1]
+        files.add(os.path.abspath(filename))
+    return files
+
+
+def app_directories(app):
+    """
+    Returns the template and static folders of the app and its blueprints.
+    """
+    dirs = set()
+    for obj in [app] + list(getattr(app, 'blueprints', {}).values()):
+        template_folder = getattr(obj, 'template_folder', None)
+        if template_folder:
+            dirs.add(os.path.join(obj.root_path, template_folder))
+        static_folder = getattr(obj, 'static_folder', None)
+        if static_folder:
+            dirs.add(static_folder)
+    return set(os.path.abspath(d) for d in dirs if os.path.isdir(d))
+
+
+def _matches(path, patterns):
+    name = os.path.basename(path)
+    for pattern in patterns:
+        if fnmatch.fnmatch(path, pattern) or fnmatch.fnmatch(name, pattern):
+            return True
+    return False
+
+
+class Watcher(object):
+    """
+    Base class for file watchers.
+
+    :param extra_files: additional files to watch
+    :param directories: directories whose files are watched recursively,
+                        e.g. the app's template and static folders
+    :param include: glob patterns of files to watch next to the
+                    loaded modules
+    :param exclude: glob patterns of files to ignore everywhere
+    :param debounce: seconds to wait for further changes before
+                     reporting, so that a burst of writes causes
+                     only one reload
+    """
+
+    def __init__(self, extra_files=(), directories=(), include=None,
+                 exclude=None, debounce=0.1):
+        self.extra_files = set(os.path.abspath(f) for f in extra_files or ())
+        self.directories = set(os.path.abspath(d) for d in directories or ())
+        self.include = tuple(include or DEFAULT_INCLUDE)
+        self.exclude = tuple(exclude or DEFAULT_EXCLUDE)
+        self.debounce = debounce
+
+    def in_directories(self, path):
+        for directory in self.directories:
+            if path.startswith(directory + os.sep):
+                return True
+        return False
+
+    def is_relevant(self, path):
+        """
+        Returns True if a change to ``path`` should trigger a reload.
+        """
+        if _matches(path, self.exclude):
+            return False
+        return (path in self.extra_files or self.in_directories(path) or
+                _matches(path, self.include))
+
+    def wait(self):
+        """
+        Blocks until a relevant file changes, and returns its path.
+        """
+        raise NotImplementedError
+
+
+class StatWatcher(Watcher):
+    """
+    Polls modification times every ``interval`` seconds.
+    """
+
+    def __init__(self, interval=1, **kwargs):
+        super(StatWatcher, self).__init__(**kwargs)
+        self.interval = interval
+
+    def files(self):
+        files = module_files() | self.extra_files
+        for directory in self.directories:
+            for dirpath, dirnames, filenames in os.walk(directory):
+                files.update(os.path.join(dirpath, f) for f in filenames)
+        return [f for f in files if self.is_relevant(f)]
+
+    def snapshot(self):
+        mtimes = {}
+        for filename in self.files():
+            try:
+                mtimes[filename] = os.stat(filename).st_mtime
+            except OSError:
+                continue
+        return mtimes
+
+    def wait(self):
+        mtimes = self.snapshot()
+        while True:
+            time.sleep(self.interval)
+            current = self.snapshot()
+            for filename, mtime in current.items():
+                old = mtimes.get(filename)
+                if old is not None and old != mtime:
+                    return filename
+            for filename in mtimes:
+                if filename not in current:
+                    return filename
+            mtimes.update(current)
+
+
+class InotifyWatcher(Watcher):
+    """
+    Waits for inotify events on the directories of all loaded modules and
+    (recursively) on the watched directories.
+    """
+
+    #: how often to check for newly imported modules while idle
+    rescan_interval = 1
+
+    def __init__(self, **kwargs):
+        super(InotifyWatcher, self).__init__(**kwargs)
+        self.libc = _load_libc()
+        if self.libc is None:
+            raise RuntimeError("inotify is not available")
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches = {}
+        self.recursive = set()
+        self.n_modules = 0
+
+        for directory in self.directories:
+            self.add_tree(directory)
+        for filename in self.extra_files:
+            self.add_watch(os.path.dirname(filename))
+        self.scan_modules()
+
+    def _encode(self, path):
+        if PY2 or isinstance(path, bytes):
+            return path
+        return path.encode(sys.getfilesystemencoding() or 'utf-8',
+                           'surrogateescape')
+
+    def _decode(self, name):
+        if PY2:
+            return name
+        return name.decode(sys.getfilesystemencoding() or 'utf-8',
+                           'surrogateescape')
+
+    def add_watch(self, directory, recursive=False):
+        if recursive:
+            self.recursive.add(directory)
+        if directory in itervalues(self.watches) or not os.path.isdir(directory):
+            return
+        wd = self.libc.inotify_add_watch(self.fd, self._encode(directory),
+                                         WATCH_MASK)
+        if wd >= 0:
+            self.watches[wd] = directory
+
+    def add_tree(self, directory):
+        for dirpath, dirnames, filenames in os.walk(directory):
+            self.add_watch(dirpath, recursive=True)
+
+    def scan_modules(self):
+        if len(sys.modules) == self.n_modules:
+            return
+        self.n_modules = len(sys.modules)
+        known = set(itervalues(self.watches))
+        for directory in set(os.path.dirname(f) for f in module_files()):
+            if directory not in known:
+                self.add_watch(directory)
+
+    def read_events(self, timeout):
+        """
+        Returns the paths of all changed files, waiting at most
+        ``timeout`` seconds for anything to happen.
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except OSError as exc:
+            if exc.errno == errno.EAGAIN:
+                return []
+            raise
+
+        paths = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = self._decode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                # we lost events, so assume the worst
+                paths.append('<inotify queue overflow>')
+                continue
+            directory = self.watches.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and directory in self.recursive:
+                    self.add_tree(path)
+                continue
+            paths.append(path)
+        return paths
+
+    def wait(self):
+        while True:
+            changed = [p for p in self.read_events(self.rescan_interval)
+                       if p.startswith('<') or self.is_relevant(p)]
+            if not changed:
+                self.scan_modules()
+                continue
+            # swallow the rest of a burst of changes
+            while self.read_events(self.debounce):
+                pass
+            return changed[0]
+
+    def close(self):
+        os.close(self.fd)
+
+
+def make_watcher(kind='inotify', interval=1, **kwargs):
+    """
+    Returns a watcher of the given ``kind``. If inotify is requested
+    but not available, falls back to polling.
+    """
+    if kind == 'inotify' and inotify_available():
+        return InotifyWatcher(**kwargs)
+    return StatWatcher(interval=interval, **kwargs)
+
+
+def _get_args_for_reloading():
+    args = [sys.executable]
+    args.extend('-W%s' % opt for opt in sys.warnoptions)
+    main_module = sys.modules.get('__main__')
+    package = getattr(main_module, '__package__', None)
+    if package and os.path.basename(sys.argv[0]) == '__main__.py':
+        # started with "python -m package"
+        args.extend(['-m', package])
+        args.extend(sys.argv[1:])
+    else:
+        args.extend(sys.argv)
+    return args
+
+
+def run_with_reloader(main_func, watcher_factory):
+    """
+    Runs ``main_func`` in a child process which is restarted whenever the
+    watcher returned by ``watcher_factory`` reports a change.
+    """
+    if os.environ.get(RELOADER_ENV) == 'true':
+        thread = threading.Thread(target=main_func)
+        thread.daemon = True
+        thread.start()
+        watcher = watcher_factory()
+        try:
+            changed = watcher.wait()
+        except KeyboardInterrupt:
+            sys.exit(0)
+        print(" * Detected change in %r, reloading" % changed, file=sys.stderr)
+        sys.exit(3)
+
+    print(" * Restarting with file watcher", file=sys.stderr)
+    env = dict(os.environ)
+    env[RELOADER_ENV] = 'true'
+    try:
+        while True:
+            exit_code = subprocess.call(_get_args_for_reloading(), env=env,
+                                        close_fds=False)
+            if exit_code != 3:
+                sys.exit(exit_code)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,417 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_script.scheduler
+    ~~~~~~~~~~~~~~~~~~~~~~
+
+    The ``scheduler`` command: runs other commands of the manager on cron
+    schedules or at fixed intervals, in one long-running process.
+
+    The app is created once, and every job runs with that app through the
+    manager, as if it had been called on the command line.  This saves the
+    interpreter start and app setup a separate cron entry pays on every
+    run.
+
+    Typical usage::
+
+        from flask_script.scheduler import Scheduler, Job
+
+        manager.add_command('scheduler', Scheduler([
+            Job('aggregate --daily', cron='15 3 * * *'),
+            Job('cleanup', every=600, jitter=30),
+        ]))
+
+    Jobs can also be listed in the app's ``SCHEDULER_JOBS`` setting, as
+    dicts of :class:`Job` arguments.
+"""
+from __future__ import absolute_import, print_function
+
+import os
+import sys
+import time
+import shlex
+import random
+import hashlib
+import datetime
+import threading
+
+from .commands import Command, Option, InvalidCommand
+from .workers import make_pool, run_job
+from ._state import state_path, read_json, write_json
+
+#: what to do with runs which were missed because the scheduler was not
+#: running, was late, or the previous run had not finished yet:
+#: ``skip`` drops them but still runs a job which is at most ``grace``
+#: seconds late, ``once`` makes up for all of them with a single run and
+#: ``all`` runs every one of them
+MISFIRE_POLICIES = ('skip', 'once', 'all')
+
+_ALIASES = {
+    '@yearly': '0 0 1 1 *',
+    '@annually': '0 0 1 1 *',
+    '@monthly': '0 0 1 * *',
+    '@weekly': '0 0 * * 0',
+    '@daily': '0 0 * * *',
+    '@midnight': '0 0 * * *',
+    '@hourly': '0 * * * *',
+}
+
+
+def _parse_field(field, low, high):
+    values = set()
+    for part in field.split(','):
+        step = 1
+        if '/' in part:
+            part, step = part.split('/', 1)
+            step = int(step)
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start, end = (int(v) for v in part.split('-', 1))
+        else:
+            start = int(part)
+            end = high if step > 1 else start
+        if start < low or end > high or start > end or step < 1:
+            raise ValueError("Invalid cron field: %r" % field)
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronSchedule(object):
+    """
+    A classic five-field cron expression (minute, hour, day of month,
+    month, day of week), in local time. Fields take ``*``, numbers,
+    ranges, lists and steps; ``@daily`` and friends are understood too.
+    """
+
+    def __init__(self, expression):
+        self.expression = expression
+        fields = _ALIASES.get(expression.strip(), expression).split()
+        if len(fields) != 5:
+            raise ValueError("A cron expression has five fields: %r" % expression)
+        self.minutes = _parse_field(fields[0], 0, 59)
+        self.hours = _parse_field(fields[1], 0, 23)
+        self.days = _parse_field(fields[2], 1, 31)
+        self.months = _parse_field(fields[3], 1, 12)
+        self.weekdays = set(d % 7 for d in _parse_field(fields[4], 0, 7))
+        # as in cron, a day matches either field if both are restricted
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+
+    def _day_matches(self, dt):
+        day = dt.day in self.days
+        weekday = (dt.weekday() + 1) % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def next(self, after):
+        """
+        Returns the first matching time after the timestamp ``after``.
+        """
+        dt = datetime.datetime.fromtimestamp(after).replace(second=0, microsecond=0)
+        dt += datetime.timedelta(minutes=1)
+        limit = dt.year + 5
+        while dt.year <= limit:
+            if dt.month not in self.months:
+                dt = (dt.replace(day=1, hour=0, minute=0) +
+                      datetime.timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(dt):
+                dt = dt.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+            elif dt.hour not in self.hours:
+                dt = dt.replace(minute=0) + datetime.timedelta(hours=1)
+            elif dt.minute not in self.minutes:
+                dt += datetime.timedelta(minutes=1)
+            else:
+                return time.mktime(dt.timetuple())
+        raise ValueError("The cron expression %r never matches" % self.expression)
+
+    def __str__(self):
+        return self.expression
+
+
+class IntervalSchedule(object):
+    """
+    Every ``seconds`` seconds.
+    """
+
+    def __init__(self, seconds):
+        if seconds <= 0:
+            raise ValueError("The interval must be positive")
+        self.seconds = seconds
+
+    def next(self, after):
+        return after + self.seconds
+
+    def __str__(self):
+        return 'every %gs' % self.seconds
+
+
+class Job(object):
+    """
+    A command line to run on a schedule.
+
+    :param command: the command line, without the script name, as a
+                    string or a list of arguments
+    :param cron: a cron expression
+    :param every: an interval in seconds, instead of ``cron``
+    :param jitter: delay each run by a random number of seconds up to this
+    :param misfire: one of :data:`MISFIRE_POLICIES`
+    :param grace: with ``skip``, how late a run may start, in seconds
+    :param name: defaults to the command line
+    """
+
+    def __init__(self, command, cron=None, every=None, jitter=None,
+                 misfire='skip', grace=60, name=None):
+        if (cron is None) == (every is None):
+            raise ValueError("Pass either cron or every")
+        if misfire not in MISFIRE_POLICIES:
+            raise ValueError("Unknown misfire policy %r" % misfire)
+        if isinstance(command, (list, tuple)):
+            self.args = list(command)
+        else:
+            self.args = shlex.split(command)
+        self.name = name or ' '.join(self.args)
+        self.schedule = CronSchedule(cron) if cron is not None else IntervalSchedule(every)
+        self.jitter = jitter
+        self.misfire = misfire
+        self.grace = grace
+
+        self.next_run = None
+        self.delay = 0.0
+        self.running = False
+        self.pending = 0
+        self.missed = 0
+        self.runs = 0
+        self.last_status = None
+
+    def plan(self, after, jitter):
+        self.next_run = self.schedule.next(after)
+        jitter = self.jitter if self.jitter is not None else jitter
+        self.delay = random.uniform(0, jitter) if jitter else 0.0
+
+    @property
+    def fire_at(self):
+        return self.next_run + self.delay
+
+
+class JobScheduler(object):
+    """
+    Runs :class:`Job` objects in a pool of threads or processes.
+
+    :param dispatch: called in a worker with the arguments of a job
+    :param executor: ``thread`` or ``process``; processes are forked from
+                     the scheduler, so they share its warm app
+    :param state_file: where run times are kept between restarts, so that
+                       runs missed while the scheduler was down are found
+    """
+
+    def __init__(self, jobs, dispatch, workers=4, executor='thread',
+                 jitter=0, state_file=None, log=None):
+        self.jobs = list(jobs)
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.state_file = state_file
+        self.jitter = jitter
+        self.stopping = False
+        self.log = log or (lambda message: print(message, file=sys.stderr))
+
+        self.pool = make_pool(workers, dispatch, executor)
+
+        now = time.time()
+        state = read_json(state_file, {}) if state_file else {}
+        for job in self.jobs:
+            saved = state.get(job.name, {})
+            job.missed = saved.get('missed', 0)
+            if saved.get('next_run'):
+                job.next_run = saved['next_run']
+            else:
+                job.plan(now, jitter)
+
+    def save(self):
+        if not self.state_file:
+            return
+        write_json(self.state_file, dict(
+            (job.name, dict(next_run=job.next_run, missed=job.missed,
+                            last_status=job.last_status))
+            for job in self.jobs))
+
+    def _missed(self, job, count, reason):
+        if count:
+            job.missed += count
+            self.log('%s: missed %d run%s (%s, policy %s)' % (
+                job.name, count, '' if count == 1 else 's', reason, job.misfire))
+
+    def _start(self, job):
+        job.running = True
+        job.runs += 1
+
+        def done(result):
+            status, elapsed = result
+            with self.lock:
+                job.running = False
+                job.last_status = status
+                if job.pending and not self.stopping:
+                    job.pending -= 1
+                    self._start(job)
+                self.save()
+            self.log('%s: %s in %.2fs' % (job.name, status, elapsed))
+            self.wakeup.set()
+
+        self.pool.apply_async(run_job, (job.args,), callback=done)
+
+    def tick(self, now=None):
+        """
+        Starts the jobs which are due and returns the number of seconds
+        until the next one is.
+        """
+        now = time.time() if now is None else now
+        with self.lock:
+            changed = False
+            for job in self.jobs:
+                if job.fire_at > now:
+                    continue
+                changed = True
+                delay = job.delay
+                due = []
+                while job.next_run <= now and len(due) < 1000:
+                    due.append(job.next_run)
+                    job.plan(job.next_run, self.jitter)
+                if job.next_run <= now:
+                    job.plan(now, self.jitter)
+
+                if job.misfire == 'skip':
+                    late = now - due[-1] > job.grace + delay
+                    if job.running or late:
+                        self._missed(job, len(due),
+                                     'still running' if job.running else 'too late')
+                        continue
+                    self._missed(job, len(due) - 1, 'late')
+                    runs = 1
+                elif job.misfire == 'once':
+                    runs = 1
+                else:
+                    runs = len(due)
+
+                if job.running:
+                    job.pending = 1 if job.misfire == 'once' else job.pending + runs
+                else:
+                    job.pending += runs - 1
+                    self._start(job)
+            if changed:
+                self.save()
+            return max(0.0, min(job.fire_at for job in self.jobs) - time.time())
+
+    def run_forever(self):
+        while True:
+            self.wakeup.wait(min(self.tick(), 60.0))
+            self.wakeup.clear()
+
+    def wait_idle(self):
+        """
+        Waits until no job is running.
+        """
+        while True:
+            with self.lock:
+                if not any(job.running for job in self.jobs):
+                    return
+            time.sleep(0.05)
+
+    def shutdown(self):
+        """
+        Waits for running jobs, dropping pending ones, and stops the pool.
+        """
+        self.stopping = True
+        self.wait_idle()
+        self.pool.close()
+        self.pool.join()
+        with self.lock:
+            self.save()
+
+
+class Scheduler(Command):
+    """
+    Runs commands of this manager on schedules, with one warm app.
+
+    :param jobs: a list of :class:`Job` objects
+    :param workers: default number of jobs which can run at the same time
+    :param executor: default executor, ``thread`` or ``process``
+    """
+
+    help = description = 'Runs commands on cron schedules or intervals'
+
+    def __init__(self, jobs=(), workers=4, executor='thread'):
+        self.jobs = list(jobs)
+        self.workers = workers
+        self.executor = executor
+
+    def add_job(self, *args, **kwargs):
+        """
+        Adds a job; takes the same arguments as :class:`Job`.
+        """
+        self.jobs.append(Job(*args, **kwargs))
+
+    def get_options(self):
+        return (
+            Option('-w', '--workers',
+                   dest='workers',
+                   type=int,
+                   default=self.workers,
+                   help='jobs which can run at the same time (default: %d)' % self.workers),
+            Option('--executor',
+                   dest='executor',
+                   choices=('thread', 'process'),
+                   default=self.executor,
+                   help='run jobs in threads or forked processes (default: %s)' % self.executor),
+            Option('--jitter',
+                   dest='jitter',
+                   type=float,
+                   default=0,
+                   metavar='SECONDS',
+                   help='delay runs randomly by up to this, unless a job sets its own'),
+            Option('--list',
+                   dest='list_jobs',
+                   action='store_true',
+                   help='list the jobs and their next run and exit'),
+        )
+
+    def get_jobs(self, app):
+        jobs = list(self.jobs)
+        for spec in app.config.get('SCHEDULER_JOBS', ()):
+            jobs.append(Job(**spec))
+        return jobs
+
+    def state_file(self):
+        script = os.path.abspath(sys.argv[0])
+        return state_path('scheduler', '%s.json' % hashlib.sha1(
+            script.encode('utf-8')).hexdigest()[:16])
+
+    def __call__(self, app, workers, executor, jitter, list_jobs):
+        jobs = self.get_jobs(app)
+        if not jobs:
+            raise InvalidCommand("No jobs to schedule.")
+
+        manager = self.get_manager()
+        prog = sys.argv[0]
+
+        def dispatch(args):
+            return manager.handle(prog, args, app=app)
+
+        if list_jobs:
+            now = time.time()
+            for job in jobs:
+                print('%-30s %-20s next: %s' % (
+                    job.name, job.schedule,
+                    time.strftime('%Y-%m-%d %H:%M:%S',
+                                  time.localtime(job.schedule.next(now)))))
+            return
+
+        scheduler = JobScheduler(jobs, dispatch, workers, executor, jitter,
+                                 self.state_file())
+        print(' * Scheduling %d job%s' % (len(jobs), '' if len(jobs) == 1 else 's'),
+              file=sys.stderr)
+        try:
+            scheduler.run_forever()
+        except KeyboardInterrupt:
+            print(' * Waiting for running jobs', file=sys.stderr)
+        finally:
+            scheduler.shutdown()
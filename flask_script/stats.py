@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_script.stats
+    ~~~~~~~~~~~~~~~~~~
+
+    Request statistics for the :class:`~flask_script.Server` command.
+
+    :class:`RequestStats` counts requests, status classes, bytes sent and
+    response times per endpoint.  Response times go into a log-linear
+    :class:`Histogram`, so recording a request is a dictionary update and
+    memory use does not grow with the number of requests.
+"""
+from __future__ import absolute_import, print_function
+
+import io
+import os
+import sys
+import json
+import time
+import threading
+import itertools
+
+from ._compat import iteritems
+from .cli import format_table
+
+#: each power of two is split into 2**SUB_BITS buckets, i.e. values are
+#: recorded with a precision of about 3%
+SUB_BITS = 5
+_SUB_COUNT = 1 << SUB_BITS
+
+ENDPOINT_KEY = 'flask_script.endpoint'
+
+
+def _bucket(value):
+    if value < 2 * _SUB_COUNT:
+        return value
+    shift = value.bit_length() - SUB_BITS - 1
+    return (shift + 1) * _SUB_COUNT + (value >> shift) - _SUB_COUNT
+
+
+def _bucket_range(index):
+    if index < 2 * _SUB_COUNT:
+        return index, index
+    shift = index // _SUB_COUNT - 1
+    mantissa = index % _SUB_COUNT + _SUB_COUNT
+    return mantissa << shift, ((mantissa + 1) << shift) - 1
+
+
+class Histogram(object):
+    """
+    A log-linear histogram of non-negative integers, in the spirit of
+    HdrHistogram.
+    """
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, value):
+        value = int(value)
+        index = _bucket(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        for index, count in iteritems(other.counts):
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    @property
+    def mean(self):
+        return self.total / float(self.count) if self.count else 0.0
+
+    def percentile(self, percent):
+        """
+        Returns the value below which ``percent`` percent of the
+        recorded values fall.
+        """
+        if not self.count:
+            return 0
+        wanted = self.count * percent / 100.0
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= wanted:
+                low, high = _bucket_range(index)
+                return min((low + high) // 2, self.max)
+        return self.max
+
+
+class EndpointStats(object):
+    """
+    Counters for a single endpoint. Latencies are in microseconds.
+    """
+
+    def __init__(self):
+        self.statuses = {}
+        self.bytes_out = 0
+        self.latency = Histogram()
+
+    @property
+    def count(self):
+        return self.latency.count
+
+    def record(self, status, micros, nbytes):
+        status_class = '%dxx' % (status // 100)
+        self.statuses[status_class] = self.statuses.get(status_class, 0) + 1
+        self.bytes_out += nbytes
+        self.latency.record(micros)
+
+    def merge(self, other):
+        for status_class, count in iteritems(other.statuses):
+            self.statuses[status_class] = self.statuses.get(status_class, 0) + count
+        self.bytes_out += other.bytes_out
+        self.latency.merge(other.latency)
+
+    def as_dict(self):
+        latency = self.latency
+        return dict(count=self.count,
+                    statuses=dict(self.statuses),
+                    bytes_out=self.bytes_out,
+                    latency_us=dict(mean=round(latency.mean, 1),
+                                    p50=latency.percentile(50),
+                                    p90=latency.percentile(90),
+                                    p99=latency.percentile(99),
+                                    max=latency.max))
+
+
+class RequestStats(object):
+    """
+    Thread-safe per-endpoint request statistics.
+
+    Counters are striped: every thread records into one of ``stripes``
+    separately locked tables, so request threads rarely wait for each
+    other. :meth:`snapshot` merges them.
+    """
+
+    def __init__(self, stripes=16):
+        self._stripes = [({}, threading.Lock()) for _ in range(stripes)]
+        # threads are numbered in the order they first record; thread
+        # idents are aligned addresses and would all pick the same stripe
+        self._thread_numbers = itertools.count()
+        self._local = threading.local()
+        self.started = time.time()
+
+    def _stripe(self):
+        number = getattr(self._local, 'number', None)
+        if number is None:
+            number = self._local.number = next(self._thread_numbers)
+        return self._stripes[number % len(self._stripes)]
+
+    def record(self, endpoint, status, micros, nbytes):
+        table, lock = self._stripe()
+        with lock:
+            stats = table.get(endpoint)
+            if stats is None:
+                stats = table[endpoint] = EndpointStats()
+            stats.record(status, micros, nbytes)
+
+    def snapshot(self):
+        """
+        Returns a dict of endpoint names to merged :class:`EndpointStats`.
+        """
+        merged = {}
+        for table, lock in self._stripes:
+            with lock:
+                for endpoint, stats in iteritems(table):
+                    if endpoint not in merged:
+                        merged[endpoint] = EndpointStats()
+                    merged[endpoint].merge(stats)
+        return merged
+
+    def as_dict(self):
+        return dict(uptime=round(time.time() - self.started, 3),
+                    endpoints=dict((endpoint, stats.as_dict()) for
+                                   endpoint, stats in iteritems(self.snapshot())))
+
+    def summary(self):
+        """
+        Returns a table of the collected statistics as a string.
+        """
+        snapshot = self.snapshot()
+        elapsed = max(time.time() - self.started, 1e-9)
+        header = ('Endpoint', 'Requests', '2xx', '3xx', '4xx', '5xx',
+                  'p50 ms', 'p90 ms', 'p99 ms', 'max ms', 'Bytes out')
+        rows = []
+        total = 0
+        for endpoint in sorted(snapshot):
+            stats = snapshot[endpoint]
+            latency = stats.latency
+            total += stats.count
+            rows.append((endpoint, str(stats.count)) +
+                        tuple(str(stats.statuses.get(c, 0))
+                              for c in ('2xx', '3xx', '4xx', '5xx')) +
+                        tuple('%.1f' % (v / 1000.0) for v in (
+                            latency.percentile(50), latency.percentile(90),
+                            latency.percentile(99), latency.max)) +
+                        (str(stats.bytes_out),))
+        return '%s\n%d requests in %.1fs (%.1f/s)' % (
+            format_table(header, rows), total, elapsed, total / elapsed)
+
+
+class _ResponseIterator(object):
+
+    def __init__(self, response, on_close):
+        self.response = response
+        self.on_close = on_close
+        self.nbytes = 0
+
+    def __iter__(self):
+        for chunk in self.response:
+            self.nbytes += len(chunk)
+            yield chunk
+
+    def close(self):
+        try:
+            if hasattr(self.response, 'close'):
+                self.response.close()
+        finally:
+            self.on_close(self.nbytes)
+
+
+class StatsMiddleware(object):
+    """
+    WSGI middleware recording every request in a :class:`RequestStats`.
+
+    If the server forks a process per request, the records are sent to
+    the parent process through a pipe, see :meth:`use_pipe`.
+    """
+
+    def __init__(self, wsgi_app, stats):
+        self.wsgi_app = wsgi_app
+        self.stats = stats
+        self.pid = os.getpid()
+        self.pipe = None
+
+    def use_pipe(self):
+        """
+        Starts a thread which collects records written by forked children.
+        """
+        read_fd, self.pipe = os.pipe()
+
+        def collect():
+            with io.open(read_fd, 'r', encoding='utf-8') as lines:
+                for line in lines:
+                    endpoint, status, micros, nbytes = line.rstrip('\n').split('\t')
+                    self.stats.record(endpoint, int(status), int(micros),
+                                      int(nbytes))
+
+        thread = threading.Thread(target=collect)
+        thread.daemon = True
+        thread.start()
+
+    def record(self, endpoint, status, micros, nbytes):
+        if self.pipe is not None and os.getpid() != self.pid:
+            # lines shorter than PIPE_BUF are written atomically
+            os.write(self.pipe, ('%s\t%d\t%d\t%d\n' % (
+                endpoint, status, micros, nbytes)).encode('utf-8'))
+        else:
+            self.stats.record(endpoint, status, micros, nbytes)
+
+    def __call__(self, environ, start_response):
+        started = time.time()
+        status_code = [500]
+
+        def _start_response(status, headers, exc_info=None):
+            status_code[0] = int(status.split(None, 1)[0])
+            return start_response(status, headers, exc_info)
+
+        def on_close(nbytes):
+            self.record(environ.get(ENDPOINT_KEY) or '<unmatched>',
+                        status_code[0], (time.time() - started) * 1e6, nbytes)
+
+        response = self.wsgi_app(environ, _start_response)
+        return _ResponseIterator(response, on_close)
+
+
+def _remember_endpoint():
+    from flask import request
+    request.environ[ENDPOINT_KEY] = request.endpoint
+
+
+def instrument(app, processes=1):
+    """
+    Wraps ``app.wsgi_app`` in a :class:`StatsMiddleware` and returns it.
+    """
+    app.before_request_funcs.setdefault(None, []).insert(0, _remember_endpoint)
+    middleware = StatsMiddleware(app.wsgi_app, RequestStats())
+    if processes > 1:
+        middleware.use_pipe()
+    app.wsgi_app = middleware
+    return middleware
+
+
+def serve_stats(stats, address):
+    """
+    Serves the statistics as JSON on ``address`` (``host:port``) in a
+    background thread.
+    """
+    from wsgiref.simple_server import make_server, WSGIRequestHandler
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    def stats_app(environ, start_response):
+        body = json.dumps(stats.as_dict(), indent=2).encode('utf-8')
+        start_response('200 OK', [('Content-Type', 'application/json'),
+                                  ('Content-Length', str(len(body)))])
+        return [body]
+
+    host, _, port = address.rpartition(':')
+    server = make_server(host or '127.0.0.1', int(port), stats_app,
+                         handler_class=QuietHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    print(" * Request statistics on http://%s:%d/" % server.server_address[:2],
+          file=sys.stderr)
+    return server
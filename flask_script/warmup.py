@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_script.warmup
+    ~~~~~~~~~~~~~~~~~~~
+
+    The ``warmup`` command: requests the app's routes concurrently after a
+    deploy, so that caches are filled, templates compiled and lazy imports
+    done before the first visitors arrive.
+
+    Typical usage::
+
+        from flask_script.warmup import Warmup
+
+        manager.add_command('warmup', Warmup())
+
+    and then::
+
+        python manage.py warmup
+        python manage.py warmup --url http://127.0.0.1:8000 -f urls.txt
+"""
+from __future__ import absolute_import, print_function
+
+import time
+from multiprocessing.pool import ThreadPool
+
+try:
+    from urllib.parse import urlsplit
+except ImportError:  # Python 2
+    from urlparse import urlsplit
+
+from .cli import format_table
+from .commands import Command, Option, InvalidCommand, get_static_urls
+from .loadtest import _connection
+
+
+def read_paths(filename):
+    """
+    Returns the paths listed, one per line, in a file. Empty lines and
+    lines starting with ``#`` are ignored.
+    """
+    with open(filename) as f:
+        return [line.strip() for line in f
+                if line.strip() and not line.strip().startswith('#')]
+
+
+def client_fetch(app):
+    """
+    Returns a function requesting a path through the app's test client,
+    and returning the status code.
+    """
+    def fetch(path):
+        response = app.test_client().get(path)
+        response.close()
+        return response.status_code
+    return fetch
+
+
+def http_fetch(base, timeout=30):
+    """
+    Returns a function requesting a path from the server at ``base``, and
+    returning the status code.
+    """
+    prefix = urlsplit(base).path.rstrip('/')
+
+    def fetch(path):
+        conn = _connection(base, timeout)
+        try:
+            conn.request('GET', prefix + path)
+            response = conn.getresponse()
+            response.read()
+            return response.status
+        finally:
+            conn.close()
+    return fetch
+
+
+def _request(args):
+    fetch, path = args
+    started = time.time()
+    try:
+        status, error = fetch(path), None
+    except Exception as exc:
+        status, error = None, '%s: %s' % (type(exc).__name__, exc)
+    return path, status, time.time() - started, error
+
+
+def warm_up(paths, fetch, concurrency=8):
+    """
+    Requests the paths with ``fetch`` from ``concurrency`` threads and
+    returns ``(path, status, seconds, error)`` for each, in order.
+    """
+    pool = ThreadPool(max(1, min(concurrency, len(paths))))
+    try:
+        return pool.map(_request, [(fetch, path) for path in paths], 1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def failed(result):
+    """
+    Returns whether a request failed: it raised, or the server answered
+    with a 5xx status.
+    """
+    path, status, seconds, error = result
+    return status is None or status >= 500
+
+
+def format_results(results):
+    """
+    Returns a table of the results of :func:`warm_up`.
+    """
+    header = ('Path', 'Status', 'Time ms', 'Error')
+    rows = [(path, '-' if status is None else str(status),
+             '%.1f' % (seconds * 1000), error or '')
+            for path, status, seconds, error in results]
+    return format_table(header, rows)
+
+
+class Warmup(Command):
+    """
+    Requests routes concurrently to warm up the app.
+
+    By default every ``GET`` route without arguments is requested through
+    the test client, which warms up this process and whatever it shares
+    with the servers, e.g. a cache server or compiled files. To warm up
+    the server processes themselves, pass the base URL of the deployed
+    server with ``--url``.
+
+    Exits with status 1 if a request raised or returned a 5xx status.
+
+    :param concurrency: default number of concurrent requests
+    """
+
+    help = description = 'Requests routes concurrently to warm up the app'
+
+    def __init__(self, concurrency=8):
+        self.concurrency = concurrency
+
+    def get_options(self):
+        return (
+            Option('urls',
+                   nargs='*',
+                   metavar='PATH',
+                   help='paths to request (default: every GET route without arguments)'),
+            Option('-f', '--file',
+                   dest='url_file',
+                   metavar='FILE',
+                   help='file with paths to request, one per line'),
+            Option('-c', '--concurrency',
+                   dest='concurrency',
+                   type=int,
+                   default=self.concurrency,
+                   help='number of concurrent requests (default: %d)' % self.concurrency),
+            Option('--url',
+                   dest='target',
+                   metavar='URL',
+                   help='base URL of a running server to warm up'),
+            Option('--request-timeout',
+                   dest='request_timeout',
+                   type=float,
+                   default=30,
+                   help='seconds to wait for a response (default: 30)'),
+        )
+
+    def __call__(self, app, urls, url_file, concurrency, target, request_timeout):
+        paths = list(urls or [])
+        if url_file:
+            paths.extend(read_paths(url_file))
+        if not paths:
+            paths = get_static_urls(app)
+        if not paths:
+            raise InvalidCommand("Nothing to warm up; pass paths or --file.")
+
+        fetch = http_fetch(target, request_timeout) if target else client_fetch(app)
+        started = time.time()
+        results = warm_up(paths, fetch, concurrency)
+        elapsed = time.time() - started
+
+        print(format_results(results))
+        failures = [result for result in results if failed(result)]
+        print('Warmed up %d of %d paths in %.2fs' % (
+            len(results) - len(failures), len(results), elapsed))
+        return 1 if failures else 0
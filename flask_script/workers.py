@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_script.workers
+    ~~~~~~~~~~~~~~~~~~~~
+
+    Pools of threads or processes running commands, as used by the
+    scheduler, ``run-graph``, ``--for-each-config`` and others.
+
+    Worker processes are always forked, so that they inherit the app the
+    caller already set up instead of importing and creating it again.
+"""
+from __future__ import absolute_import
+
+import os
+import time
+import traceback
+
+
+def fork_context():
+    """
+    Returns the ``multiprocessing`` context which forks its processes, or
+    None if the system cannot fork.
+    """
+    if not hasattr(os, 'fork'):
+        return None
+    import multiprocessing
+    if hasattr(multiprocessing, 'get_context'):
+        return multiprocessing.get_context('fork')
+    return multiprocessing
+
+
+def pool_class(executor='thread'):
+    """
+    Returns the pool class of an ``executor``: ``thread``, or ``process``
+    for forked processes.
+    """
+    if executor == 'process':
+        context = fork_context()
+        if context is None:
+            raise ValueError("Process pools need fork, which is not available.")
+        return context.Pool
+    elif executor == 'thread':
+        from multiprocessing.pool import ThreadPool
+        return ThreadPool
+    raise ValueError("Unknown executor %r" % executor)
+
+
+def default_executor():
+    """
+    Returns ``process`` where processes can be forked, else ``thread``.
+    """
+    return 'thread' if fork_context() is None else 'process'
+
+
+_dispatch = None
+
+
+def init_worker(dispatch):
+    """
+    Sets the function :func:`run_job` calls in this worker.
+    """
+    global _dispatch
+    _dispatch = dispatch
+
+
+def run_job(args, dispatch=None):
+    """
+    Calls ``dispatch`` (by default the one of the worker) with ``args`` and
+    returns a status message and the duration.
+    """
+    started = time.time()
+    try:
+        result = (dispatch or _dispatch)(args)
+        failed = isinstance(result, int) and not isinstance(result, bool) and result
+        status = 'exit %d' % result if failed else 'ok'
+    except SystemExit as exc:
+        status = 'exit %s' % exc.code if exc.code else 'ok'
+    except Exception as exc:
+        traceback.print_exc()
+        status = 'error: %s: %s' % (type(exc).__name__, exc)
+    return status, time.time() - started
+
+
+def make_pool(workers, dispatch, executor='thread'):
+    """
+    Returns a pool of ``workers`` threads or processes in which
+    :func:`run_job` calls ``dispatch``.
+    """
+    return pool_class(executor)(workers, init_worker, (dispatch,))
@@ -1,12 +1,36 @@
 # -*- coding: utf-8 -*-
 
+import os
 import re
 import sys
+import time
 import unittest
 
 from flask import Flask
 from flask_script._compat import StringIO, text_type
-from flask_script import Command, Manager, Option, prompt, prompt_bool, prompt_choices
+from flask_script import Command, Manager, Option, Server, Shell, prompt, prompt_bool, prompt_choices
+from flask_script import lazy, lazy_import
+from flask_script.commands import InvalidCommand
+from flask_script.engines import ENGINES, engine, engine_available
+from flask_script import reloader, stats
+from flask_script.loadtest import LoadTest, Scenario
+from flask_script.bench import Bench
+from flask_script.commands import Clean, Compile, ShowUrls, get_static_urls
+from flask_script.progress import Progress
+from flask_script.batch import BatchCommand, FileSource, KeysetSource
+from flask_script.lock import CommandLock, lock_path
+from flask_script.scheduler import CronSchedule, Job, JobScheduler
+from flask_script.jobqueue import JobQueue, Enqueue, Worker, Jobs, _LeaseRenewer
+from flask_script.cache import ResultCache, Entry
+from flask_script.incremental import expand
+from flask_script.graph import CommandGraph, RunGraph
+from flask_script.limits import Limits, LimitExceeded, parse_size
+from flask_script.manifest import ExportManifest, build_manifest, write_launcher
+from flask_script import launcher
+from flask_script.pipeline import Pipe, StageFailed
+from flask_script.fanout import expand_configs
+from flask_script.warmup import Warmup
+from flask_script.freeze import Freeze, output_path
 
 from pytest import raises
 
@@ -433,6 +457,26 @@ class TestManager:
         out, err = capsys.readouterr()
         assert 'hello joe from reddit.com' in out
 
+    def test_command_settings_above_options(self, capsys):
+
+        manager = Manager(self.app)
+
+        @manager.command(lock=True, inputs=['in.txt'], timeout=5)
+        @manager.option('-n', '--name', dest='name')
+        def hello(name):
+            print('hello ' + name)
+
+        command = manager._commands['hello']
+        assert [option.args for option in command.option_list] == [('-n', '--name')]
+        assert command.lock is True
+        assert command.inputs == ('in.txt',)
+        assert command.timeout == 5
+
+        code = run('manage.py hello -n joe', manager.run)
+        out, err = capsys.readouterr()
+        assert code == 0
+        assert 'hello joe' in out
+
     def test_global_option_provided_before_and_after_command(self, capsys):
 
         manager = Manager(self.app)
@@ -470,6 +514,36 @@ class TestManager:
         assert 'Development' in out
         assert 'OK' in out
 
+    def test_factory_app_is_cached(self, capsys):
+
+        calls = []
+
+        def create_app(config_name):
+            calls.append(config_name)
+            return Flask(config_name)
+
+        manager = Manager(create_app, app_cache_size=2)
+        manager.add_option('-c', dest='config_name', default='dev')
+        manager.add_command('simple', SimpleCommand())
+
+        for args in ('', '', '-c prod', '-c test', '-c prod', '-c dev'):
+            assert run('manage.py %s simple' % args, manager.run) == 0
+        # "dev" was the least recently used app when "test" was built
+        assert calls == ['dev', 'prod', 'test', 'dev']
+        assert manager.app.name == 'dev'
+
+        manager.clear_app_cache()
+        assert manager.app is create_app
+        run('manage.py simple', manager.run)
+        assert calls == ['dev', 'prod', 'test', 'dev', 'dev']
+
+        manager = Manager(create_app, app_cache_size=0)
+        manager.add_option('-c', dest='config_name', default='dev')
+        manager.add_command('simple', SimpleCommand())
+        run('manage.py simple', manager.run)
+        run('manage.py simple', manager.run)
+        assert calls[-2:] == ['dev', 'dev']
+
     def test_get_usage(self):
 
         manager = Manager(self.app)
@@ -865,3 +939,1598 @@ class TestSubManager:
 
         assert 'runserver' not in sub_manager._commands
         assert 'shell' not in sub_manager._commands
+
+
+class TestServer:
+
+    def setup(self):
+
+        self.app = AppForTesting()
+
+    def test_engine_options(self):
+
+        calls = []
+
+        @engine('dummy', module='sys')
+        def run_dummy(app, **kwargs):
+            calls.append(kwargs)
+
+        try:
+            manager = Manager(self.app, with_default_commands=False)
+            manager.add_command('runserver', Server())
+            code = run('manage.py runserver --engine dummy -p 8000 -D '
+                       '--threaded --ssl-crt a.crt --ssl-key a.key', manager.run)
+        finally:
+            del ENGINES['dummy']
+
+        assert code == 0
+        assert calls[0]['port'] == 8000
+        assert calls[0]['threaded'] is True
+        assert calls[0]['use_debugger'] is False
+        assert calls[0]['ssl_context'] == ('a.crt', 'a.key')
+
+    def test_engine_not_installed(self):
+
+        @engine('missing', module='no_such_server_module')
+        def run_missing(app, **kwargs):
+            pass
+
+        try:
+            assert engine_available('werkzeug')
+            assert not engine_available('missing')
+
+            manager = Manager(self.app, with_default_commands=False)
+            manager.add_command('runserver', Server(engine='missing'))
+            with raises(InvalidCommand):
+                run('manage.py runserver -D', manager.run)
+        finally:
+            del ENGINES['missing']
+
+    def test_engine_without_ssl(self):
+
+        for name in ('waitress', 'bjoern'):
+            with raises(InvalidCommand):
+                ENGINES[name](self.app, host='127.0.0.1', port=5000,
+                              use_debugger=False, use_reloader=False,
+                              threaded=False, processes=1,
+                              passthrough_errors=False,
+                              ssl_context=('a.crt', 'a.key'))
+
+    def test_watcher_options(self, monkeypatch):
+
+        calls = []
+        watchers = []
+
+        @engine('dummy', module='sys')
+        def run_dummy(app, **kwargs):
+            calls.append(kwargs)
+
+        def fake_run_with_reloader(main_func, watcher_factory):
+            watchers.append(watcher_factory())
+            main_func()
+
+        monkeypatch.setattr(reloader, 'run_with_reloader', fake_run_with_reloader)
+        self.app.blueprints = {}
+        self.app.root_path = '.'
+        self.app.template_folder = self.app.static_folder = None
+        try:
+            manager = Manager(self.app, with_default_commands=False)
+            manager.add_command('runserver', Server(engine='dummy'))
+            code = run('manage.py runserver -D -r --watcher stat '
+                       '--watch-include *.cfg --watch-exclude local_*', manager.run)
+        finally:
+            del ENGINES['dummy']
+
+        assert code == 0
+        assert calls[0]['use_reloader'] is False
+        watcher = watchers[0]
+        assert isinstance(watcher, reloader.StatWatcher)
+        assert watcher.is_relevant('/src/app/views.py')
+        assert watcher.is_relevant('/src/app/prod.cfg')
+        assert not watcher.is_relevant('/src/app/local_settings.py')
+        assert not watcher.is_relevant('/src/app/views.pyc')
+
+
+class TestWatcher:
+
+    def test_directories_are_relevant(self, tmpdir):
+
+        watcher = reloader.Watcher(directories=[str(tmpdir)])
+        assert watcher.is_relevant(str(tmpdir.join('templates', 'index.html')))
+        assert not watcher.is_relevant(str(tmpdir.join('.git', 'HEAD')))
+        assert not watcher.is_relevant('/elsewhere/index.html')
+
+    def test_inotify_watcher(self, tmpdir):
+
+        if not reloader.inotify_available():
+            return
+        watcher = reloader.InotifyWatcher(directories=[str(tmpdir)], debounce=0.01)
+        try:
+            tmpdir.mkdir('sub')
+            assert watcher.read_events(1) == []
+            tmpdir.join('sub', 'page.html').write('hello')
+            assert watcher.wait() == str(tmpdir.join('sub', 'page.html'))
+        finally:
+            watcher.close()
+
+
+class TestStats:
+
+    def test_histogram(self):
+
+        histogram = stats.Histogram()
+        for value in range(1, 10001):
+            histogram.record(value)
+
+        assert histogram.count == 10000
+        assert histogram.max == 10000
+        assert abs(histogram.percentile(50) - 5000) < 5000 * 0.04
+        assert abs(histogram.percentile(99) - 9900) < 9900 * 0.04
+        assert histogram.percentile(100) == 10000
+
+    def test_threads_use_separate_stripes(self):
+
+        import threading
+
+        request_stats = stats.RequestStats(stripes=4)
+        threads = [threading.Thread(target=request_stats.record,
+                                    args=('hello', 200, 100, 5))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert all(table for table, lock in request_stats._stripes)
+        assert request_stats.snapshot()['hello'].count == 4
+
+    def test_instrument(self):
+
+        app = Flask(__name__)
+
+        @app.route('/hello')
+        def hello():
+            return 'hello'
+
+        middleware = stats.instrument(app)
+        client = app.test_client()
+        for _ in range(3):
+            client.get('/hello', buffered=True)
+        client.get('/nowhere', buffered=True)
+
+        snapshot = middleware.stats.snapshot()
+        assert snapshot['hello'].count == 3
+        assert snapshot['hello'].statuses == {'2xx': 3}
+        assert snapshot['hello'].bytes_out == 15
+        assert snapshot['<unmatched>'].statuses == {'4xx': 1}
+        assert 'hello' in middleware.stats.summary()
+
+
+class TestLoadTest:
+
+    def test_scenario_file(self, tmpdir):
+
+        scenario_file = tmpdir.join('scenario.txt')
+        scenario_file.write('# weight method path\n3 GET /\n\n/about\n1 head /static/app.js\n')
+        scenario = Scenario.from_file(str(scenario_file))
+
+        assert scenario.requests == [('GET', '/'), ('GET', '/about'),
+                                     ('HEAD', '/static/app.js')]
+        assert scenario.total == 5
+
+    def test_loadtest_in_process(self, capsys):
+
+        app = Flask(__name__)
+
+        @app.route('/')
+        def index():
+            return 'hello'
+
+        manager = Manager(app, with_default_commands=False)
+        manager.add_command('loadtest', LoadTest())
+        code = run('manage.py loadtest -n 20 -c 2 / /nowhere', manager.run)
+        out, err = capsys.readouterr()
+
+        assert code == 0
+        assert 'Requests:      20 in' in out
+        assert '404:' in out
+
+
+class TestWarmup:
+
+    def setup(self):
+
+        self.app = Flask(__name__)
+
+        @self.app.route('/')
+        def index():
+            return 'hello'
+
+        @self.app.route('/broken')
+        def broken():
+            raise ValueError('not warm')
+
+        @self.app.route('/items/<int:item>')
+        def item(item):
+            return str(item)
+
+        self.manager = Manager(self.app, with_default_commands=False)
+        self.manager.add_command('warmup', Warmup())
+
+    def test_warmup_routes(self, capsys):
+
+        code = run('manage.py warmup', self.manager.run)
+        out, err = capsys.readouterr()
+
+        assert code == 1
+        assert re.search(r'^/broken +500 ', out, re.M)
+        assert re.search(r'^/ +200 ', out, re.M)
+        assert '/items/' not in out
+        assert 'Warmed up 1 of 2 paths' in out
+
+    def test_warmup_file(self, capsys, tmpdir):
+
+        url_file = tmpdir.join('urls.txt')
+        url_file.write('# after deploy\n/items/1\n\n/\n')
+        code = run('manage.py warmup -c 2 -f %s' % url_file, self.manager.run)
+        out, err = capsys.readouterr()
+
+        assert code == 0
+        assert re.search(r'^/items/1 +200 ', out, re.M)
+        assert 'Warmed up 2 of 2 paths' in out
+
+
+class TestFreeze:
+
+    def setup(self):
+
+        self.app = Flask(__name__)
+        self.pages = {'/': 'home ' * 100}
+
+        @self.app.route('/')
+        def index():
+            return self.pages['/']
+
+        @self.app.route('/items/<int:id>')
+        def item(id):
+            return 'item %d' % id
+
+        self.manager = Manager(self.app, with_default_commands=False)
+        self.freeze = Freeze()
+        self.manager.add_command('freeze', self.freeze)
+        self.ids = [1, 2]
+
+        @self.freeze.url_generator
+        def item():
+            for id in self.ids:
+                yield {'id': id}
+
+    def test_output_path(self):
+
+        assert output_path('/', 'text/html') == 'index.html'
+        assert output_path('/about', 'text/html') == 'about.html'
+        assert output_path('/feed.json?page=2', 'application/json') == 'feed.json'
+        with raises(InvalidCommand):
+            output_path('/a/../../etc', 'text/html')
+
+    def test_freeze(self, capsys, tmpdir):
+
+        build = tmpdir.join('build')
+        code = run('manage.py freeze -j 2 %s' % build, self.manager.run)
+        out, err = capsys.readouterr()
+
+        assert code == 0
+        assert 'Froze 3 pages to %s: 3 written, 0 unchanged' % build in out
+        assert build.join('items', '2.html').read() == 'item 2'
+        assert build.join('index.html.gz').check()
+        assert not build.join('items', '1.html.gz').check()
+
+        self.ids = [1]
+        self.pages['/'] = 'changed ' * 100
+        code = run('manage.py freeze -j 1 %s' % build, self.manager.run)
+        out, err = capsys.readouterr()
+
+        assert code == 0
+        assert '1 written, 1 unchanged, 1 files removed' in out
+        assert not build.join('items', '2.html').check()
+        assert build.join('index.html').read().startswith('changed')
+
+    def test_failed_page(self, capsys, tmpdir):
+
+        self.freeze.url_generator(lambda: ['/nowhere'])
+        code = run('manage.py freeze -j 1 %s' % tmpdir, self.manager.run)
+        out, err = capsys.readouterr()
+
+        assert code == 1
+        assert '/nowhere returned 404' in err
+        assert tmpdir.join('items', '1.html').check()
+
+
+class TestBench:
+
+    def setup(self):
+
+        self.app = Flask(__name__)
+
+        @self.app.route('/')
+        def index():
+            return 'hello'
+
+        @self.app.route('/about', methods=['GET', 'POST'])
+        def about():
+            return 'about'
+
+        @self.app.route('/submit', methods=['POST'])
+        def submit():
+            return 'thanks'
+
+        @self.app.route('/item/<int:n>')
+        def item(n):
+            return str(n)
+
+    def test_get_static_urls(self):
+
+        assert get_static_urls(self.app) == ['/', '/about']
+
+    def test_bench_all(self, capsys):
+
+        manager = Manager(self.app, with_default_commands=False)
+        manager.add_command('bench', Bench())
+        code = run('manage.py bench -n 20 -w 2 -t 2 --all /item/1', manager.run)
+        out, err = capsys.readouterr()
+
+        assert code == 0
+        lines = out.splitlines()
+        assert lines[0].startswith('URL')
+        assert [line.split()[:2] for line in lines[2:]] == [
+            ['/item/1', '20'], ['/', '20'], ['/about', '20']]
+
+
+class TestClean:
+
+    def setup(self):
+
+        self.app = AppForTesting()
+
+    def make_tree(self, tmpdir):
+
+        for name in ('a.pyc', 'b.py', 'b.pyc', 'c.pyo', 'keep.txt',
+                     'pkg/__pycache__/b.cpython-36.pyc',
+                     'pkg/__pycache__/gone.cpython-36.pyc',
+                     'pkg/b.py',
+                     'node_modules/x.pyc',
+                     'env/pyvenv.cfg', 'env/lib/y.pyc'):
+            tmpdir.join(name).ensure()
+
+    def test_clean(self, tmpdir, capsys):
+
+        self.make_tree(tmpdir)
+        manager = Manager(self.app, with_default_commands=False)
+        manager.add_command('clean', Clean())
+        code = run('manage.py clean %s' % tmpdir, manager.run)
+        out, err = capsys.readouterr()
+
+        assert code == 0
+        assert 'Removed 5 bytecode files' in out
+        assert sorted(p.relto(tmpdir) for p in tmpdir.visit() if p.isfile()) == [
+            'b.py', 'env/lib/y.pyc', 'env/pyvenv.cfg', 'keep.txt',
+            'node_modules/x.pyc', 'pkg/b.py']
+        assert not tmpdir.join('pkg', '__pycache__').check()
+
+    def test_clean_help(self, capsys):
+
+        manager = Manager(self.app, with_default_commands=False)
+        manager.add_command('clean', Clean())
+        run('manage.py -?', manager.run)
+        out, err = capsys.readouterr()
+        assert 'Remove *.pyc and *.pyo files' in out
+        run('manage.py clean -?', manager.run)
+        out, err = capsys.readouterr()
+        assert ':param' not in out and '``' not in out
+
+    def test_clean_stale_only(self, tmpdir, capsys):
+
+        self.make_tree(tmpdir)
+        manager = Manager(self.app, with_default_commands=False)
+        manager.add_command('clean', Clean())
+        code = run('manage.py clean -s -e node_* %s' % tmpdir, manager.run)
+        out, err = capsys.readouterr()
+
+        assert code == 0
+        assert 'Removed 3 bytecode files' in out
+        assert tmpdir.join('b.pyc').check()
+        assert tmpdir.join('pkg', '__pycache__', 'b.cpython-36.pyc').check()
+        assert not tmpdir.join('pkg', '__pycache__', 'gone.cpython-36.pyc').check()
+
+    def test_clean_dry_run(self, tmpdir, capsys):
+
+        self.make_tree(tmpdir)
+        manager = Manager(self.app, with_default_commands=False)
+        manager.add_command('clean', Clean(exclude=()))
+        code = run('manage.py clean -n -v %s' % tmpdir, manager.run)
+        out, err = capsys.readouterr()
+
+        assert code == 0
+        assert 'Would remove 6 bytecode files' in out
+        assert 'x.pyc' in out
+        assert tmpdir.join('a.pyc').check()
+
+
+class TestCompile:
+
+    def test_compile(self, tmpdir, capsys):
+
+        tmpdir.join('pkg', '__init__.py').ensure()
+        tmpdir.join('pkg', 'mod.py').write('x = 1\n')
+        tmpdir.join('pkg', 'broken.py').write('def f(:\n')
+        tmpdir.join('node_modules', 'skipped.py').ensure()
+
+        app = AppForTesting()
+        app.root_path = str(tmpdir)
+        app.import_name = '__main__'
+        manager = Manager(app, with_default_commands=False)
+        manager.add_command('compile', Compile(jobs=2))
+
+        code = run('manage.py compile', manager.run)
+        out, err = capsys.readouterr()
+        assert code == 0
+        assert 'Compiled 2, skipped 0 up-to-date, 1 failed' in out
+        assert 'broken.py' in err
+
+        code = run('manage.py compile', manager.run)
+        out, err = capsys.readouterr()
+        assert 'Compiled 0, skipped 2 up-to-date, 1 failed' in out
+
+    def test_compile_help(self, capsys):
+
+        manager = Manager(AppForTesting(), with_default_commands=False)
+        manager.add_command('compile', Compile())
+        run('manage.py compile -?', manager.run)
+        out, err = capsys.readouterr()
+        assert 'Precompile Python files to bytecode' in out
+        assert ':param' not in out and '``' not in out
+
+
+class TestShell:
+
+    def test_lazy(self):
+
+        calls = []
+
+        def factory():
+            calls.append(1)
+            return {'answer': 42}
+
+        obj = lazy(factory)
+        assert calls == []
+        assert obj['answer'] == 42
+        assert 'answer' in obj
+        assert len(obj) == 1
+        assert calls == [1]
+
+        json_module = lazy_import('json')
+        assert json_module.loads('[1]') == [1]
+
+    def test_backend_detection_is_cached(self, tmpdir, monkeypatch):
+
+        monkeypatch.setenv('FLASK_SCRIPT_STATE_DIR', str(tmpdir))
+        shell = Shell()
+        shell.backends = (('fake', ('json',)), ('missing', ('no_such_shell',)))
+        assert shell.available_backends() == ['fake']
+        assert tmpdir.join('shell-backends.json').check()
+
+        shell.backends = (('other', ('json',)),)
+        assert shell.available_backends() == ['fake']
+
+        shell.forget_backends()
+        assert shell.available_backends() == ['other']
+
+    def test_run_command(self, capsys):
+
+        manager = Manager(AppForTesting(), with_default_commands=False)
+        manager.add_command('shell', Shell(make_context=lambda: dict(x=41)))
+
+        code = run('manage.py shell -c print(x+1)', manager.run)
+        out, err = capsys.readouterr()
+        assert code == 0
+        assert out == '42\n'
+
+    def test_run_script(self, tmpdir, capsys):
+
+        script = tmpdir.join('script.py')
+        script.write('import sys\nprint(sys.argv[1:])\nprint(x)\n')
+        manager = Manager(AppForTesting(), with_default_commands=False)
+        manager.add_command('shell', Shell(make_context=lambda: dict(x='hello')))
+
+        code = run('manage.py shell --timing %s one --two' % script, manager.run)
+        out, err = capsys.readouterr()
+        assert code == 0
+        assert "['one', '--two']" in out
+        assert 'hello' in out
+        assert '3: print(x)' in err
+
+
+class RecordsCommand(Command):
+
+    output_fields = ('name', 'value')
+
+    def run(self):
+        for i in range(3):
+            yield ('row%d' % i, i)
+
+
+class TestOutput:
+
+    def setup(self):
+
+        self.app = Flask(__name__)
+        self.app.config['TESTING'] = True
+
+        @self.app.route('/')
+        def index():
+            return 'index'
+
+    def test_text(self, capsys):
+
+        manager = Manager(self.app, with_default_commands=False)
+        manager.add_command('records', RecordsCommand())
+
+        code = run('manage.py records', manager.run)
+        out, err = capsys.readouterr()
+        assert code == 0
+        assert out == 'row0  0\nrow1  1\nrow2  2\n'
+
+    def test_command_option_with_global_dest(self, capsys, tmpdir):
+
+        manager = Manager(self.app, with_default_commands=False)
+        manager.add_command('records', RecordsCommand())
+
+        @manager.option('-o', '--output', dest='output_file')
+        def export(output_file):
+            print('exporting to %s' % output_file)
+
+        code = run('manage.py export -o %s' % tmpdir.join('out.txt'), manager.run)
+        out, err = capsys.readouterr()
+        assert code == 0
+        assert out == 'exporting to %s\n' % tmpdir.join('out.txt')
+
+    def test_global_options_only_when_used(self, capsys):
+
+        manager = Manager(self.app, with_default_commands=False)
+        manager.add_command('simple', SimpleCommand())
+        code = run('manage.py -?', manager.run)
+        out, err = capsys.readouterr()
+        assert code == 0
+        assert '--timeout' in out
+        for option in ('--output-format', '--refresh-cache', '--force',
+                       '--for-each-config', '--config-jobs'):
+            assert option not in out
+
+        manager.add_command('records', RecordsCommand())
+        run('manage.py -?', manager.run)
+        out, err = capsys.readouterr()
+        assert '--output-format' in out
+
+    def test_json_formats(self, capsys):
+
+        import json
+
+        manager = Manager(self.app, with_default_commands=False)
+        manager.add_command('records', RecordsCommand())
+
+        code = run('manage.py --output-format json records', manager.run)
+        out, err = capsys.readouterr()
+        assert code == 0
+        assert json.loads(out)[2] == {'name': 'row2', 'value': 2}
+
+        code = run('manage.py --output-format jsonl records', manager.run)
+        out, err = capsys.readouterr()
+        assert [json.loads(line)['value'] for line in out.splitlines()] == [0, 1, 2]
+
+    def test_csv_to_gzip_file(self, tmpdir):
+
+        import gzip
+
+        manager = Manager(self.app, with_default_commands=False)
+        manager.add_command('records', RecordsCommand())
+        target = tmpdir.join('out.csv.gz')
+
+        code = run('manage.py --output-format csv --output %s records' % target,
+                   manager.run)
+        assert code == 0
+        with gzip.open(str(target), 'rb') as f:
+            assert f.read() == b'name,value\nrow0,0\nrow1,1\nrow2,2\n'
+
+    def test_csv_dict_records(self, capsys):
+
+        manager = Manager(self.app, with_default_commands=False)
+
+        @manager.command
+        def people():
+            yield {'name': 'ann', 'age': 31}
+            yield {'name': 'bob', 'age': 42, 'email': 'bob@example.com'}
+
+        with raises(InvalidCommand):
+            run('manage.py --output-format csv people', manager.run)
+        capsys.readouterr()
+
+        manager._commands['people'].output_fields = ('name', 'age', 'email')
+        code = run('manage.py --output-format csv people', manager.run)
+        out, err = capsys.readouterr()
+        assert code == 0
+        assert out.splitlines() == ['name,age,email', 'ann,31,', 'bob,42,bob@example.com']
+
+    def test_show_urls(self, capsys):
+
+        manager = Manager(self.app, with_default_commands=False)
+        manager.add_command('urls', ShowUrls())
+
+        code = run('manage.py urls', manager.run)
+        out, err = capsys.readouterr()
+        assert code == 0
+        assert out.splitlines()[0].split() == ['Rule', 'Endpoint']
+        assert re.search(r'^/\s+index\s*$', out, re.M)
+
+        code = run('manage.py --output-format tsv urls /', manager.run)
+        out, err = capsys.readouterr()
+        assert out.splitlines() == ['rule\tendpoint\targuments', '/\tindex\t{}']
+
+        code = run('manage.py --output-format jsonl urls', manager.run)
+        out, err = capsys.readouterr()
+        assert '{"rule": "/", "endpoint": "index", "arguments": null}' in out.splitlines()
+
+        with raises(InvalidCommand):
+            run('manage.py urls /missing', manager.run)
+
+
+def _count_in_worker(worker, n):
+    for _ in worker.iterate(range(n)):
+        pass
+
+
+class TestProgress:
+
+    def test_iterate(self):
+
+        stream = StringIO()
+        command = Command()
+        items = list(command.progress(range(100000), label='items',
+                                      stream=stream, log_interval=0))
+        assert len(items) == 100000
+        lines = stream.getvalue().splitlines()
+        assert lines[-1].startswith('items: 100000/100000 (100.0%) in 0:00:')
+        assert all(line.startswith('items: ') for line in lines)
+
+    def test_update_without_total(self):
+
+        stream = StringIO()
+        with Progress(stream=stream, log_interval=3600) as progress:
+            for _ in range(1000):
+                progress.update()
+            progress.update(500)
+        assert progress.done == 1500
+        assert stream.getvalue().startswith('1500 in ')
+
+    def test_workers(self):
+
+        import multiprocessing
+
+        stream = StringIO()
+        with Progress(total=3000, stream=stream, shared=True) as progress:
+            workers = [multiprocessing.Process(target=_count_in_worker,
+                                               args=(progress.worker(), 1000))
+                       for _ in range(3)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        assert progress.done == 3000
+        assert '3000/3000' in stream.getvalue()
+
+
+class SquaresCommand(BatchCommand):
+
+    chunk_size = 10
+
+    def __init__(self, fail_at=None):
+        self.fail_at = fail_at
+        self.processed = []
+        self.commits = 0
+
+    def get_source(self):
+        return range(45)
+
+    def process(self, items):
+        for item in items:
+            if item == self.fail_at:
+                raise RuntimeError('crash')
+        self.processed.extend(items)
+
+    def commit(self):
+        self.commits += 1
+
+
+class FakeQuery(object):
+
+    def __init__(self, rows, low=None, size=None):
+        self.rows, self.low, self.size = rows, low, size
+
+    def filter(self, low):
+        return FakeQuery(self.rows, low, self.size)
+
+    def order_by(self, column):
+        return self
+
+    def limit(self, size):
+        return FakeQuery(self.rows, self.low, size)
+
+    def all(self):
+        rows = sorted(r for r in self.rows if self.low is None or r > self.low)
+        return rows[:self.size]
+
+
+class FakeColumn(object):
+
+    name = 'id'
+
+    def __gt__(self, other):
+        return other
+
+
+class TestBatch:
+
+    def test_resume(self, tmpdir, monkeypatch):
+
+        monkeypatch.setenv('FLASK_SCRIPT_STATE_DIR', str(tmpdir))
+        app = Flask(__name__)
+
+        command = SquaresCommand(fail_at=23)
+        with raises(RuntimeError):
+            command(app, chunk_size=10, resume=False, checkpoint_file=None)
+        assert command.processed == list(range(20))
+        assert len(tmpdir.join('checkpoints').listdir()) == 1
+
+        command = SquaresCommand()
+        command(app, chunk_size=10, resume=True, checkpoint_file=None)
+        assert command.processed == list(range(20, 45))
+        assert command.commits == 3
+        assert tmpdir.join('checkpoints').listdir() == []
+
+    def test_file_source(self, tmpdir):
+
+        data = tmpdir.join('data.txt')
+        data.write('a\nb\nc\nd\ne\n')
+        chunks = list(FileSource(str(data)).chunks(2))
+        assert [items for items, _ in chunks] == [['a', 'b'], ['c', 'd'], ['e']]
+        resumed = list(FileSource(str(data)).chunks(2, chunks[0][1]))
+        assert [items for items, _ in resumed] == [['c', 'd'], ['e']]
+
+    def test_keyset_source(self):
+
+        source = KeysetSource(FakeQuery([5, 1, 3, 2, 4]), FakeColumn(),
+                              key=lambda row: row)
+        assert list(source.chunks(2)) == [([1, 2], 2), ([3, 4], 4), ([5], 5)]
+        assert list(source.chunks(2, 3)) == [([4, 5], 5)]
+
+
+class TestLock:
+
+    def setup(self):
+
+        self.app = Flask(__name__)
+        self.app.config['TESTING'] = True
+        self.calls = []
+
+    def make_manager(self, **kwargs):
+
+        manager = Manager(self.app, with_default_commands=False)
+
+        @manager.command(**kwargs)
+        def aggregate():
+            self.calls.append(1)
+
+        return manager
+
+    def test_runs_and_releases(self, tmpdir, monkeypatch):
+
+        monkeypatch.setenv('FLASK_SCRIPT_STATE_DIR', str(tmpdir))
+        manager = self.make_manager(lock=True)
+        assert run('manage.py aggregate', manager.run) == 0
+        assert run('manage.py aggregate', manager.run) == 0
+        assert self.calls == [1, 1]
+
+    def test_skip(self, tmpdir, monkeypatch, capsys):
+
+        monkeypatch.setenv('FLASK_SCRIPT_STATE_DIR', str(tmpdir))
+        monkeypatch.setattr(sys, 'argv', ['manage.py'])
+        held = CommandLock(lock_path(['aggregate']))
+        assert held.acquire()
+        try:
+            manager = self.make_manager(lock=True)
+            code = run('manage.py aggregate', manager.run)
+            out, err = capsys.readouterr()
+            assert code == 0
+            assert 'already running' in err
+            assert self.calls == []
+
+            manager = self.make_manager(lock='fail')
+            assert run('manage.py aggregate', manager.run) == 1
+
+            manager = self.make_manager(lock='wait', lock_timeout=0.2)
+            assert run('manage.py aggregate', manager.run) == 1
+            assert self.calls == []
+        finally:
+            held.release()
+
+    def test_lock_attribute(self, tmpdir, monkeypatch):
+
+        monkeypatch.setenv('FLASK_SCRIPT_STATE_DIR', str(tmpdir))
+        monkeypatch.setattr(sys, 'argv', ['manage.py'])
+        command = SimpleCommand()
+        command.lock = 'fail'
+        manager = Manager(self.app, with_default_commands=False)
+        manager.add_command('simple', command)
+        held = CommandLock(lock_path(['simple']))
+        assert held.acquire()
+        try:
+            assert run('manage.py simple', manager.run) == 1
+        finally:
+            held.release()
+        assert run('manage.py simple', manager.run) == 0
+
+
+class TestScheduler:
+
+    def test_cron(self):
+
+        import time
+        import datetime
+
+        def stamp(*args):
+            return time.mktime(datetime.datetime(*args).timetuple())
+
+        schedule = CronSchedule('15 3 * * *')
+        assert schedule.next(stamp(2024, 1, 1, 3, 15)) == stamp(2024, 1, 2, 3, 15)
+        assert schedule.next(stamp(2024, 1, 1, 1, 0)) == stamp(2024, 1, 1, 3, 15)
+
+        schedule = CronSchedule('*/20 9-17 * * 1-5')
+        # Saturday 2024-01-06 -> Monday
+        assert schedule.next(stamp(2024, 1, 6, 12, 0)) == stamp(2024, 1, 8, 9, 0)
+        assert schedule.next(stamp(2024, 1, 8, 9, 0)) == stamp(2024, 1, 8, 9, 20)
+
+        assert CronSchedule('@monthly').next(stamp(2024, 1, 31, 12, 0)) == stamp(2024, 2, 1)
+
+        with raises(ValueError):
+            CronSchedule('61 * * * *')
+
+    def test_handle_with_app(self, capsys):
+
+        calls = []
+
+        def create_app():
+            calls.append(1)
+            return Flask(__name__)
+
+        manager = Manager(create_app)
+        manager.add_command('simple', SimpleCommand())
+        app = Flask(__name__)
+        manager.handle('manage.py', ['simple'], app=app)
+        out, err = capsys.readouterr()
+        assert 'OK' in out
+        assert calls == []
+
+    def test_runs_and_misfires(self):
+
+        ran = []
+
+        def dispatch(args):
+            ran.append(args)
+
+        job = Job('simple --flag', every=10)
+        skipped = Job('late', every=10, grace=5)
+        caught_up = Job('catchup', every=10, misfire='all')
+        messages = []
+        scheduler = JobScheduler([job, skipped, caught_up], dispatch,
+                                 workers=1, log=messages.append)
+        now = job.next_run
+        skipped.next_run = now - 27
+        caught_up.next_run = now - 25
+
+        scheduler.tick(now - 30)
+        assert ran == []
+        scheduler.tick(now)
+        scheduler.wait_idle()
+        scheduler.shutdown()
+
+        assert ran.count(['simple', '--flag']) == 1
+        assert ['late'] not in ran
+        assert ran.count(['catchup']) == 3
+        assert skipped.missed == 3
+        assert job.next_run == now + 10
+
+
+class TestJobQueue:
+
+    def setup(self):
+
+        self.app = Flask(__name__)
+        self.app.config['TESTING'] = True
+
+    def test_claim_order_and_limits(self, tmpdir):
+
+        queue = JobQueue(str(tmpdir.join('queue.sqlite')))
+        low = queue.enqueue(['report', '--month', '1'])
+        high = queue.enqueue(['report', '--month', '2'], priority=5)
+        other = queue.enqueue(['cleanup'])
+        later = queue.enqueue(['cleanup'], delay=60)
+
+        job = queue.claim('w1', limits={'report': 1})
+        assert job['id'] == high
+        assert job['args'] == ['report', '--month', '2']
+        job = queue.claim('w2', limits={'report': 1})
+        assert job['id'] == other
+        assert queue.claim('w3', limits={'report': 1}) is None
+
+        queue.complete(queue.get(high), {'rows': 3})
+        assert queue.claim('w1', limits={'report': 1})['id'] == low
+        assert queue.get(high)['result'] == '{"rows": 3}'
+        assert queue.get(later)['status'] == 'queued'
+
+    def test_retry_and_lease_expiry(self, tmpdir):
+
+        queue = JobQueue(str(tmpdir.join('queue.sqlite')))
+        job_id = queue.enqueue(['flaky'], max_attempts=2)
+
+        job = queue.claim('w1')
+        queue.fail(job, 'boom', backoff=0)
+        job = queue.claim('w1', lease=-1)
+        assert job['attempts'] == 2
+        # the lease expired and no attempts are left
+        assert queue.claim('w2') is None
+        assert queue.get(job_id)['status'] == 'failed'
+        assert queue.get(job_id)['error'] == 'lease expired'
+
+    def test_lost_lease(self, tmpdir):
+
+        queue = JobQueue(str(tmpdir.join('queue.sqlite')))
+        job_id = queue.enqueue(['slow'])
+        stale = queue.claim('w1', lease=-1)
+        job = queue.claim('w2')
+        assert job['id'] == job_id
+        assert not queue.extend(job_id, 'w1')
+        assert not queue.complete(stale)
+        assert not queue.fail(stale, 'boom')
+        assert queue.get(job_id)['status'] == 'running'
+        assert queue.complete(job, 'ok')
+        assert queue.get(job_id)['result'] == '"ok"'
+
+        # the worker stops renewing, and recording, a job taken over
+        job_id = queue.enqueue(['slow'])
+        job = queue.claim('w1')
+
+        def dispatch(args):
+            queue.db.execute("UPDATE jobs SET worker = 'w2' WHERE id = ?", (job_id,))
+            time.sleep(0.2)
+
+        renewer = _LeaseRenewer(queue, 'w1', 0.06)
+        try:
+            outcome = Worker(lease=0.06).run_job(queue, job, dispatch, renewer)
+        finally:
+            renewer.stop()
+        assert outcome == 'lease lost, outcome discarded'
+        assert queue.get(job_id)['status'] == 'running'
+        assert queue.get(job_id)['worker'] == 'w2'
+
+    def test_worker(self, tmpdir, capsys):
+
+        calls = []
+        manager = Manager(self.app, with_default_commands=False)
+
+        @manager.command
+        def greet(name):
+            calls.append(name)
+            if name == 'bad':
+                raise RuntimeError('bad name')
+
+        manager.add_command('enqueue', Enqueue())
+        manager.add_command('worker', Worker(backoff=0))
+        manager.add_command('jobs', Jobs())
+        path = tmpdir.join('queue.sqlite')
+
+        assert run('manage.py enqueue --queue %s greet world' % path, manager.run) == 0
+        assert run('manage.py enqueue --queue %s --max-attempts 2 greet bad' % path,
+                   manager.run) == 0
+        out, err = capsys.readouterr()
+        assert out.split() == ['1', '2']
+
+        assert run('manage.py worker --queue %s --burst -c 2' % path, manager.run) == 0
+        assert sorted(calls) == ['bad', 'bad', 'world']
+
+        run('manage.py --output-format jsonl jobs --queue %s' % path, manager.run)
+        out, err = capsys.readouterr()
+        import json
+        jobs = dict((job['id'], job) for job in map(json.loads, out.splitlines()))
+        assert jobs[1]['status'] == 'done'
+        assert jobs[2]['status'] == 'failed'
+        assert jobs[2]['attempts'] == 2
+        assert jobs[2]['error'] == 'RuntimeError: bad name'
+
+        with raises(InvalidCommand):
+            run('manage.py enqueue --queue %s gret world' % path, manager.run)
+        run('manage.py --output-format jsonl jobs --queue %s' % path, manager.run)
+        out, err = capsys.readouterr()
+        assert len(out.splitlines()) == 2
+
+
+class TestCache:
+
+    def setup(self):
+
+        self.app = Flask(__name__)
+        self.app.config['TESTING'] = True
+        self.calls = []
+
+    def make_manager(self, tmpdir):
+
+        self.app.config['RESULT_CACHE_DIR'] = str(tmpdir.join('cache'))
+        manager = Manager(self.app, with_default_commands=False)
+
+        @manager.command(cache=60)
+        @manager.option('-n', dest='n', type=int)
+        def square(n):
+            self.calls.append(n)
+            print('square of %d is %d' % (n, n * n))
+
+        @manager.command(cache=60, cache_config=('GREETING',))
+        def greet():
+            self.calls.append('greet')
+            print(self.app.config.get('GREETING', 'hello'))
+
+        @manager.command(cache=60)
+        def fail():
+            self.calls.append('fail')
+            return 2
+
+        @manager.command(cache=60)
+        def records():
+            self.calls.append('records')
+            for i in range(3):
+                yield (i, i * i)
+
+        return manager
+
+    def test_replays_output(self, tmpdir, capsys):
+
+        manager = self.make_manager(tmpdir)
+        for i in range(2):
+            assert run('manage.py square -n 3', manager.run) == 0
+            out, err = capsys.readouterr()
+            assert out == 'square of 3 is 9\n'
+        assert self.calls == [3]
+
+        run('manage.py square -n 4', manager.run)
+        run('manage.py --refresh-cache square -n 3', manager.run)
+        assert self.calls == [3, 4, 3]
+
+    def test_config_key(self, tmpdir, capsys):
+
+        manager = self.make_manager(tmpdir)
+        run('manage.py greet', manager.run)
+        run('manage.py greet', manager.run)
+        self.app.config['GREETING'] = 'hi'
+        run('manage.py greet', manager.run)
+        out, err = capsys.readouterr()
+        assert out.split() == ['hello', 'hello', 'hi']
+        assert self.calls == ['greet', 'greet']
+
+    def test_failures_not_cached(self, tmpdir):
+
+        manager = self.make_manager(tmpdir)
+        assert run('manage.py fail', manager.run) == 2
+        assert run('manage.py fail', manager.run) == 2
+        assert self.calls == ['fail', 'fail']
+
+    def test_manager_options_key(self, tmpdir, capsys):
+
+        def create_app(config=None):
+            app = Flask(__name__)
+            app.config['RESULT_CACHE_DIR'] = str(tmpdir.join('cache'))
+            app.config['TENANT'] = config
+            return app
+
+        manager = Manager(create_app, with_default_commands=False)
+        manager.add_option('-c', dest='config', required=False)
+
+        @manager.command(cache=60)
+        def report():
+            from flask import current_app
+            print('tenant %s' % current_app.config['TENANT'])
+
+        for config in ('a.cfg', 'b.cfg', 'a.cfg'):
+            run('manage.py -c %s report' % config, manager.run)
+        out, err = capsys.readouterr()
+        assert out.splitlines() == ['tenant a.cfg', 'tenant b.cfg', 'tenant a.cfg']
+
+    def test_records(self, tmpdir, capsys):
+
+        manager = self.make_manager(tmpdir)
+        run('manage.py --output-format csv records', manager.run)
+        first, err = capsys.readouterr()
+        run('manage.py --output-format csv records', manager.run)
+        second, err = capsys.readouterr()
+        assert first.split() == ['0,0', '1,1', '2,4']
+        assert second == first
+        assert self.calls == ['records']
+
+    def test_evicts_least_recently_used(self, tmpdir):
+
+        entry = Entry(time.time() + 60, 'x' * 1000, '')
+        cache = ResultCache(str(tmpdir), max_size=5000)
+        cache.set('a', entry)
+        cache.set('b', entry)
+        os.utime(cache.path('a'), (1, 1))
+        cache.set('c', entry)
+        cache.set('d', entry)
+        cache.set('e', entry)
+        assert cache.get('a') is None
+        assert cache.get('e').stdout == entry.stdout
+
+        expired = Entry(time.time() - 1, '', '')
+        cache.set('f', expired)
+        assert cache.get('f') is None
+
+
+class TestIncremental:
+
+    def setup(self):
+
+        self.app = Flask(__name__)
+        self.app.config['TESTING'] = True
+        self.calls = []
+        self.fail = False
+
+    def make_manager(self, tmpdir, monkeypatch):
+
+        monkeypatch.setenv('FLASK_SCRIPT_STATE_DIR', str(tmpdir.join('state')))
+        monkeypatch.setattr(sys, 'argv', ['manage.py'])
+        src = tmpdir.mkdir('src')
+        src.join('a.txt').write('a')
+        src.join('b.txt').write('b')
+        out = tmpdir.join('out.txt')
+
+        manager = Manager(self.app, with_default_commands=False)
+
+        @manager.command(inputs=[str(src.join('*.txt'))], outputs=[str(out)])
+        def build():
+            self.calls.append('build')
+            if self.fail:
+                return 1
+            out.write(''.join(f.read() for f in sorted(src.listdir())))
+
+        return manager, src, out
+
+    def test_skips_when_up_to_date(self, tmpdir, monkeypatch, capsys):
+
+        manager, src, out = self.make_manager(tmpdir, monkeypatch)
+        run('manage.py build', manager.run)
+        run('manage.py build', manager.run)
+        out_, err = capsys.readouterr()
+        assert 'build is up to date' in err
+        assert self.calls == ['build']
+
+        run('manage.py --force build', manager.run)
+        assert self.calls == ['build', 'build']
+
+    def test_changed_inputs(self, tmpdir, monkeypatch):
+
+        manager, src, out = self.make_manager(tmpdir, monkeypatch)
+        run('manage.py build', manager.run)
+        future = time.time() + 10
+
+        # touched but unchanged: the recorded digests match
+        os.utime(str(src.join('a.txt')), (future, future))
+        run('manage.py build', manager.run)
+        assert self.calls == ['build']
+
+        src.join('a.txt').write('A')
+        os.utime(str(src.join('a.txt')), (future + 1, future + 1))
+        run('manage.py build', manager.run)
+        assert out.read() == 'Ab'
+
+        src.join('c.txt').write('c')
+        os.utime(str(out), (future + 2, future + 2))
+        run('manage.py build', manager.run)
+        assert out.read() == 'Abc'
+
+        out.remove()
+        run('manage.py build', manager.run)
+        assert self.calls == ['build'] * 4
+
+    def test_failed_build_not_recorded(self, tmpdir, monkeypatch):
+
+        manager, src, out = self.make_manager(tmpdir, monkeypatch)
+        assert run('manage.py build', manager.run) == 0
+        future = time.time() + 10
+        src.join('a.txt').write('A')
+        os.utime(str(src.join('a.txt')), (future, future))
+        self.fail = True
+        assert run('manage.py build', manager.run) == 1
+        self.fail = False
+        assert run('manage.py build', manager.run) == 0
+        assert self.calls == ['build'] * 3
+        assert out.read() == 'Ab'
+
+    def test_expand(self, tmpdir):
+
+        tmpdir.mkdir('d').join('x.po').write('')
+        tmpdir.join('d', 'y.po').write('')
+        tmpdir.join('z.txt').write('')
+        files, missing = expand([str(tmpdir.join('d')), 'paths', 'nope*'],
+                                {'paths': [str(tmpdir.join('z.txt'))]})
+        assert files == sorted([str(tmpdir.join('d', 'x.po')),
+                                str(tmpdir.join('d', 'y.po')),
+                                str(tmpdir.join('z.txt'))])
+        assert missing == ['nope*']
+
+
+class TestGraph:
+
+    def setup(self):
+
+        self.app = Flask(__name__)
+        self.app.config['TESTING'] = True
+        self.calls = []
+
+    def make_manager(self):
+
+        manager = Manager(self.app, with_default_commands=False)
+        db = Manager(with_default_commands=False)
+
+        @db.option('-r', dest='revision', default='head')
+        def upgrade(revision):
+            self.calls.append(('upgrade', revision))
+
+        manager.add_command('db', db)
+
+        @manager.command(requires=['db upgrade'])
+        def assets():
+            time.sleep(0.05)
+            self.calls.append('assets')
+
+        @manager.command(requires=['db upgrade -r 42', 'db upgrade'])
+        def index():
+            self.calls.append('index')
+
+        @manager.command(requires=['assets', 'index'])
+        def deploy():
+            self.calls.append('deploy')
+
+        @manager.command(requires=['missing'])
+        def broken():
+            pass
+
+        @manager.command(requires=['cycle'])
+        def cycle():
+            pass
+
+        @manager.command
+        def fail():
+            raise RuntimeError('failed')
+
+        @manager.command(requires=['fail'])
+        def after_fail():
+            self.calls.append('after_fail')
+
+        manager.add_command('run-graph', RunGraph())
+        return manager
+
+    def test_resolve(self):
+
+        graph = CommandGraph(self.make_manager())
+        graph.add('deploy')
+        assert list(graph.nodes) == [('db', 'upgrade'), ('assets',),
+                                     ('db', 'upgrade', '-r', '42'), ('index',),
+                                     ('deploy',)]
+        assert graph.nodes[('deploy',)] == [('assets',), ('index',)]
+
+        with raises(InvalidCommand):
+            CommandGraph(self.make_manager()).add('broken')
+        with raises(InvalidCommand):
+            CommandGraph(self.make_manager()).add('cycle')
+        with raises(InvalidCommand):
+            CommandGraph(self.make_manager()).add('db')
+
+    def test_run(self, capsys):
+
+        manager = self.make_manager()
+        assert run('manage.py run-graph -j 3 deploy index', manager.run) == 0
+        assert sorted(self.calls[:2]) == [('upgrade', '42'), ('upgrade', 'head')]
+        assert sorted(self.calls[2:4]) == ['assets', 'index']
+        assert self.calls[4:] == ['deploy']
+        out, err = capsys.readouterr()
+        assert 'Critical path' in err
+        assert 'db upgrade (' in err
+
+    def test_failure(self, capsys):
+
+        manager = self.make_manager()
+        assert run('manage.py run-graph after_fail', manager.run) == 1
+        out, err = capsys.readouterr()
+        assert 'Not run: after_fail' in err
+        assert self.calls == []
+
+    def test_critical_path(self):
+
+        graph = CommandGraph(self.make_manager())
+        graph.add('deploy')
+        graph.durations = {('db', 'upgrade'): 1, ('assets',): 5,
+                           ('db', 'upgrade', '-r', '42'): 2, ('index',): 1,
+                           ('deploy',): 1}
+        path, total = graph.critical_path()
+        assert path == [('db', 'upgrade'), ('assets',), ('deploy',)]
+        assert total == 7
+
+
+class TestLimits:
+
+    def setup(self):
+
+        self.app = Flask(__name__)
+        self.app.config['TESTING'] = True
+
+    def test_parse_size(self):
+
+        assert parse_size('512') == 512
+        assert parse_size('2k') == 2048
+        assert parse_size('1.5G') == 3 << 29
+        assert parse_size('64MiB') == 64 << 20
+        with raises(ValueError):
+            parse_size('lots')
+
+    def test_timeout(self, capsys):
+
+        manager = Manager(self.app, with_default_commands=False)
+
+        @manager.command(timeout=0.1)
+        def sleepy():
+            time.sleep(5)
+            print('woke up')
+
+        started = time.time()
+        assert run('manage.py sleepy', manager.run) == 1
+        assert time.time() - started < 2
+        out, err = capsys.readouterr()
+        assert 'Timeout of 0.1s exceeded' in err
+        assert 'woke up' not in out
+
+    def test_cli_overrides(self, capsys):
+
+        manager = Manager(self.app, with_default_commands=False)
+
+        @manager.command(timeout=0.01)
+        def nap():
+            time.sleep(0.1)
+            print('done')
+
+        assert run('manage.py --timeout 5 nap', manager.run) == 0
+        out, err = capsys.readouterr()
+        assert out == 'done\n'
+
+    def test_open_files(self):
+
+        files = []
+        with raises(LimitExceeded):
+            with Limits(open_files=50):
+                for i in range(100):
+                    files.append(open(os.devnull))
+        for f in files:
+            f.close()
+        # the limit is lifted again
+        files = [open(os.devnull) for i in range(100)]
+        for f in files:
+            f.close()
+
+
+def manifest_greet(name, shout=False):
+    """Greets without an app"""
+    print(('hello %s' % name).upper() if shout else 'hello %s' % name)
+
+
+class TestManifest:
+
+    def setup(self):
+
+        self.app = Flask(__name__)
+        self.app.config['TESTING'] = True
+
+    def make_manager(self, monkeypatch):
+
+        manager = Manager(self.app, with_default_commands=False)
+        manager.command(needs_app=False)(manifest_greet)
+        manager.add_command('simple', SimpleCommand())
+        db = Manager(usage='database', with_default_commands=False)
+        db.add_command('simple', CommandWithOptions())
+        manager.add_command('db', db)
+        manager.add_command('export-manifest', ExportManifest())
+        monkeypatch.setattr(sys.modules[__name__], 'manifest_manager', manager,
+                            raising=False)
+        return manager
+
+    def test_build(self, monkeypatch):
+
+        manifest = build_manifest(self.make_manager(monkeypatch), 'manage.py')
+        assert manifest['manager'] == {'location': '%s:manifest_manager' % __name__}
+        tree = manifest['tree']
+        assert list(tree['commands']) == ['manifest_greet', 'simple', 'db',
+                                          'export-manifest']
+        greet = tree['commands']['manifest_greet']
+        assert greet['location'] == '%s:manifest_greet' % __name__
+        assert greet['direct']
+        assert greet['help'] == 'Greets without an app'
+        assert not tree['commands']['simple']['direct']
+        options = tree['commands']['db']['commands']['simple']['options']
+        assert ['-n', '--name'] in [option['flags'] for option in options]
+
+    def test_launcher(self, tmpdir, monkeypatch, capsys):
+
+        manager = self.make_manager(monkeypatch)
+        path = str(tmpdir.join('manage.json'))
+        assert run('manage.py export-manifest %s' % path, manager.run) == 0
+        capsys.readouterr()
+
+        # run directly, without the manager
+        monkeypatch.setattr(manager, 'handle', None)
+        launcher.main(path, ['manifest_greet', 'bob', '--shout'])
+        out, err = capsys.readouterr()
+        assert out == 'HELLO BOB\n'
+
+        with raises(SystemExit):
+            launcher.main(path, ['db', 'simpel'])
+        out, err = capsys.readouterr()
+        assert "invalid choice: 'simpel'" in err
+
+        monkeypatch.undo()
+        self.make_manager(monkeypatch)
+        assert launcher.main(path, ['db', 'simple', '-n', 'Joe']) is None
+        out, err = capsys.readouterr()
+        assert 'Joe' in out
+
+    def test_write_launcher(self, tmpdir):
+
+        path = str(tmpdir.join('launch'))
+        write_launcher(path, str(tmpdir.join('manage.json')))
+        source = open(path).read()
+        compile(source, path, 'exec')
+        assert "'manage.json'" in source
+        assert 'import flask' not in source
+
+
+class TestPipeline:
+
+    def setup(self):
+
+        self.app = Flask(__name__)
+        self.app.config['TESTING'] = True
+        self.loaded = []
+
+    def make_manager(self):
+
+        manager = Manager(self.app, with_default_commands=False)
+
+        @manager.option('--since', dest='since', type=int, default=0)
+        def extract(since):
+            for i in range(since, since + 250):
+                yield {'id': i}
+
+        @manager.command(input_records=True)
+        def transform(records, factor='2'):
+            for record in records:
+                if record['id'] < 0:
+                    raise ValueError('negative id')
+                record['value'] = record['id'] * int(factor)
+                yield record
+
+        @manager.command(input_records=True)
+        def load(records):
+            for record in records:
+                self.loaded.append(record['value'])
+
+        manager.add_command('pipe', Pipe())
+        return manager
+
+    def test_threads(self, capsys):
+
+        manager = self.make_manager()
+        manager.handle('manage.py', ['pipe', 'extract --since 10',
+                                     'transform -f 3', 'load'])
+        assert self.loaded == [i * 3 for i in range(10, 260)]
+
+        run('manage.py --output-format csv pipe extract transform', manager.run)
+        out, err = capsys.readouterr()
+        lines = out.split()
+        assert len(lines) == 251
+        assert lines[:2] == ['id,value', '0,0']
+
+    def test_processes(self, capsys):
+
+        manager = self.make_manager()
+        run('manage.py --output-format jsonl pipe --processes -b 7 extract transform',
+            manager.run)
+        out, err = capsys.readouterr()
+        assert len(out.splitlines()) == 250
+        assert out.splitlines()[-1] == '{"id": 249, "value": 498}'
+
+    def test_failure(self, capsys):
+
+        manager = self.make_manager()
+        with raises(StageFailed):
+            manager.handle('manage.py', ['pipe', 'extract --since -5',
+                                         'transform', 'load'])
+        with raises(InvalidCommand):
+            run('manage.py pipe extract extract', manager.run)
+
+    def test_stdin(self, capsys, monkeypatch):
+
+        manager = self.make_manager()
+        monkeypatch.setattr(sys, 'stdin', StringIO('{"id": 1}\n\n{"id": 2}\n'))
+        run('manage.py --output-format jsonl transform', manager.run)
+        out, err = capsys.readouterr()
+        assert out.splitlines() == ['{"id": 1, "value": 2}', '{"id": 2, "value": 4}']
+
+
+class TestFanOut:
+
+    def make_manager(self):
+
+        def create_app(config=None):
+            app = Flask(__name__)
+            if config:
+                app.config.from_pyfile(config)
+            return app
+
+        manager = Manager(create_app, with_default_commands=False)
+        manager.add_option('-c', '--config', dest='config', required=False)
+
+        @manager.command
+        def migrate():
+            from flask import current_app
+            print('migrating %s' % current_app.config['TENANT'])
+            if current_app.config['TENANT'] == 'bad':
+                return 3
+
+        return manager
+
+    def write_configs(self, tmpdir, *names):
+
+        for name in names:
+            tmpdir.join('%s.cfg' % name).write('TENANT = %r\n' % name)
+
+    def test_runs_each_config(self, tmpdir, capsys):
+
+        self.write_configs(tmpdir, 'one', 'two', 'three')
+        manager = self.make_manager()
+        code = run('manage.py --for-each-config %s --config-jobs 2 migrate' %
+                   tmpdir.join('*.cfg'), manager.run)
+        out, err = capsys.readouterr()
+        assert code == 0
+        for name in ('one', 'two', 'three'):
+            assert '==> %s (ok,' % tmpdir.join('%s.cfg' % name) in out
+            assert 'migrating %s\n' % name in out
+        assert '3 of 3 configurations succeeded' in err
+
+    def test_failure_and_list_file(self, tmpdir, capsys):
+
+        self.write_configs(tmpdir, 'good', 'bad')
+        tmpdir.join('list').write('# tenants\n%s\n%s\n' % (
+            tmpdir.join('good.cfg'), tmpdir.join('bad.cfg')))
+        manager = self.make_manager()
+        code = run('manage.py --for-each-config @%s migrate' % tmpdir.join('list'),
+                   manager.run)
+        out, err = capsys.readouterr()
+        assert code == 1
+        assert 'failed: %s (exit 3)' % tmpdir.join('bad.cfg') in err
+
+    def test_expand_configs(self, tmpdir):
+
+        with raises(InvalidCommand):
+            expand_configs(str(tmpdir.join('*.cfg')))